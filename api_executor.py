@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Ejecución común de todas las peticiones a las APIs de Drive y YouTube.
+
+Los servicios del pool se construyen con `build(requestBuilder=...)` y una
+subclase de HttpRequest cuyo execute() pasa por ApiExecutor, así que cada
+`.execute()` de la aplicación (y de folder_cache, drive_index, image_dedup...)
+obtiene, sin cambiar la llamada:
+
+- reintentos con espera exponencial con jitter ante 429 y errores de límite de
+  cuota (rateLimitExceeded) en cualquier petición, respetando la cabecera
+  Retry-After; ante 5xx y errores de red solo en las lecturas y subidas
+  resumables (que continúan donde se quedaron): un 500 en files.create o
+  permissions.create puede llegar cuando Drive ya lo ha creado, y repetirlo
+  lo duplicaría;
+- un token bucket por usuario que espacia sus peticiones antes de que Google
+  empiece a rechazarlas, y que tras un 429 pausa todas las de ese usuario; el
+  usuario es la cuenta de Google (`account_identity` en service_pool.py), así
+  que sus sesiones en varios navegadores comparten el límite dentro de cada
+  proceso;
+- coalescencia de lecturas idénticas en curso: si dos pestañas del mismo
+  usuario piden a la vez el mismo listado, solo una llamada llega a Google y
+  ambas reciben la respuesta.
+
+Las peticiones batch de drive_batch y los trozos que envía upload_jobs con
+next_chunk() tienen su propia gestión de errores y no pasan por aquí.
+"""
+import copy
+import email.utils
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from googleapiclient.errors import HttpError
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+def retry_after_seconds(resp):
+    """Segundos que pide esperar la cabecera Retry-After (número o fecha HTTP), o None."""
+    value = resp.get('retry-after') if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate_limited(error):
+    details = getattr(error, 'error_details', None)
+    if not isinstance(details, list):
+        return False
+    return any(isinstance(detail, dict) and detail.get('reason') in RATE_LIMIT_REASONS for detail in details)
+
+
+class TokenBucket(object):
+    """`rate` peticiones por segundo con ráfagas de hasta `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Toma un token y devuelve cuántos segundos hay que esperar para usarlo."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class _Flight(object):
+    """Una lectura en curso y las peticiones idénticas que esperan su resultado."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class ApiExecutor(object):
+    """Reintentos, límite por usuario y coalescencia de las llamadas execute()."""
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=32.0, rate=10.0, burst=20,
+                 coalesce=True, max_users=1024):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate = rate  # 0 desactiva el token bucket
+        self.burst = burst
+        self.coalesce = coalesce
+        self.max_users = max_users
+        self._buckets = OrderedDict()  # usuario -> TokenBucket (LRU)
+        self._flights = {}  # (usuario, URI, cabeceras) -> _Flight
+        self._classes = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.coalesced = 0
+
+    def request_builder(self, user, base=None):
+        """requestBuilder para build(): las peticiones del servicio se ejecutan como `user`."""
+        request_class = self._request_class(base)
+
+        def build_request(*args, **kwargs):
+            request = request_class(*args, **kwargs)
+            request.executor_user = user
+            return request
+        return build_request
+
+    def _request_class(self, base):
+        if base is None:
+            from googleapiclient.http import HttpRequest
+            base = HttpRequest
+        with self._lock:
+            request_class = self._classes.get(base)
+            if request_class is None:
+                request_class = self._classes[base] = _executor_request_class(self, base)
+            return request_class
+
+    def _bucket(self, user):
+        with self._lock:
+            bucket = self._buckets.get(user)
+            if bucket is None:
+                bucket = self._buckets[user] = TokenBucket(self.rate, self.burst)
+                while len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(user)
+            return bucket
+
+    def _throttle(self, user):
+        if not self.rate:
+            return
+        wait = self._bucket(user).reserve()
+        if wait > 0:
+            with self._lock:
+                self.throttled += 1
+                self.throttle_seconds += wait
+            time.sleep(wait)
+
+    def _backoff(self, attempt):
+        # Jitter completo: entre 0 y base * 2^intento, con un máximo
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def execute(self, request, call):
+        """Ejecuta `call()` (el execute() original de `request`) con coalescencia y reintentos."""
+        user = getattr(request, 'executor_user', None)
+        if not (self.coalesce and request.method == 'GET' and request.resumable is None):
+            return self._execute(request, user, call)
+
+        key = (user, request.uri, tuple(sorted((request.headers or {}).items())))
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            result = self._execute(request, user, call)
+            flight.result = result
+            return result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                waiters = flight.waiters
+            if waiters and flight.error is None:
+                # Copia antes de que quien la pidió pueda modificar la respuesta
+                flight.result = copy.deepcopy(flight.result)
+            flight.done.set()
+
+    def _execute(self, request, user, call):
+        import httplib2
+
+        # Lo que se puede repetir sin duplicar nada si no se sabe si Google lo hizo
+        idempotent = request.method == 'GET' or request.resumable is not None
+        attempt = 0
+        with self._lock:
+            self.calls += 1
+        while True:
+            self._throttle(user)
+            try:
+                return call()
+            except HttpError as e:
+                status = e.resp.status
+                # Un límite de cuota rechaza la petición sin hacerla: se repite siempre
+                rate_limited = status == 429 or _rate_limited(e)
+                if not (rate_limited or (idempotent and status in RETRYABLE_STATUSES)):
+                    raise
+                error = e
+                delay = retry_after_seconds(e.resp)
+            except (httplib2.HttpLib2Error, OSError) as e:
+                # Sin respuesta de Google: solo se repite lo que no puede duplicar nada
+                if not idempotent:
+                    raise
+                error = e
+                delay = None
+            attempt += 1
+            if attempt >= self.max_attempts:
+                with self._lock:
+                    self.gave_up += 1
+                raise error
+            delay = self._backoff(attempt) if delay is None else min(delay, self.max_delay)
+            if self.rate and isinstance(error, HttpError) and error.resp.status == 429:
+                # El usuario superó su cuota: sus otras peticiones también esperan
+                self._bucket(user).pause(delay)
+            with self._lock:
+                self.retries += 1
+            print("Google API {} failed ({}), retry {} of {} in {:.1f} s".format(
+                request.methodId, error, attempt, self.max_attempts - 1, delay))
+            time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'gave_up': self.gave_up,
+                'throttled': self.throttled,
+                'throttle_seconds': self.throttle_seconds,
+                'coalesced': self.coalesced,
+                'users': len(self._buckets),
+                'in_flight_reads': len(self._flights),
+            }
+
+
+def _executor_request_class(executor, base):
+    class ExecutorHttpRequest(base):
+        def execute(self, http=None, num_retries=0):
+            parent = super(ExecutorHttpRequest, self)
+            return executor.execute(self, lambda: parent.execute(http=http, num_retries=num_retries))
+
+    return ExecutorHttpRequest
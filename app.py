@@ -1,19 +1,101 @@
 # -*- coding: utf-8 -*-
+import functools
+import hashlib
+import hmac
 import os
 import json
 import io
 import tempfile
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify
-from pynliner import Pynliner
-import google.oauth2.credentials
-import google_auth_oauthlib.flow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Request, g, render_template, request, session, redirect, url_for, jsonify, send_file
+from jinja2 import FileSystemBytecodeCache
 from googleapiclient.errors import HttpError
+from werkzeug.utils import secure_filename
+from render_cache import RenderCache, DiskBackend, context_key
+from service_pool import ServicePool, ACCOUNT_ID_FIELD, account_identity, credentials_identity
+from folder_cache import FolderCache, escape_query_value
+from drive_batch import execute_in_batches
+from drive_index import DriveIndexStore
+from session_store import ServerSideSessionInterface, SQLiteSessionStore, FileSessionStore
+from upload_jobs import JobStore, UploadJobQueue
+from image_pipeline import ImagePipeline, DEFAULT_WIDTH
+from image_dedup import ContentHashIndex, HASH_PROPERTY, content_hash
+from batch_render import BatchRenderer, merge_context
+from metrics import Metrics
+from api_executor import ApiExecutor
+from template_snapshot import dumps_template, loads_template
+from template_cache import TemplateCache
+from live_preview import LivePreview
+from thumbnail_cache import ThumbnailCache
+from private_files import private_directory
+
+# Subidas: tamaño de cada trozo de la subida resumable (múltiplo de 256 KB) y
+# memoria máxima que ocupa un fichero recibido antes de pasar a disco.
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+UPLOAD_SPOOL_MAX_MEMORY = int(os.environ.get('UPLOAD_SPOOL_MAX_MEMORY', 1024 * 1024))
+
+# Subidas en lote: hilos que suben a Drive en paralelo
+UPLOAD_BATCH_WORKERS = int(os.environ.get('UPLOAD_BATCH_WORKERS', 4))
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_BATCH_WORKERS, thread_name_prefix='drive-upload')
+
+# Optimización de imágenes antes de subirlas (requiere Pillow; IMAGE_OPTIMIZE=0 la desactiva)
+image_pipeline = ImagePipeline(
+    workers=int(os.environ.get('IMAGE_WORKERS', 2)),
+    formats=os.environ.get('IMAGE_FORMATS', 'JPEG,PNG').upper().split(','),
+    enabled=os.environ.get('IMAGE_OPTIMIZE', '1') != '0')
+
+# Hashes de las imágenes ya subidas por carpeta, para no volver a subir duplicados (IMAGE_DEDUP=0 lo desactiva)
+IMAGE_DEDUP = os.environ.get('IMAGE_DEDUP', '1') != '0'
+image_index = ContentHashIndex(ttl=int(os.environ.get('IMAGE_INDEX_TTL', 600)))
+
+class SpooledUploadRequest(Request):
+    """
+    Los ficheros del formulario se guardan en memoria hasta UPLOAD_SPOOL_MAX_MEMORY
+    y a partir de ahí en disco, sin copias adicionales.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY, mode='rb+')
 
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'your_super_secret_key_for_dev') # Usar una clave fija para desarrollo o desde variable de entorno
 
+# Plantillas en producción (TEMPLATE_MODE=production, por defecto salvo con `python app.py`):
+# sin comprobar cambios en disco, todas compiladas al arrancar (antes del fork con
+# preload_app) y con el bytecode en disco, compartido por los workers. Jinja carga ese
+# bytecode con marshal: el directorio solo puede ser del usuario del proceso. Sin
+# TEMPLATE_CACHE_DIR se usa el de Jinja, que ya crea uno por usuario (0700) y lo comprueba.
+TEMPLATE_MODE = os.environ.get('TEMPLATE_MODE', 'development' if __name__ == '__main__' else 'production')
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+if TEMPLATE_MODE == 'production':
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(
+        private_directory(TEMPLATE_CACHE_DIR) if TEMPLATE_CACHE_DIR else None))
+
+# Métricas en /metrics, en formato de Prometheus (METRICS=0 las desactiva sin dejar nada activo)
+metrics = Metrics() if os.environ.get('METRICS', '1') != '0' else None
+if metrics:
+    metrics.instrument_app(app)
+    metrics.describe('newsletter_render_duration_seconds', 'histogram',
+                     'Tiempo de renderizado (render) e inlineado de estilos (inline) de cada newsletter.')
+    metrics.describe('google_api_batched_operations_total', 'counter',
+                     'Operaciones enviadas dentro de peticiones batch de Drive.')
+
+# Sesiones: por defecto la cookie firmada de Flask. Con SESSION_BACKEND=sqlite o file se
+# guardan en el servidor y la cookie solo lleva el ID; son locales a la máquina (con un disco
+# efímero, como en Heroku, cada reinicio o despliegue cierra las sesiones) y el directorio que
+# las contiene queda solo para el usuario del proceso (0700)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie')
+if SESSION_BACKEND == 'sqlite':
+    app.session_interface = ServerSideSessionInterface(SQLiteSessionStore(
+        os.environ.get('SESSION_SQLITE_PATH',
+                       os.path.join(tempfile.gettempdir(), 'newsletter_session_db', 'sessions.sqlite3'))))
+elif SESSION_BACKEND == 'file':
+    app.session_interface = ServerSideSessionInterface(FileSessionStore(
+        os.environ.get('SESSION_FILE_DIR', os.path.join(tempfile.gettempdir(), 'newsletter_sessions'))))
+
 # Configuración de OAuth
 CLIENT_SECRETS_FILE = "client_secret.json"
 SCOPES = [
@@ -24,6 +106,98 @@ SCOPES = [
 API_SERVICE_NAME = 'youtube'
 API_VERSION = 'v3'
 
+# Las librerías de Google (google.oauth2, google_auth_oauthlib, googleapiclient.discovery
+# y .http, httplib2) y el inliner (pynliner, cssutils, bs4) tardan más en importarse que
+# el resto de la aplicación: se importan en la función que las usa, y con gunicorn
+# warm_up() las carga por adelantado (WARM_UP en gunicorn.conf.py).
+
+def build_service(service_name, version, credentials_info):
+    """Construye un servicio de la API con el documento de descubrimiento incluido en la librería."""
+    import google.oauth2.credentials
+    from googleapiclient.discovery import build
+    credentials = google.oauth2.credentials.Credentials(
+        **{name: value for name, value in credentials_info.items() if name != ACCOUNT_ID_FIELD})
+    # Cada execute() del servicio pasa por api_executor (y se mide si hay métricas), con el
+    # límite de peticiones de la cuenta de Google compartido por todas sus sesiones
+    request_builder = api_executor.request_builder(account_identity(credentials_info),
+                                                   base=metrics.request_builder() if metrics else None)
+    return build(service_name, version, credentials=credentials, cache_discovery=False, static_discovery=True,
+                 requestBuilder=request_builder)
+
+# Llamadas a Google: reintentos con espera exponencial (API_MAX_ATTEMPTS intentos), como
+# mucho API_RATE_PER_USER peticiones por segundo y usuario con ráfagas de API_BURST_PER_USER
+# (0 = sin límite) y lecturas idénticas simultáneas compartidas (API_COALESCE=0 lo desactiva)
+api_executor = ApiExecutor(
+    max_attempts=int(os.environ.get('API_MAX_ATTEMPTS', 5)),
+    max_delay=float(os.environ.get('API_MAX_DELAY', 32)),
+    rate=float(os.environ.get('API_RATE_PER_USER', 10)),
+    burst=int(os.environ.get('API_BURST_PER_USER', 20)),
+    coalesce=os.environ.get('API_COALESCE', '1') != '0')
+
+# Servicios ya construidos por usuario (SERVICE_POOL_SIZE entradas como máximo)
+service_pool = ServicePool(build_service, max_size=int(os.environ.get('SERVICE_POOL_SIZE', 128)))
+
+def get_pooled_service(service_name, version, credentials_info):
+    """Toma un servicio del pool para esta petición; se devuelve al terminarla."""
+    service = service_pool.get(service_name, version, credentials_info)
+    g.setdefault('pooled_services', []).append(service)
+    return service
+
+@app.teardown_request
+def release_pooled_services(exception=None):
+    for service in g.pop('pooled_services', []):
+        service_pool.release(service)
+
+# IDs de carpetas de Drive ya resueltos por cuenta (p. ej. "Newsletter_Templates")
+TEMPLATES_FOLDER_NAME = "Newsletter_Templates"
+folder_cache = FolderCache(ttl=int(os.environ.get('FOLDER_CACHE_TTL', 600)))
+
+# Índice de carpetas e imágenes por cuenta, actualizado con la API de cambios de Drive
+drive_index = DriveIndexStore(max_accounts=int(os.environ.get('DRIVE_INDEX_ACCOUNTS', 64)))
+
+# Minificado del HTML tras el inlineado (ver html_minify.py; MINIFY_HTML=1 lo activa, se
+# comprueba con benchmarks/bench_minify.py) y tamaño máximo que se muestra en result.html
+# (por defecto, el límite a partir del cual Gmail recorta el mensaje)
+MINIFY_HTML = os.environ.get('MINIFY_HTML', '0') == '1'
+NEWSLETTER_SIZE_BUDGET = int(os.environ.get('NEWSLETTER_SIZE_BUDGET', 102 * 1024))
+
+# Generación de variantes en lote: procesos del pool (0 = todo en el worker web),
+# mínimo de variantes para usarlo y máximo por petición (cada una es un render completo)
+BATCH_RENDER_WORKERS = int(os.environ.get('BATCH_RENDER_WORKERS', 0))
+BATCH_RENDER_MAX_VARIANTS = int(os.environ.get('BATCH_RENDER_MAX_VARIANTS', 100))
+batch_renderer = BatchRenderer(workers=BATCH_RENDER_WORKERS,
+                               parallel_min=int(os.environ.get('BATCH_RENDER_PARALLEL_MIN', 16)),
+                               minify=MINIFY_HTML)
+
+# Caché de newsletters renderizadas (RENDER_CACHE_DIR activa el almacén compartido en disco)
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+RENDER_CACHE_TTL = int(os.environ.get('RENDER_CACHE_TTL', 3600))
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR')
+render_cache = RenderCache(
+    max_bytes=RENDER_CACHE_MAX_BYTES,
+    ttl=RENDER_CACHE_TTL,
+    disk_backend=DiskBackend(RENDER_CACHE_DIR, RENDER_CACHE_TTL, RENDER_CACHE_MAX_BYTES) if RENDER_CACHE_DIR else None)
+
+# Copia local de las plantillas de Drive, revalidada con su md5Checksum (ver template_cache.py)
+saved_template_cache = TemplateCache(
+    os.environ.get('SAVED_TEMPLATE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'newsletter_saved_templates')),
+    ttl=int(os.environ.get('SAVED_TEMPLATE_CACHE_TTL', 60)),
+    max_bytes=int(os.environ.get('SAVED_TEMPLATE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    prefetch=int(os.environ.get('SAVED_TEMPLATE_PREFETCH', 3)))
+
+# Fragmentos inlineados de la vista previa en vivo (ver live_preview.py)
+live_preview = LivePreview(max_fragments=int(os.environ.get('LIVE_PREVIEW_MAX_FRAGMENTS', 4096)))
+
+# Página de gestión de imágenes: imágenes por página del listado y tamaño de las
+# miniaturas, servidas con una caché en disco (ver thumbnail_cache.py) que precarga
+# las THUMBNAIL_PREFETCH primeras de la carpeta
+IMAGE_PAGE_SIZE = int(os.environ.get('IMAGE_PAGE_SIZE', 60))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 320))
+thumbnail_cache = ThumbnailCache(
+    os.environ.get('THUMBNAIL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'newsletter_thumbnails')),
+    max_bytes=int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+    prefetch=int(os.environ.get('THUMBNAIL_PREFETCH', 24)))
+
 def get_drive_service():
     """
     Verifica las credenciales en la sesión y devuelve una instancia del servicio de Drive.
@@ -33,28 +207,28 @@ def get_drive_service():
         return None, jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        credentials = google.oauth2.credentials.Credentials(**session['credentials'])
-        # Si las credenciales han sido revocadas o son inválidas, esto lanzará una excepción
-        if credentials.expired and credentials.refresh_token:
-            # No es un error, pero es bueno saberlo. El cliente se encargará de refrescar.
-            pass
-        drive_service = build('drive', 'v3', credentials=credentials)
+        # Si las credenciales son inválidas, esto lanzará una excepción. Si han
+        # caducado, el transporte autorizado se encargará de refrescarlas.
+        drive_service = get_pooled_service('drive', 'v3', session['credentials'])
         return drive_service, None, None
     except HttpError as e:
         # Si las credenciales son inválidas (ej. revocadas), la API devuelve 401
         if e.resp.status == 401:
+            service_pool.discard(session['credentials'])
             session.pop('credentials', None) # Limpiar credenciales inválidas
             return None, jsonify({'error': 'Invalid credentials (HttpError). Please re-authenticate.'}), 401
         # Otros errores de la API de Google
         return None, jsonify({'error': 'Google API error', 'details': str(e)}), e.resp.status
     except Exception as e:
         # Otras excepciones durante la validación de credenciales
+        service_pool.discard(session['credentials'])
         session.pop('credentials', None) # Limpiar credenciales inválidas
         # Devuelve 401 para forzar la re-autenticación, ya que es la causa más probable
         return None, jsonify({'error': 'Invalid credentials (Exception). Please re-authenticate.'}), 401
 
 @app.route('/authorize')
 def authorize():
+    import google_auth_oauthlib.flow
     if os.path.exists(CLIENT_SECRETS_FILE):
         flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
             CLIENT_SECRETS_FILE, scopes=SCOPES)
@@ -79,6 +253,7 @@ def authorize():
 
 @app.route('/oauth2callback')
 def oauth2callback():
+    import google_auth_oauthlib.flow
     state = session['state']
     if os.path.exists(CLIENT_SECRETS_FILE):
         flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
@@ -99,9 +274,22 @@ def oauth2callback():
     authorization_response = request.url
     flow.fetch_token(authorization_response=authorization_response)
     credentials = flow.credentials
-    session['credentials'] = credentials_to_dict(credentials)
+    credentials_info = credentials_to_dict(credentials)
+    account_id = google_account_id(credentials_info)
+    if account_id:
+        credentials_info[ACCOUNT_ID_FIELD] = account_id
+    session['credentials'] = credentials_info
     return redirect(url_for('index'))
 
+def google_account_id(credentials_info):
+    """permissionId de Drive del usuario, igual en todos sus inicios de sesión, o None si no se pudo consultar."""
+    try:
+        drive_service = build_service('drive', 'v3', credentials_info)
+        return drive_service.about().get(fields='user(permissionId)').execute()['user']['permissionId']
+    except Exception as e:
+        print("Error getting the Google account ID: {}".format(e))
+        return None
+
 def credentials_to_dict(credentials):
     return {'token': credentials.token,
             'refresh_token': credentials.refresh_token,
@@ -112,7 +300,9 @@ def credentials_to_dict(credentials):
 
 @app.route('/logout')
 def logout():
-    # Eliminar las credenciales de la sesión
+    # Eliminar las credenciales de la sesión y sus servicios construidos
+    if 'credentials' in session:
+        service_pool.discard(session['credentials'])
     session.pop('credentials', None)
     session.pop('form_data', None) # También limpiamos los datos del formulario
     return redirect(url_for('index'))
@@ -127,23 +317,60 @@ def get_or_create_folder():
     if not folder_name:
         return jsonify({'error': 'No folder name provided'}), 400
 
-    # Buscar si la carpeta ya existe
-    query = "mimeType='application/vnd.google-apps.folder' and name='{}' and trashed=false".format(folder_name)
-    response = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-    files = response.get('files', [])
+    # Buscar la carpeta (o crearla si no existe) usando la caché de IDs
+    account = credentials_identity(session['credentials'])
+    folder_id = folder_cache.resolve(drive_service, account, folder_name)
+    return jsonify({'folderId': folder_id})
 
-    if files:
-        # Carpeta encontrada
-        folder_id = files[0].get('id')
-        return jsonify({'folderId': folder_id})
-    else:
-        # Crear la carpeta
-        file_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder'
-        }
-        folder = drive_service.files().create(body=file_metadata, fields='id').execute()
-        return jsonify({'folderId': folder.get('id')})
+def forget_missing_folder(account, folder_id, exception):
+    """
+    Un 404 de Drive al usar una carpeta indica que puede haberse eliminado: se
+    olvida en la caché de IDs para que get_or_create_folder la resuelva de nuevo.
+    """
+    if folder_id and isinstance(exception, HttpError) and exception.resp.status == 404:
+        folder_cache.invalidate(account, folder_id=folder_id)
+
+def upload_to_drive(drive_service, file, folder_id):
+    """Sube un fichero del formulario a Drive, por trozos desde su stream."""
+    file_metadata = {
+        'name': file.filename,
+        'parents': [folder_id] if folder_id else []
+    }
+    from googleapiclient.http import MediaIoBaseUpload
+    file.stream.seek(0) # Ensure stream is at the beginning
+    media = MediaIoBaseUpload(file.stream, mimetype=file.mimetype, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+    request_drive = drive_service.files().create(media_body=media, body=file_metadata, fields='id, webViewLink, webContentLink')
+    return request_drive.execute()
+
+PUBLIC_PERMISSION = {'type': 'anyone', 'role': 'reader'}
+
+def content_hash_update(drive_service, file_id, file_hash):
+    """
+    Petición que guarda el hash en appProperties de una imagen ya pública. Solo
+    se guarda después del permiso: ContentHashIndex ofrece como duplicado
+    cualquier fichero de la carpeta con hash, y uno privado sería un enlace roto.
+    """
+    return drive_service.files().update(fileId=file_id, body={'appProperties': {HASH_PROPERTY: file_hash}},
+                                        fields='id')
+
+def find_duplicate_image(drive_service, account, folder_id, file, max_width):
+    """
+    Devuelve (hash, ID de la imagen ya subida a la carpeta con ese contenido o None).
+    Sin carpeta o con IMAGE_DEDUP=0 no se lee el fichero y el hash es None; si
+    falla la consulta a Drive, la imagen se sube sin comprobar.
+    """
+    if not folder_id or not IMAGE_DEDUP:
+        return None, None
+    file_hash = content_hash(file.stream, image_pipeline.variant(max_width))
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    try:
+        return file_hash, image_index.lookup(drive_service, account, folder_id, file_hash, size)
+    except Exception as e:
+        print("Error looking up image hashes in Drive: {}".format(e))
+        forget_missing_folder(account, folder_id, e)
+        return file_hash, None
 
 @app.route('/upload_image', methods=['POST'])
 def upload_image():
@@ -156,112 +383,231 @@ def upload_image():
 
     if not file:
         return jsonify({'error': 'No file provided'}), 400
-    
-    # Create a temporary file and write the content to it
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        file.stream.seek(0) # Ensure stream is at the beginning
-        temp_file.write(file.stream.read())
-        temp_file_path = temp_file.name
 
+    # Si la carpeta ya tiene una imagen con el mismo contenido se reutiliza (ya es pública)
+    max_width = request.form.get('maxWidth', DEFAULT_WIDTH, type=int)
+    account = credentials_identity(session['credentials'])
+    file_hash, existing_id = find_duplicate_image(drive_service, account, folder_id, file, max_width)
+    if existing_id:
+        return jsonify({'url': "https://lh3.googleusercontent.com/d/{}".format(existing_id), 'deduplicated': True})
+
+    # Redimensionar y recomprimir antes de subir (maxWidth: 540, 600, 1080 o 1200)
+    file, optimization = image_pipeline.optimize(file, max_width)
+    
     response = None
     try:
-        file_metadata = {
-            'name': file.filename,
-            'parents': [folder_id] if folder_id else []
-        }
-
-        media = MediaFileUpload(temp_file_path, mimetype=file.mimetype, resumable=True)
-        
-        request_drive = drive_service.files().create(media_body=media, body=file_metadata, fields='id, webViewLink, webContentLink')
-        response = request_drive.execute()
+        response = upload_to_drive(drive_service, file, folder_id)
     except Exception as e:
         print("Error uploading to Drive: {}".format(e))
-    finally:
-        # Clean up the temporary file
-        os.remove(temp_file_path)
+        forget_missing_folder(account, folder_id, e)
 
     if not response:
         return jsonify({'error': 'Failed to upload file to Google Drive'}), 500
 
-    # Hacer el archivo público
+    # Hacer el archivo público y, solo entonces, guardar su hash para reutilizarlo
     file_id = response.get('id')
-    permission = {'type': 'anyone', 'role': 'reader'}
-    drive_service.permissions().create(fileId=file_id, body=permission).execute()
+    try:
+        drive_service.permissions().create(fileId=file_id, body=PUBLIC_PERMISSION).execute()
+    except Exception as e:
+        print("Error making {} public: {}".format(file_id, e))
+        return jsonify({'error': 'File uploaded but could not be made public in Google Drive'}), 500
+    if folder_id and IMAGE_DEDUP:
+        try:
+            content_hash_update(drive_service, file_id, file_hash).execute()
+            image_index.add(account, folder_id, file_hash, file_id)
+        except Exception as e:
+            print("Error saving content hash of {}: {}".format(file_id, e))
     
     # Construir el enlace de descarga directa
     direct_link = "https://lh3.googleusercontent.com/d/{}".format(file_id)
     
-    return jsonify({'url': direct_link})
+    return jsonify({'url': direct_link, 'optimization': optimization})
+
+@app.route('/upload_images_batch', methods=['POST'])
+def upload_images_batch():
+    drive_service, error_response, status_code = get_drive_service()
+    if error_response:
+        return error_response, status_code
+
+    files = [file for file in request.files.getlist('files') if file]
+    folder_id = request.form.get('folderId')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+
+    # Los hilos no tienen acceso a la sesión: cada uno toma y devuelve su propio servicio del pool
+    credentials_info = session['credentials']
+    account = credentials_identity(credentials_info)
+    max_width = request.form.get('maxWidth', DEFAULT_WIDTH, type=int)
+    batch_start = time.perf_counter()
+
+    def upload_one(file):
+        start = time.perf_counter()
+        result = {'name': file.filename}
+        thread_service = None
+        try:
+            thread_service = service_pool.get('drive', 'v3', credentials_info)
+            file_hash, existing_id = find_duplicate_image(thread_service, account, folder_id, file, max_width)
+            if existing_id:
+                result.update(id=existing_id, deduplicated=True)
+            else:
+                file, result['optimization'] = image_pipeline.optimize(file, max_width)
+                result['id'] = upload_to_drive(thread_service, file, folder_id).get('id')
+                result['hash'] = file_hash
+        except Exception as e:
+            print("Error uploading {} to Drive: {}".format(file.filename, e))
+            forget_missing_folder(account, folder_id, e)
+            result['error'] = 'No se pudo subir la imagen a Google Drive.'
+        finally:
+            if thread_service is not None:
+                service_pool.release(thread_service)
+        result['upload_ms'] = round(1000 * (time.perf_counter() - start), 1)
+        return result
+
+    results = list(upload_executor.map(upload_one, files))
+
+    # Hacer públicos los archivos subidos agrupando los permisos en peticiones batch
+    # (los duplicados reutilizan una imagen que ya es pública)
+    for result in results:
+        if result.get('deduplicated'):
+            result['url'] = "https://lh3.googleusercontent.com/d/{}".format(result['id'])
+    uploaded = [result for result in results if result.get('id') and not result.get('deduplicated')]
+    permission_results = execute_in_batches(drive_service, [
+        (result['id'], drive_service.permissions().create(fileId=result['id'], body=PUBLIC_PERMISSION))
+        for result in uploaded], metrics=metrics)
+    public = []
+    for result in uploaded:
+        _, exception = permission_results[result['id']]
+        if exception is not None:
+            print("Error making {} public: {}".format(result['name'], exception))
+            result['error'] = 'La imagen se subió pero no se pudo hacer pública.'
+        else:
+            result['url'] = "https://lh3.googleusercontent.com/d/{}".format(result['id'])
+            public.append(result)
+
+    # Solo las imágenes ya públicas guardan su hash (también en batch)
+    if folder_id and IMAGE_DEDUP and public:
+        hash_results = execute_in_batches(drive_service, [
+            (result['id'], content_hash_update(drive_service, result['id'], result['hash'])) for result in public],
+            metrics=metrics)
+        for result in public:
+            _, exception = hash_results[result['id']]
+            if exception is not None:
+                print("Error saving content hash of {}: {}".format(result['name'], exception))
+            else:
+                image_index.add(account, folder_id, result['hash'], result['id'])
+    for result in results:
+        result.pop('hash', None)
+
+    succeeded = sum(1 for result in results if 'url' in result)
+    payload = {
+        'results': results,
+        'uploaded': succeeded,
+        'failed': len(results) - succeeded,
+        'elapsed_ms': round(1000 * (time.perf_counter() - batch_start), 1)
+    }
+    return jsonify(payload), 200 if succeeded else 500
+
+VIDEO_METADATA = {
+    'snippet': {
+        'title': 'Video subido desde la App de Newsletter',
+        'description': 'Este es un video subido a través de la aplicación de generación de newsletters.',
+        'tags': ['newsletter', 'video'],
+        'categoryId': '22' 
+    },
+    'status': {
+        'privacyStatus': 'public' 
+    }
+}
+
+def start_video_upload(youtube_service, media):
+    return youtube_service.videos().insert(
+        part='snippet,status', # Corregido: 'part' debe ser una cadena explícita
+        body=VIDEO_METADATA,
+        media_body=media
+    )
+
+def video_upload_result(response):
+    return {'url': "https://www.youtube.com/watch?v={}".format(response.get('id'))}
+
+def video_upload_error(exception):
+    """Mensaje para el usuario a partir del error final de una subida de vídeo."""
+    if isinstance(exception, HttpError):
+        try:
+            error_details = json.loads(exception.content.decode('utf-8'))
+        except ValueError:
+            error_details = {}
+        error_reason = error_details.get('error', {}).get('errors', [{}])[0].get('reason')
+        print("YouTube API Error Details: {}".format(error_details))
+        if error_reason == 'youtubeSignupRequired':
+            # Error específico cuando no existe un canal de YouTube
+            return 'No se pudo subir el vídeo. La cuenta de Google no tiene un canal de YouTube. Por favor, ve a YouTube.com, inicia sesión y crea un canal.'
+        return 'Ocurrió un error con la API de YouTube. Revisa la consola del servidor para más detalles.'
+    return 'Ocurrió un error inesperado durante la subida del vídeo.'
+
+# Subidas de vídeo en segundo plano: como mucho UPLOAD_JOB_WORKERS a la vez por proceso;
+# cada UPLOAD_JOB_MAINTENANCE_INTERVAL segundos cada worker retoma las de procesos muertos
+video_upload_queue = UploadJobQueue(
+    JobStore(os.environ.get('UPLOAD_JOB_DB',
+                            os.path.join(tempfile.gettempdir(), 'newsletter_job_db', 'jobs.sqlite3'))),
+    os.environ.get('UPLOAD_JOB_DIR', os.path.join(tempfile.gettempdir(), 'newsletter_upload_jobs')),
+    service_pool,
+    (API_SERVICE_NAME, API_VERSION),
+    start_video_upload,
+    video_upload_result,
+    video_upload_error,
+    workers=int(os.environ.get('UPLOAD_JOB_WORKERS', 2)),
+    chunk_size=UPLOAD_CHUNK_SIZE,
+    max_attempts=int(os.environ.get('UPLOAD_JOB_MAX_ATTEMPTS', 5)),
+    maintenance_interval=float(os.environ.get('UPLOAD_JOB_MAINTENANCE_INTERVAL', 60)))
 
 @app.route('/upload_video', methods=['POST'])
 def upload_video():
     if 'credentials' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    # Esta función necesita las credenciales, no el servicio de Drive
-    credentials = google.oauth2.credentials.Credentials(**session['credentials'])
-    youtube_service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
-
     file = request.files['file']
     if not file:
         return jsonify({'error': 'No file provided'}), 400
-    
-    # Create a temporary file and write the content to it
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        file.stream.seek(0) # Ensure stream is at the beginning
-        temp_file.write(file.stream.read())
-        temp_file_path = temp_file.name
 
-    response = None
+    # La subida a YouTube se hace en segundo plano; el cliente consulta /jobs/<id>
     try:
-        body = {
-            'snippet': {
-                'title': 'Video subido desde la App de Newsletter',
-                'description': 'Este es un video subido a través de la aplicación de generación de newsletters.',
-                'tags': ['newsletter', 'video'],
-                'categoryId': '22' 
-            },
-            'status': {
-                'privacyStatus': 'public' 
-            }
-        }
-
-        media = MediaFileUpload(
-            temp_file_path, 
-            mimetype=file.mimetype,  # Corregido: Especificar el mimetype es crucial
-            chunksize=-1, 
-            resumable=True)
-        
-        request_youtube = youtube_service.videos().insert(
-            part='snippet,status', # Corregido: 'part' debe ser una cadena explícita
-            body=body,
-            media_body=media
-        )
-        
-        response = request_youtube.execute()
-    except HttpError as e:
-        error_details = json.loads(e.content.decode('utf-8'))
-        error_reason = error_details.get('error', {}).get('errors', [{}])[0].get('reason')
-        
-        print("YouTube API Error Details: {}".format(error_details))
-
-        if error_reason == 'youtubeSignupRequired':
-            # Error específico cuando no existe un canal de YouTube
-            return jsonify({'error': 'No se pudo subir el vídeo. La cuenta de Google no tiene un canal de YouTube. Por favor, ve a YouTube.com, inicia sesión y crea un canal.'}), 403
-        
-        print("Error uploading to YouTube: {}".format(e))
-        return jsonify({'error': 'Ocurrió un error con la API de YouTube. Revisa la consola del servidor para más detalles.'}), 500
+        job_id = video_upload_queue.submit(credentials_identity(session['credentials']), session['credentials'], file)
     except Exception as e:
-        print("Error uploading to YouTube: {}".format(e))
+        print("Error queuing video upload: {}".format(e))
         return jsonify({'error': 'Ocurrió un error inesperado durante la subida del vídeo.'}), 500
-    finally:
-        # Clean up the temporary file
-        os.remove(temp_file_path)
 
-    video_id = response.get('id')
-    video_url = "https://www.youtube.com/watch?v={}".format(video_id)
-    
-    return jsonify({'url': video_url})
+    return jsonify({'jobId': job_id, 'statusUrl': url_for('job_status', job_id=job_id)}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if 'credentials' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    status = video_upload_queue.status(job_id, credentials_identity(session['credentials']))
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+# Mensajes de error al eliminar, por código de estado
+IMAGE_DELETE_ERRORS = {
+    403: 'Permisos insuficientes para eliminar el archivo.',
+    404: 'El archivo no fue encontrado. Puede que ya haya sido eliminado.',
+    500: 'No se pudo eliminar la imagen de Google Drive.',
+}
+TEMPLATE_DELETE_ERRORS = {
+    403: 'Permisos insuficientes para eliminar la plantilla.',
+    404: 'La plantilla no fue encontrada. Puede que ya haya sido eliminada.',
+    500: 'No se pudo eliminar la plantilla de Google Drive.',
+}
+
+def delete_error_status(exception):
+    """Intenta dar un código de estado más específico a partir del error de Drive."""
+    error_message = str(exception)
+    if 'insufficient permissions' in error_message.lower():
+        return 403
+    if 'notFound' in error_message:
+        return 404
+    return 500
 
 @app.route('/delete_image/<image_id>', methods=['POST'])
 def delete_image(image_id):
@@ -273,17 +619,83 @@ def delete_image(image_id):
         return jsonify({'error': 'Image ID is required'}), 400
     try:
         drive_service.files().delete(fileId=image_id).execute()
+        image_index.forget(credentials_identity(session['credentials']), image_id)
         return jsonify({'success': True, 'message': 'Imagen eliminada con éxito.'})
     except Exception as e:
         print("Error deleting image from Drive: {}".format(e))
         # Intenta dar un mensaje de error más específico si es posible
-        error_message = str(e)
-        if 'insufficient permissions' in error_message.lower():
-            return jsonify({'error': 'Permisos insuficientes para eliminar el archivo.'}), 403
-        if 'notFound' in error_message:
-            return jsonify({'error': 'El archivo no fue encontrado. Puede que ya haya sido eliminado.'}), 404
-        
-        return jsonify({'error': 'No se pudo eliminar la imagen de Google Drive.'}), 500
+        status = delete_error_status(e)
+        return jsonify({'error': IMAGE_DELETE_ERRORS[status]}), status
+
+# Máximo de IDs en /delete_images_batch e /images_metadata
+BATCH_IDS_MAX = int(os.environ.get('BATCH_IDS_MAX', 500))
+
+def image_ids_from_json(data):
+    """(IDs sin duplicados y en el mismo orden, None) o (None, mensaje de error) de {"ids": [...]}."""
+    image_ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(image_ids, list) or not image_ids:
+        return None, 'Image IDs are required'
+    if not all(isinstance(image_id, str) and image_id for image_id in image_ids):
+        return None, 'Image IDs must be non-empty strings'
+    if len(image_ids) > BATCH_IDS_MAX:
+        return None, 'Too many image IDs (max {})'.format(BATCH_IDS_MAX)
+    return list(dict.fromkeys(image_ids)), None
+
+@app.route('/delete_images_batch', methods=['POST'])
+def delete_images_batch():
+    drive_service, error_response, status_code = get_drive_service()
+    if error_response:
+        return error_response, status_code
+
+    image_ids, error = image_ids_from_json(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+
+    responses = execute_in_batches(drive_service, [
+        (image_id, drive_service.files().delete(fileId=image_id)) for image_id in image_ids], metrics=metrics)
+    results = []
+    account = credentials_identity(session['credentials'])
+    for image_id in image_ids:
+        _, exception = responses[image_id]
+        if exception is None:
+            image_index.forget(account, image_id)
+            results.append({'id': image_id, 'success': True})
+        else:
+            print("Error deleting image {} from Drive: {}".format(image_id, exception))
+            status = delete_error_status(exception)
+            results.append({'id': image_id, 'success': False, 'status': status, 'error': IMAGE_DELETE_ERRORS[status]})
+
+    deleted = sum(1 for result in results if result['success'])
+    return jsonify({
+        'success': deleted == len(results),
+        'message': '{} de {} imágenes eliminadas con éxito.'.format(deleted, len(results)),
+        'results': results
+    })
+
+@app.route('/images_metadata', methods=['POST'])
+def images_metadata():
+    drive_service, error_response, status_code = get_drive_service()
+    if error_response:
+        return error_response, status_code
+
+    image_ids, error = image_ids_from_json(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error}), 400
+
+    fields = 'id, name, mimeType, size, modifiedTime, thumbnailLink'
+    responses = execute_in_batches(drive_service, [
+        (image_id, drive_service.files().get(fileId=image_id, fields=fields)) for image_id in image_ids],
+        metrics=metrics)
+    results = []
+    for image_id in image_ids:
+        response, exception = responses[image_id]
+        if exception is None:
+            response['url'] = "https://lh3.googleusercontent.com/d/{}".format(image_id)
+            results.append(response)
+        else:
+            print("Error getting metadata for {}: {}".format(image_id, exception))
+            results.append({'id': image_id, 'error': 'No se pudo obtener la información de la imagen.'})
+    return jsonify(results)
 
 
 @app.route('/list_drive_folders', methods=['GET'])
@@ -292,23 +704,11 @@ def list_drive_folders():
     if error_response:
         return error_response, status_code
 
-    folders = []
-    page_token = None
+    # ?force=1 descarta el índice y vuelve a listar todas las carpetas
+    force = request.args.get('force') == '1'
     try:
-        while True:
-            response = drive_service.files().list(
-                q="mimeType='application/vnd.google-apps.folder' and trashed=false",
-                spaces='drive',
-                fields='nextPageToken, files(id, name)',
-                pageToken=page_token
-            ).execute()
-            
-            for file in response.get('files', []):
-                folders.append({'id': file.get('id'), 'name': file.get('name')})
-            
-            page_token = response.get('nextPageToken', None);
-            if page_token is None:
-                break
+        account = credentials_identity(session['credentials'])
+        folders = drive_index.folders(drive_service, account, force=force)
         
         # Ordenar las carpetas alfabéticamente por nombre
         folders.sort(key=lambda x: x['name'].lower())
@@ -319,67 +719,179 @@ def list_drive_folders():
         print("Error listing Drive folders: {}".format(e))
         return jsonify({'error': 'Failed to list folders from Google Drive'}), 500
 
+def minify_newsletter(newsletter_html):
+    """Última etapa tras el inlineado: HTML más pequeño con el mismo aspecto (solo con MINIFY_HTML=1)."""
+    if not MINIFY_HTML:
+        return newsletter_html
+    from html_minify import minify_html
+    return minify_html(newsletter_html)
+
+def render_newsletter_uncached(context):
+    from inliner import inline_styles
+    if metrics is None:
+        return minify_newsletter(inline_styles(render_template('template.html', **context)))
+
+    # Renderizar la plantilla de la newsletter a una variable
+    start = time.perf_counter()
+    newsletter_html = render_template('template.html', **context)
+    rendered = time.perf_counter()
+
+    # Inliner los estilos CSS (hoja de estilos precompilada, misma salida que Pynliner)
+    newsletter_html = inline_styles(newsletter_html)
+    inlined = time.perf_counter()
+    newsletter_html = minify_newsletter(newsletter_html)
+    metrics.observe('newsletter_render_duration_seconds', rendered - start, stage='render')
+    metrics.observe('newsletter_render_duration_seconds', inlined - rendered, stage='inline')
+    metrics.observe('newsletter_render_duration_seconds', time.perf_counter() - inlined, stage='minify')
+    return newsletter_html
+
+def precompile_templates():
+    """Compila todas las plantillas de templates/ para que ninguna petición pague esa compilación."""
+    start = time.perf_counter()
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    print("Precompiled {} templates in {:.0f} ms".format(len(names), 1000 * (time.perf_counter() - start)))
+
+def warm_up():
+    """
+    Importa los módulos que se cargan en el primer uso y compila la hoja de
+    estilos del inliner, para que la primera petición que los necesita no espere.
+    """
+    start = time.perf_counter()
+    # Primero el inliner, que es lo que necesita la ruta más usada (POST /)
+    with app.app_context():
+        render_newsletter_uncached({})
+    import google.oauth2.credentials
+    import google_auth_oauthlib.flow
+    import googleapiclient.discovery
+    import googleapiclient.http
+    import httplib2
+    print("Warmed up in {:.0f} ms".format(1000 * (time.perf_counter() - start)))
+
+def render_newsletters(contexts):
+    """HTML final de cada contexto, reutilizando las newsletters ya generadas."""
+    # Reutilizar el resultado si ya se generó esta misma newsletter
+    from inliner import template_version
+    template_path = os.path.join(app.root_path, app.template_folder, 'template.html')
+    # El HTML guardado en la caché depende también de si se minifica
+    version = template_version(template_path) + (':min' if MINIFY_HTML else '')
+    cache_keys = [context_key(context, version) for context in contexts]
+    htmls = [render_cache.get(cache_key) for cache_key in cache_keys]
+    missing = [i for i, html in enumerate(htmls) if html is None]
+    rendered = batch_renderer.render([contexts[i] for i in missing], render_newsletter_uncached)
+    for i, html in zip(missing, rendered):
+        htmls[i] = html
+        render_cache.set(cache_keys[i], html)
+    return htmls
+
+@app.route('/render_batch', methods=['POST'])
+def render_batch():
+    """
+    Genera varias variantes de la newsletter en una llamada.
+    JSON: {"base": {contexto}, "variants": [{"name": ..., "overrides": {...}}, ...], "format": "json" | "zip"}
+    """
+    if 'credentials' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    data = request.get_json(silent=True) or {}
+    base = data.get('base') or {}
+    variants = data.get('variants')
+    if not isinstance(base, dict) or not isinstance(variants, list) or not variants:
+        return jsonify({'error': 'A base context and a list of variants are required'}), 400
+    if len(variants) > BATCH_RENDER_MAX_VARIANTS:
+        return jsonify({'error': 'Too many variants (max {})'.format(BATCH_RENDER_MAX_VARIANTS)}), 400
+    if not all(isinstance(variant, dict) and isinstance(variant.get('overrides') or {}, dict) for variant in variants):
+        return jsonify({'error': 'Each variant must be an object with optional "name" and "overrides"'}), 400
+
+    base.setdefault('sections', [])
+    names = []
+    for i, variant in enumerate(variants):
+        name = secure_filename(str(variant.get('name') or '')) or 'variant_{}'.format(i + 1)
+        names.append(name if name not in names else '{}_{}'.format(name, i + 1))
+    contexts = [merge_context(base, variant.get('overrides')) for variant in variants]
+
+    start = time.perf_counter()
+    htmls = render_newsletters(contexts)
+    elapsed = time.perf_counter() - start
+
+    if data.get('format') == 'zip':
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, html in zip(names, htmls):
+                archive.writestr(name + '.html', html)
+        buffer.seek(0)
+        return send_file(buffer, mimetype='application/zip', as_attachment=True, download_name='newsletters.zip')
+
+    return jsonify({
+        'variants': [{'name': name, 'html': html} for name, html in zip(names, htmls)],
+        'elapsed_ms': round(1000 * elapsed, 1),
+        'variants_per_second': round(len(htmls) / elapsed, 1) if elapsed else None
+    })
+
+def context_from_form(form):
+    """Contexto de template.html a partir de los campos del formulario de index.html."""
+    # Recoger datos del formulario
+    context = {
+        'title': form.get('title'),
+        'header_logo_link': form.get('header_logo_link'),
+        'header_logo_src': form.get('header_logo_src'),
+        'hero_link': form.get('hero_link'),
+        'hero_src': form.get('hero_src'),
+        'hero_alt': form.get('hero_alt'),
+        'intro_title': form.get('intro_title'),
+        'intro_p1': form.get('intro_p1'),
+        'intro_p2': form.get('intro_p2'),
+        'video_title': form.get('video_title'),
+        'video_p': form.get('video_p'),
+        'video_link': form.get('video_link'),
+        'video_thumbnail_src': form.get('video_thumbnail_src'),
+        'video_thumbnail_alt': form.get('video_thumbnail_alt'),
+        'footer_web_link': form.get('footer_web_link'),
+        'footer_text_main': form.get('footer_text_main'),
+        'footer_web_text': form.get('footer_web_text'),
+        'footer_legal_text': form.get('footer_legal_text'),
+        'bg_type': form.get('bg_type'),
+        'bg_color': form.get('bg_color'),
+        'bg_color_1': form.get('bg_color_1'),
+        'bg_color_2': form.get('bg_color_2'),
+        'title_color': form.get('title_color'),
+        'text_color': form.get('text_color'),
+        'button_color': form.get('button_color'),
+        'font_family': form.get('font_family'),
+        'title_font_size': form.get('title_font_size'),
+        'sections': []
+    }
+
+    # Recoger secciones dinámicamente
+    sections_data = {}
+    for key, value in form.items(multi=True):
+        if key.startswith('section'):
+            parts = key.split('_')
+            section_num = parts[0].replace('section', '')
+            field_name = '_'.join(parts[1:])
+
+            if section_num not in sections_data:
+                sections_data[section_num] = {'id': section_num}
+            sections_data[section_num][field_name] = value
+
+    # Convertir el diccionario de secciones a una lista ordenada
+    sorted_section_nums = sorted(sections_data.keys(), key=int)
+    context['sections'] = [sections_data[num] for num in sorted_section_nums if sections_data[num]]
+
+    return context
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        # Recoger datos del formulario
-        context = {
-            'title': request.form.get('title'),
-            'header_logo_link': request.form.get('header_logo_link'),
-            'header_logo_src': request.form.get('header_logo_src'),
-            'hero_link': request.form.get('hero_link'),
-            'hero_src': request.form.get('hero_src'),
-            'hero_alt': request.form.get('hero_alt'),
-            'intro_title': request.form.get('intro_title'),
-            'intro_p1': request.form.get('intro_p1'),
-            'intro_p2': request.form.get('intro_p2'),
-            'video_title': request.form.get('video_title'),
-            'video_p': request.form.get('video_p'),
-            'video_link': request.form.get('video_link'),
-            'video_thumbnail_src': request.form.get('video_thumbnail_src'),
-            'video_thumbnail_alt': request.form.get('video_thumbnail_alt'),
-            'footer_web_link': request.form.get('footer_web_link'),
-            'footer_text_main': request.form.get('footer_text_main'),
-            'footer_web_text': request.form.get('footer_web_text'),
-            'footer_legal_text': request.form.get('footer_legal_text'),
-            'bg_type': request.form.get('bg_type'),
-            'bg_color': request.form.get('bg_color'),
-            'bg_color_1': request.form.get('bg_color_1'),
-            'bg_color_2': request.form.get('bg_color_2'),
-            'title_color': request.form.get('title_color'),
-            'text_color': request.form.get('text_color'),
-            'button_color': request.form.get('button_color'),
-            'font_family': request.form.get('font_family'),
-            'title_font_size': request.form.get('title_font_size'),
-            'sections': []
-        }
-
-        # Recoger secciones dinámicamente
-        sections_data = {}
-        for key, value in request.form.items(multi=True):
-            if key.startswith('section'):
-                parts = key.split('_')
-                section_num = parts[0].replace('section', '')
-                field_name = '_'.join(parts[1:])
-                
-                if section_num not in sections_data:
-                    sections_data[section_num] = {'id': section_num}
-                sections_data[section_num][field_name] = value
-        
-        # Convertir el diccionario de secciones a una lista ordenada
-        sorted_section_nums = sorted(sections_data.keys(), key=int)
-        context['sections'] = [sections_data[num] for num in sorted_section_nums if sections_data[num]]
-
-        # Renderizar la plantilla de la newsletter a una variable
-        newsletter_html = render_template('template.html', **context)
-        
-        # Inliner los estilos CSS
-        p = Pynliner()
-        newsletter_html = p.from_string(newsletter_html).run()
+        context = context_from_form(request.form)
+        newsletter_html = render_newsletters([context])[0]
         session['form_data'] = context # Corregido: Guardar datos DESPUÉS de procesar todo
 
-        # Devolver la página de resultados con el código de la newsletter
-        return render_template('result.html', newsletter_html=newsletter_html)
+        # Devolver la página de resultados con el código de la newsletter y su tamaño final
+        return render_template('result.html', newsletter_html=newsletter_html,
+                               newsletter_size=len(newsletter_html.encode('utf-8')),
+                               size_budget=NEWSLETTER_SIZE_BUDGET)
     
     # Si es GET, mostrar el formulario con los datos de la sesión si existen
     form_data = session.get('form_data', {})
@@ -387,43 +899,225 @@ def index():
     return render_template('index.html', credentials_exist=credentials_exist, form_data=form_data)
 
 
+@app.route('/live_preview', methods=['POST'])
+def live_preview_route():
+    """
+    Vista previa mientras se edita: mismos campos que el formulario de index()
+    (o el contexto en JSON). Solo se inlinean los fragmentos que han cambiado
+    desde la vista previa anterior; no modifica la sesión.
+    """
+    if request.is_json:
+        context = request.get_json(silent=True)
+        if not isinstance(context, dict):
+            return jsonify({'error': 'JSON body must be an object'}), 400
+        context.setdefault('sections', [])
+    else:
+        context = context_from_form(request.form)
+
+    start = time.perf_counter()
+    newsletter_html, inlined = live_preview.render(app.jinja_env.get_template('template.html'), context)
+    newsletter_html = minify_newsletter(newsletter_html)
+    return jsonify({
+        'html': newsletter_html,
+        'bytes': len(newsletter_html.encode('utf-8')),
+        'fragments_inlined': inlined,
+        'elapsed_ms': round(1000 * (time.perf_counter() - start), 2)
+    })
+
+# Rutas *_stats y /metrics: solo con STATS_TOKEN definido y la cabecera
+# "Authorization: Bearer <STATS_TOKEN>"; sin él responden 404
+STATS_TOKEN = os.environ.get('STATS_TOKEN')
+
+def requires_stats_token(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not STATS_TOKEN:
+            return jsonify({'error': 'Not found'}), 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + STATS_TOKEN):
+            return jsonify({'error': 'Not authorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/live_preview_stats', methods=['GET'])
+@requires_stats_token
+def live_preview_stats():
+    return jsonify(live_preview.stats())
+
+@app.route('/render_cache_stats', methods=['GET'])
+@requires_stats_token
+def render_cache_stats():
+    return jsonify(render_cache.stats())
+
+@app.route('/service_pool_stats', methods=['GET'])
+@requires_stats_token
+def service_pool_stats():
+    return jsonify(service_pool.stats())
+
+@app.route('/image_pipeline_stats', methods=['GET'])
+@requires_stats_token
+def image_pipeline_stats():
+    return jsonify(image_pipeline.stats())
+
+@app.route('/image_index_stats', methods=['GET'])
+@requires_stats_token
+def image_index_stats():
+    return jsonify(image_index.stats())
+
+@app.route('/drive_index_stats', methods=['GET'])
+@requires_stats_token
+def drive_index_stats():
+    return jsonify(drive_index.stats())
+
+@app.route('/saved_template_cache_stats', methods=['GET'])
+@requires_stats_token
+def saved_template_cache_stats():
+    return jsonify(saved_template_cache.stats())
+
+@app.route('/thumbnail_cache_stats', methods=['GET'])
+@requires_stats_token
+def thumbnail_cache_stats():
+    return jsonify(thumbnail_cache.stats())
+
+@app.route('/api_executor_stats', methods=['GET'])
+@requires_stats_token
+def api_executor_stats():
+    return jsonify(api_executor.stats())
+
+if metrics:
+    metrics.add_collector('newsletter_render_cache', render_cache.stats)
+    metrics.add_collector('newsletter_service_pool', service_pool.stats)
+    metrics.add_collector('newsletter_image_pipeline', image_pipeline.stats)
+    metrics.add_collector('newsletter_image_index', image_index.stats)
+    metrics.add_collector('newsletter_drive_index', drive_index.stats)
+    metrics.add_collector('newsletter_api_executor', api_executor.stats)
+    metrics.add_collector('newsletter_saved_template_cache', saved_template_cache.stats)
+    metrics.add_collector('newsletter_live_preview', live_preview.stats)
+    metrics.add_collector('newsletter_thumbnail_cache', thumbnail_cache.stats)
+
+@app.route('/metrics', methods=['GET'])
+@requires_stats_token
+def prometheus_metrics():
+    if metrics is None:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/list_images_in_folder/<folder_id>', methods=['GET'])
 def list_images_in_folder(folder_id):
     drive_service, error_response, status_code = get_drive_service()
     if error_response:
         return error_response, status_code
 
-    images = []
-    page_token = None
+    # ?force=1 descarta las imágenes indexadas de la carpeta y la vuelve a listar
+    force = request.args.get('force') == '1'
+    account = credentials_identity(session['credentials'])
     try:
-        while True:
-            response = drive_service.files().list(
-                q="'{}' in parents and mimeType contains 'image/' and trashed=false".format(folder_id),
-                spaces='drive',
-                fields='nextPageToken, files(id, name)',
-                pageToken=page_token
-            ).execute()
-            
-            for file in response.get('files', []):
-                file_id = file.get('id')
-                direct_link = "https://lh3.googleusercontent.com/d/{}".format(file_id)
-                images.append({
-                    'id': file_id, 
-                    'name': file.get('name'), 
-                    'url': direct_link
-                })
-            
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
+        images = []
+        for image in drive_index.images(drive_service, account, folder_id, force=force):
+            direct_link = "https://lh3.googleusercontent.com/d/{}".format(image['id'])
+            images.append({
+                'id': image['id'], 
+                'name': image['name'], 
+                'url': direct_link
+            })
         
         images.sort(key=lambda x: x['name'].lower())
         return jsonify(images)
 
     except Exception as e:
         print("Error listing images in folder: {}".format(e))
+        forget_missing_folder(account, folder_id, e)
+        return jsonify({'error': 'Failed to list images from Google Drive folder'}), 500
+
+def folder_images_page(drive_service, account, folder_id, page_token=None, prefetch=False):
+    """
+    Una página de imágenes de la carpeta, ordenadas por nombre, y el token de la
+    siguiente (o None). Con prefetch=True sus primeras miniaturas se descargan ya.
+    """
+    response = drive_service.files().list(
+        q="'{}' in parents and mimeType contains 'image/' and trashed=false".format(escape_query_value(folder_id)),
+        spaces='drive',
+        fields='nextPageToken, files(id, name, md5Checksum, thumbnailLink)',
+        orderBy='name',
+        pageSize=IMAGE_PAGE_SIZE,
+        pageToken=page_token
+    ).execute()
+    files = response.get('files', [])
+    thumbnail_cache.remember_links(account, files)
+    if prefetch:
+        credentials_info = session['credentials']
+        thumbnail_cache.prefetch(account, files, THUMBNAIL_SIZE,
+                                 lambda: service_pool.get('drive', 'v3', credentials_info), service_pool.release)
+    images = []
+    for file in files:
+        file_id = file.get('id')
+        images.append({
+            'id': file_id,
+            'name': file.get('name'),
+            'url': "https://lh3.googleusercontent.com/d/{}".format(file_id),
+            # Con el md5Checksum en la URL el navegador puede guardar la miniatura indefinidamente
+            'thumbnail': url_for('image_thumbnail', image_id=file_id, s=THUMBNAIL_SIZE, v=file.get('md5Checksum'))
+        })
+    return images, response.get('nextPageToken')
+
+@app.route('/folder_images/<folder_id>', methods=['GET'])
+def folder_images(folder_id):
+    drive_service, error_response, status_code = get_drive_service()
+    if error_response:
+        return error_response, status_code
+
+    account = credentials_identity(session['credentials'])
+    try:
+        images, next_page_token = folder_images_page(drive_service, account, folder_id,
+                                                     request.args.get('page_token') or None)
+        return jsonify({'images': images, 'next_page_token': next_page_token})
+    except Exception as e:
+        print("Error listing folder images page: {}".format(e))
+        forget_missing_folder(account, folder_id, e)
         return jsonify({'error': 'Failed to list images from Google Drive folder'}), 500
 
+@app.route('/thumbnail/<image_id>', methods=['GET'])
+def image_thumbnail(image_id):
+    if 'credentials' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    try:
+        size = int(request.args.get('s', THUMBNAIL_SIZE))
+    except ValueError:
+        size = 0
+    if not 16 <= size <= 1600:
+        return jsonify({'error': 'Invalid thumbnail size'}), 400
+
+    drive_service, error_response, status_code = get_drive_service()
+    if error_response:
+        return error_response, status_code
+
+    # Con versión (md5Checksum) la URL no cambia de contenido: el navegador la guarda un año
+    # y, si aun así pregunta, se le responde 304 sin ir a disco ni a Drive
+    version = request.args.get('v')
+    cache_control = 'private, max-age=31536000, immutable' if version else 'private, max-age=3600'
+    if version and request.if_none_match.contains('{}-{}'.format(version, size)):
+        response = app.response_class(status=304)
+        response.set_etag('{}-{}'.format(version, size))
+        response.headers['Cache-Control'] = cache_control
+        return response
+    try:
+        account = credentials_identity(session['credentials'])
+        thumbnail = thumbnail_cache.get(drive_service, account, image_id, size, version)
+    except HttpError as e:
+        print("Error getting thumbnail for {}: {}".format(image_id, e))
+        status = 404 if e.resp.status == 404 else 500
+        return jsonify({'error': 'Failed to get thumbnail from Google Drive'}), status
+    except Exception as e:
+        print("Error getting thumbnail for {}: {}".format(image_id, e))
+        return jsonify({'error': 'Failed to get thumbnail from Google Drive'}), 500
+    if thumbnail is None:
+        return jsonify({'error': 'Thumbnail not available'}), 404
+
+    data, mime_type = thumbnail
+    response = app.response_class(data, mimetype=mime_type)
+    response.set_etag('{}-{}'.format(version, size) if version else hashlib.md5(data).hexdigest())
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
 @app.route('/manage_images/<folder_id>', methods=['GET'])
 def manage_images_page(folder_id):
     if 'credentials' not in session:
@@ -432,25 +1126,48 @@ def manage_images_page(folder_id):
     drive_service, error_response, status_code = get_drive_service()
     if error_response: # Si las credenciales son inválidas, redirige
         return redirect(url_for('authorize'))
+    # Solo la primera página: el resto la pide el navegador a /folder_images al desplazarse
     images = []
+    next_page_token = None
+    account = credentials_identity(session['credentials'])
     try:
-        response = drive_service.files().list(
-            q="'{}' in parents and mimeType contains 'image/' and trashed=false".format(folder_id),
-            spaces='drive',
-            fields='files(id, name)'
-        ).execute()
-        
-        for file in response.get('files', []):
-            file_id = file.get('id')
-            direct_link = "https://lh3.googleusercontent.com/d/{}".format(file_id)
-            images.append({'id': file_id, 'name': file.get('name'), 'url': direct_link})
-        
-        images.sort(key=lambda x: x['name'].lower())
+        images, next_page_token = folder_images_page(drive_service, account, folder_id, prefetch=True)
     except Exception as e:
         print("Error en manage_images_page: {}".format(e))
+        forget_missing_folder(account, folder_id, e)
         # Podrías redirigir a una página de error o de vuelta al formulario con un mensaje.
     form_data = session.get('form_data', {})
-    return render_template('manage_images.html', images=images, form_data=form_data)
+    return render_template('manage_images.html', images=images, form_data=form_data, folder_id=folder_id,
+                           next_page_token=next_page_token)
+
+# Plantillas: gzip a partir de TEMPLATE_GZIP_THRESHOLD bytes de JSON y subida simple (una
+# sola petición, desde memoria) hasta TEMPLATE_SIMPLE_UPLOAD_MAX bytes
+TEMPLATE_GZIP_THRESHOLD = int(os.environ.get('TEMPLATE_GZIP_THRESHOLD', 64 * 1024))
+TEMPLATE_SIMPLE_UPLOAD_MAX = int(os.environ.get('TEMPLATE_SIMPLE_UPLOAD_MAX', 5 * 1024 * 1024))
+
+def template_media(payload):
+    """Cuerpo de la subida de una plantilla ya serializada en memoria."""
+    from googleapiclient.http import MediaIoBaseUpload
+    return MediaIoBaseUpload(io.BytesIO(payload), mimetype='application/json', chunksize=UPLOAD_CHUNK_SIZE,
+                             resumable=len(payload) > TEMPLATE_SIMPLE_UPLOAD_MAX)
+
+def with_templates_folder(drive_service, account, call, create=True):
+    """
+    Devuelve call(ID de la carpeta "Newsletter_Templates"), o None si no existe y
+    `create` es False. Si Drive responde 404 la carpeta de la caché se ha
+    eliminado: se olvida, se resuelve de nuevo y se repite la llamada una vez.
+    """
+    folder_id = folder_cache.resolve(drive_service, account, TEMPLATES_FOLDER_NAME, create=create)
+    if not folder_id:
+        return None
+    try:
+        return call(folder_id)
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        folder_cache.invalidate(account, folder_id=folder_id)
+    folder_id = folder_cache.resolve(drive_service, account, TEMPLATES_FOLDER_NAME, create=create)
+    return call(folder_id) if folder_id else None
 
 @app.route('/save_template', methods=['POST'])
 def save_template():
@@ -474,23 +1191,19 @@ def save_template():
         filename += '.json'
 
     # 1. Buscar o crear la carpeta "Newsletter_Templates"
-    folder_name = "Newsletter_Templates"
-    query = "mimeType='application/vnd.google-apps.folder' and name='{}' and trashed=false".format(folder_name)
-    response = drive_service.files().list(q=query, spaces='drive', fields='files(id)').execute()
-    files = response.get('files', [])
-
-    if files:
-        folder_id = files[0].get('id')
-    else:
-        file_metadata = {'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder'}
-        folder = drive_service.files().create(body=file_metadata, fields='id').execute()
-        folder_id = folder.get('id')
+    account = credentials_identity(session['credentials'])
 
     # Si no se está actualizando, comprobar si el archivo ya existe
     if not file_id_to_update:
-        query_exists = "'{}' in parents and name='{}' and trashed=false".format(folder_id, filename)
-        response_exists = drive_service.files().list(q=query_exists, spaces='drive', fields='files(id)').execute()
-        existing_files = response_exists.get('files', [])
+        def find_existing(folder_id):
+            query_exists = "'{}' in parents and name='{}' and trashed=false".format(
+                folder_id, escape_query_value(filename))
+            return drive_service.files().list(q=query_exists, spaces='drive', fields='files(id)').execute()
+        try:
+            existing_files = with_templates_folder(drive_service, account, find_existing).get('files', [])
+        except Exception as e:
+            print("Error checking existing templates in Drive: {}".format(e))
+            return jsonify({'error': 'Failed to save template to Google Drive'}), 500
         if existing_files:
             return jsonify({
                 'status': 'conflict', 
@@ -498,27 +1211,30 @@ def save_template():
                 'file_id': existing_files[0].get('id')
             }), 409 # 409 Conflict
 
-    # 2. Preparar los datos y el archivo temporal
-    template_data = json.dumps(session['form_data'], indent=4)
+    # 2. Serializar los datos: JSON compacto (gzip si es grande), mismo formulario = mismo MD5
+    payload, checksum, compressed = dumps_template(session['form_data'], TEMPLATE_GZIP_THRESHOLD)
     try:
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.json', encoding='utf-8') as temp_file:
-            temp_file.write(template_data)
-            temp_file_path = temp_file.name
-
-        media = MediaFileUpload(temp_file_path, mimetype='application/json', resumable=True)
-
         if file_id_to_update:
+            # Si Drive ya tiene exactamente este contenido no se sube nada
+            current = drive_service.files().get(fileId=file_id_to_update, fields='md5Checksum').execute()
+            if current.get('md5Checksum') == checksum:
+                return jsonify({'success': True, 'unchanged': True, 'fileId': file_id_to_update,
+                                'message': 'La plantilla "{}" ya estaba guardada en Google Drive.'.format(filename)})
             # Actualizar archivo existente
-            drive_service.files().update(fileId=file_id_to_update, media_body=media).execute()
+            drive_service.files().update(fileId=file_id_to_update, media_body=template_media(payload)).execute()
+            file_id = file_id_to_update
             message = 'Plantilla "{}" sobrescrita en Google Drive.'.format(filename)
         else:
             # Crear archivo nuevo
-            file_metadata = {'name': filename, 'parents': [folder_id]}
-            drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+            created = with_templates_folder(drive_service, account, lambda folder_id: drive_service.files().create(
+                body={'name': filename, 'parents': [folder_id]}, media_body=template_media(payload),
+                fields='id').execute())
+            file_id = created.get('id')
             message = 'Plantilla "{}" guardada en Google Drive.'.format(filename)
+        saved_template_cache.store(account, file_id, payload)
 
-        os.remove(temp_file_path) # Limpiar el archivo temporal
-        return jsonify({'success': True, 'message': message})
+        return jsonify({'success': True, 'message': message, 'fileId': file_id, 'bytes': len(payload),
+                        'compressed': compressed})
     except Exception as e:
         print("Error saving template to Drive: {}".format(e))
         return jsonify({'error': 'Failed to save template to Google Drive'}), 500
@@ -529,20 +1245,27 @@ def list_templates():
     if error_response:
         return error_response, status_code
 
-    # Buscar la carpeta "Newsletter_Templates"
-    folder_name = "Newsletter_Templates"
-    query = "mimeType='application/vnd.google-apps.folder' and name='{}' and trashed=false".format(folder_name)
-    response = drive_service.files().list(q=query, spaces='drive', fields='files(id)').execute()
-    if not response.get('files', []):
+    # Listar archivos .json en la carpeta "Newsletter_Templates", sin crearla (el
+    # md5Checksum revalida la caché local)
+    def list_json_files(folder_id):
+        query = "'{}' in parents and mimeType='application/json' and trashed=false".format(folder_id)
+        return drive_service.files().list(
+            q=query, spaces='drive',
+            fields='files(id, name, md5Checksum, version, modifiedTime, viewedByMeTime)').execute()
+    account = credentials_identity(session['credentials'])
+    response = with_templates_folder(drive_service, account, list_json_files, create=False)
+    if response is None:
         return jsonify([]) # No hay carpeta, por lo tanto no hay plantillas
+    files = response.get('files', [])
 
-    folder_id = response.get('files')[0].get('id')
+    # Precargar en segundo plano las usadas más recientemente que no estén en disco
+    missing = saved_template_cache.revalidate_listing(account, files)
+    if missing:
+        credentials_info = session['credentials']
+        saved_template_cache.prefetch(account, missing, lambda: service_pool.get('drive', 'v3', credentials_info),
+                                      service_pool.release)
 
-    # Listar archivos .json en la carpeta
-    query = "'{}' in parents and mimeType='application/json' and trashed=false".format(folder_id)
-    response = drive_service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
-    templates = response.get('files', [])
-    
+    templates = [{'id': f['id'], 'name': f['name']} for f in files]
     return jsonify(sorted(templates, key=lambda x: x['name'].lower()))
 
 @app.route('/load_template/<template_id>', methods=['GET'])
@@ -553,11 +1276,12 @@ def load_template(template_id):
     if error_response: # Redirige a login si las credenciales son inválidas
         return redirect(url_for('authorize'))
     try:
-        # Forma actualizada y más simple de descargar el contenido del archivo
-        file_content = drive_service.files().get_media(fileId=template_id).execute()
-        
-        # Decodificar el contenido y cargarlo como JSON
-        template_data = json.loads(file_content.decode('utf-8'))
+        # De la caché local si no ha cambiado en Drive; si no, se descarga
+        account = credentials_identity(session['credentials'])
+        file_content = saved_template_cache.load(drive_service, account, template_id)
+
+        # Decodificar el contenido (JSON, comprimido o no) y cargarlo
+        template_data = loads_template(file_content)
         session['form_data'] = template_data
         return redirect(url_for('index'))
     except Exception as e:
@@ -572,16 +1296,12 @@ def delete_template(template_id):
         return error_response, status_code
     try:
         drive_service.files().delete(fileId=template_id).execute()
+        saved_template_cache.invalidate(credentials_identity(session['credentials']), template_id)
         return jsonify({'success': True, 'message': 'Plantilla eliminada con éxito.'})
     except Exception as e:
         print("Error deleting template from Drive: {}".format(e))
-        error_message = str(e)
-        if 'insufficient permissions' in error_message.lower():
-            return jsonify({'error': 'Permisos insuficientes para eliminar la plantilla.'}), 403
-        if 'notFound' in error_message:
-            return jsonify({'error': 'La plantilla no fue encontrada. Puede que ya haya sido eliminada.'}), 404
-        
-        return jsonify({'error': 'No se pudo eliminar la plantilla de Google Drive.'}), 500
+        status = delete_error_status(e)
+        return jsonify({'error': TEMPLATE_DELETE_ERRORS[status]}), status
 
 @app.route('/manage_images', methods=['POST'])
 def manage_images_view():
@@ -613,7 +1333,12 @@ def manage_images_view():
         return redirect(url_for('index'))
     return redirect(url_for('manage_images_page', folder_id=folder_id))
 
+if TEMPLATE_MODE == 'production':
+    precompile_templates()
+
 if __name__ == '__main__':
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
     os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
+    # Con gunicorn lo hace cada worker al arrancar (post_worker_init en gunicorn.conf.py)
+    video_upload_queue.maintenance(force=True)
     app.run(debug=True)
\ No newline at end of file
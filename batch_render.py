@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Generación de muchas variantes (idiomas, marcas...) de la misma newsletter en
+una sola llamada.
+
+Cada variante es el contexto base con sus cambios aplicados encima. Todas se
+renderizan con la misma plantilla compilada de Jinja y la misma hoja de estilos
+precompilada del inliner; si hay muchas, se reparten por lotes entre un pool de
+procesos, cada uno con su propia plantilla y hoja compiladas una sola vez.
+
+Los procesos del pool no importan app.py: usan un entorno de Jinja propio con
+las mismas opciones que el de Flask para template.html, que no usa request,
+session ni url_for, así que la salida es la misma que la de index().
+"""
+import copy
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+NEWSLETTER_TEMPLATE = 'template.html'
+
+_environment = None
+
+
+def merge_context(base, overrides):
+    """Aplica `overrides` sobre una copia de `base`: los dicts se combinan, el resto se sustituye."""
+    merged = copy.deepcopy(base)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_context(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def _template():
+    global _environment
+    if _environment is None:
+        _environment = Environment(loader=FileSystemLoader(TEMPLATES_DIR),
+                                   autoescape=select_autoescape(['html', 'htm', 'xml', 'xhtml', 'svg']))
+    return _environment.get_template(NEWSLETTER_TEMPLATE)
+
+
+def render_contexts(contexts, minify=False):
+    """Se ejecuta en el pool de procesos: renderiza e inlinea (y minifica) un lote de contextos."""
+    from inliner import inline_styles
+    template = _template()
+    htmls = [inline_styles(template.render(**context)) for context in contexts]
+    if minify:
+        from html_minify import minify_html
+        htmls = [minify_html(html) for html in htmls]
+    return htmls
+
+
+class BatchRenderer(object):
+    """Renderiza listas de contextos en este proceso o repartidas en un pool de procesos."""
+
+    def __init__(self, workers=0, parallel_min=16, minify=False):
+        self.workers = workers
+        self.minify = minify  # lo mismo que hace render_one() tras el inlineado
+        self.parallel_min = parallel_min  # por debajo no compensa enviar los contextos a otros procesos
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'))
+            return self._executor
+
+    def render(self, contexts, render_one):
+        """
+        Devuelve el HTML de cada contexto, en orden. `render_one(context)` es el
+        renderizado del propio proceso (el de Flask) para cuando no se usa el pool.
+        """
+        if not self.workers or len(contexts) < self.parallel_min:
+            return [render_one(context) for context in contexts]
+        # Unos 4 lotes por proceso: reparte bien la carga sin pagar un envío por variante
+        batch_size = max(1, -(-len(contexts) // (self.workers * 4)))
+        try:
+            futures = [self._pool().submit(render_contexts, contexts[offset:offset + batch_size], self.minify)
+                       for offset in range(0, len(contexts), batch_size)]
+            results = []
+            for future in futures:
+                results.extend(future.result())
+            return results
+        except Exception as e:
+            # Pool roto (p. ej. un proceso murió): se recrea en la próxima llamada
+            print("Error rendering in the process pool, rendering in-process: {}".format(e))
+            with self._lock:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = None
+            return [render_one(context) for context in contexts]
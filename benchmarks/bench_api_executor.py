@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Comprobaciones de api_executor contra el servidor falso de Google, con y sin
+el executor (sin él = un solo intento, sin token bucket ni coalescencia):
+
+1. Errores inyectados: 429 con Retry-After en files.list (/list_templates),
+   dos 503 en permissions.create (/upload_image) y un 403 rateLimitExceeded.
+2. Coalescencia: N pestañas del mismo usuario piden /list_templates a la vez.
+3. Cuota por usuario en el servidor falso (como la de Drive): N plantillas
+   distintas cargadas a la vez por un usuario con /load_template.
+
+Antes, sin el servidor falso, se comprueban las reglas de reintento con
+respuestas programadas (check_retry_rules): un 5xx en un POST no resumable no se
+repite, un 5xx en un GET sí, 429 y rateLimitExceeded se repiten en cualquier
+método, se respeta Retry-After y se abandona tras `max_attempts` intentos.
+
+Termina con error si el executor no recupera algún caso.
+
+Uso: python benchmarks/bench_api_executor.py [peticiones] [latencia]
+     python benchmarks/bench_api_executor.py --rules   (solo las reglas, sin servidor)
+"""
+import http.client
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
+
+from harness import FAKE_CREDENTIALS, AppServer, point_app_at, session_cookie
+from fake_google import FOLDER_MIME, FakeGoogleServer
+from bench_upload_memory import upload
+
+import app as app_module
+from api_executor import ApiExecutor
+
+executor = app_module.api_executor
+DEFAULTS = {'max_attempts': executor.max_attempts, 'rate': executor.rate, 'coalesce': executor.coalesce}
+
+
+def use_executor(enabled):
+    if enabled:
+        for name, value in DEFAULTS.items():
+            setattr(executor, name, value)
+    else:
+        executor.max_attempts, executor.rate, executor.coalesce = 1, 0, False
+
+
+def get(address, path, cookie):
+    connection = http.client.HTTPConnection(*address, timeout=120)
+    connection.request('GET', path, headers={'Cookie': cookie})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def upload_status(address, cookie, image, folder_id):
+    try:
+        upload(address, '/upload_image', len(image), 'foto.jpg', 'image/jpeg', cookie,
+               data=image, fields={'folderId': folder_id})
+        return 200
+    except RuntimeError as e:
+        return int(str(e).split(' -> ')[1].split()[0])
+    except ValueError:
+        return 500  # página de error de Flask, no JSON
+
+
+def requests_to(fake, name):
+    return fake.state.requests.get(name, 0)
+
+
+class ScriptedHttp(object):
+    """Transporte que devuelve las respuestas (estado, cabeceras, cuerpo) indicadas, en orden."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        status, headers, body = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return httplib2.Response(dict(headers, status=str(status))), body
+
+
+def rate_limit_body(reason):
+    return json.dumps({'error': {'code': 403, 'message': reason, 'errors': [{'reason': reason}]}}).encode('utf-8')
+
+
+def check_retry_rules():
+    """Reglas de reintento de ApiExecutor con respuestas programadas. Devuelve los casos que fallan."""
+    checker = ApiExecutor(max_attempts=3, base_delay=0.01, max_delay=5, rate=0, coalesce=False)
+    build_request = checker.request_builder('usuario')
+    ok = (200, {}, b'{"id": "file1"}')
+    error = (503, {}, b'{}')
+    cases = [
+        # (nombre, método, respuestas, llamadas esperadas, termina bien, espera mínima)
+        ('503 en POST files.create: sin reintento', 'POST', [error, ok], 1, False, 0),
+        ('503 en GET files.list: reintento', 'GET', [error, ok], 2, True, 0),
+        ('429 Retry-After: 1 en POST: reintento tras 1 s', 'POST', [(429, {'retry-after': '1'}, b'{}'), ok], 2, True, 1),
+        ('403 rateLimitExceeded en POST: reintento', 'POST', [(403, {}, rate_limit_body('rateLimitExceeded')), ok],
+         2, True, 0),
+        ('403 sin límite de cuota: sin reintento', 'GET', [(403, {}, rate_limit_body('forbidden')), ok], 1, False, 0),
+        ('503 siempre en GET: abandona tras 3 intentos', 'GET', [error], 3, False, 0),
+    ]
+    failures = []
+    print('0. Reglas de reintento (sin servidor)')
+    for name, method, responses, expected_calls, succeeds, min_wait in cases:
+        http = ScriptedHttp(*responses)
+        request = build_request(http, JsonModel().response, 'https://www.googleapis.com/drive/v3/files',
+                                method=method, body='{}' if method == 'POST' else None, headers={},
+                                methodId='drive.files.test')
+        start = time.perf_counter()
+        try:
+            request.execute()
+            succeeded = True
+        except HttpError:
+            succeeded = False
+        elapsed = time.perf_counter() - start
+        passed = http.calls == expected_calls and succeeded == succeeds and elapsed >= min_wait
+        print('   {:<48} {} llamadas, {:<5} en {:.2f} s {}'.format(
+            name, http.calls, 'bien' if succeeded else 'error', elapsed, '' if passed else '<- FALLA'))
+        if not passed:
+            failures.append(name)
+    return failures
+
+
+def main():
+    failures = check_retry_rules()
+    if sys.argv[1:] == ['--rules']:
+        if failures:
+            sys.exit('Reglas de reintento incorrectas: {}'.format(', '.join(failures)))
+        return
+    concurrent = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    app_module.image_pipeline.enabled = False
+    app_module.IMAGE_DEDUP = False
+
+    fake = FakeGoogleServer(latency=latency).start()
+    point_app_at(fake)
+    server = AppServer().start()
+    templates_id = fake.state.add_file(app_module.TEMPLATES_FOLDER_NAME, FOLDER_MIME)['id']
+    templates = [fake.state.add_file('plantilla_{}.json'.format(i), 'application/json', parents=[templates_id],
+                                     data=json.dumps({'title': 'Plantilla {}'.format(i)}).encode('utf-8'))['id']
+                 for i in range(concurrent)]
+    images_id = fake.state.add_file('Imagenes', FOLDER_MIME)['id']
+    image = os.urandom(64 * 1024)
+
+    print('1. Errores inyectados')
+    cases = [
+        ('429 Retry-After: 1 en files.list', 'GET', r'^/drive/v3/files$', 429, 1, 1,
+         lambda cookie: get(server.address, '/list_templates', cookie)),
+        ('2 x 429 en permissions.create', 'POST', r'/permissions$', 429, 2, None,
+         lambda cookie: upload_status(server.address, cookie, image, images_id)),
+        ('403 rateLimitExceeded en files.get', 'GET', r'^/drive/v3/files/file', 403, 1, None,
+         lambda cookie: get(server.address, '/load_template/{}'.format(templates[0]), cookie)),
+    ]
+    for name, method, pattern, status, times, retry_after, call in cases:
+        for enabled in (False, True):
+            use_executor(enabled)
+            cookie = session_cookie()
+            fake.state.inject_errors(method, pattern, status, times=times, retry_after=retry_after)
+            start = time.perf_counter()
+            result = call(cookie)
+            fake.state.faults[:] = []
+            print('   {:<36} {:<13} HTTP {} en {:.2f} s'.format(
+                name, 'con executor' if enabled else 'sin executor', result, time.perf_counter() - start))
+            if enabled and result not in (200, 302):
+                failures.append(name)
+
+    print('2. Coalescencia: {} /list_templates simultáneos del mismo usuario'.format(concurrent))
+    for enabled in (False, True):
+        use_executor(enabled)
+        cookie = session_cookie()
+        get(server.address, '/list_templates', cookie)  # carpeta ya resuelta en folder_cache
+        before = requests_to(fake, 'files.list')
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrent) as pool:
+            statuses = list(pool.map(lambda _: get(server.address, '/list_templates', cookie), range(concurrent)))
+        print('   {:<13} files.list a Google: {:>3}, HTTP 200: {:>3}/{}, {:.2f} s'.format(
+            'con executor' if enabled else 'sin executor', requests_to(fake, 'files.list') - before,
+            statuses.count(200), concurrent, time.perf_counter() - start))
+        if enabled and statuses.count(200) != concurrent:
+            failures.append('coalescencia')
+
+    # Por encima de lo que deja pasar el token bucket por defecto (ráfaga de 20 + 10/s)
+    quota = (30, 1.0)
+    print('3. Cuota del servidor falso de {} peticiones/{:.0f} s por usuario: {} /load_template distintos a la vez'.format(
+        quota[0], quota[1], concurrent))
+    for enabled in (False, True):
+        use_executor(enabled)
+        # Otro usuario (otro token): su ventana de cuota empieza vacía
+        cookie = session_cookie(dict(FAKE_CREDENTIALS, token='quota-{}'.format(enabled)))
+        fake.state.user_quota = quota
+        limited_before = requests_to(fake, 'rate_limited')
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrent) as pool:
+            statuses = list(pool.map(lambda template_id: get(server.address, '/load_template/' + template_id, cookie),
+                                     templates))
+        fake.state.user_quota = None
+        ok = statuses.count(302)
+        print('   {:<13} cargadas: {:>3}/{}, 429 de Google: {:>3}, {:.2f} s'.format(
+            'con executor' if enabled else 'sin executor', ok, concurrent,
+            requests_to(fake, 'rate_limited') - limited_before, time.perf_counter() - start))
+        if enabled and ok != concurrent:
+            failures.append('cuota')
+
+    use_executor(True)
+    print(executor.stats())
+    server.stop()
+    fake.stop()
+    if failures:
+        sys.exit('El executor no recuperó: {}'.format(', '.join(failures)))
+
+
+if __name__ == '__main__':
+    main()
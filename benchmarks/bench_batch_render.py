@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput de la generación de variantes: un POST a / por variante frente a
+una sola llamada a /render_batch, en el worker web y con pool de procesos.
+Cada variante cambia título y textos, así que ninguna sale de la caché.
+
+Uso: python benchmarks/bench_batch_render.py [procesos del pool] [variantes ...]
+"""
+import os
+import sys
+import time
+
+from bench_inline import build_context
+from harness import session_cookie
+
+import app as app_module
+from batch_render import BatchRenderer
+
+
+def form_fields(context):
+    fields = {key: value for key, value in context.items() if key != 'sections'}
+    for section in context['sections']:
+        for key, value in section.items():
+            if key != 'id':
+                fields['section{}_{}'.format(section['id'], key)] = value
+    return fields
+
+
+def variants(count, salt):
+    return [{'name': 'variante_{}'.format(i), 'overrides': {
+        'title': 'Newsletter {} #{}'.format(salt, i),
+        'intro_title': 'Descubre el CITED ({})'.format(i),
+        'intro_p1': 'Texto traducido {} de la variante {}.'.format(salt, i),
+    }} for i in range(count)]
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 2)
+    counts = [int(arg) for arg in sys.argv[2:]] or [1, 50, app_module.BATCH_RENDER_MAX_VARIANTS]
+    base = build_context(8)
+    client = app_module.app.test_client()
+    client.set_cookie(*session_cookie().split('=', 1))
+    client.post('/render_batch', json={'base': base, 'variants': variants(1, 'calentamiento')})
+
+    print('{:>10} {:>26} {:>10} {:>14}'.format('variantes', 'modo', 'seg', 'variantes/s'))
+    for count in counts:
+        # Un POST a / por variante, como hasta ahora
+        start = time.perf_counter()
+        for variant in variants(count, 'form{}'.format(count)):
+            context = dict(base, **variant['overrides'])
+            client.post('/', data=form_fields(context))
+        elapsed = time.perf_counter() - start
+        print('{:>10} {:>26} {:>10.2f} {:>14.1f}'.format(count, 'POST / por variante', elapsed, count / elapsed))
+
+        for mode, renderer in (('/render_batch', BatchRenderer(workers=0)),
+                               ('/render_batch {} procesos'.format(workers),
+                                BatchRenderer(workers=workers, parallel_min=2))):
+            app_module.batch_renderer = renderer
+            if renderer.workers:
+                # Arranca los procesos del pool antes de medir
+                client.post('/render_batch', json={'base': base, 'variants': variants(workers * 4, 'pool')})
+            start = time.perf_counter()
+            response = client.post('/render_batch', json={'base': base, 'variants': variants(count, mode + str(count))})
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 200 and len(response.get_json()['variants']) == count
+            print('{:>10} {:>26} {:>10.2f} {:>14.1f}'.format(count, mode, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Arranque en frío de un worker de gunicorn: cuánto tarda en atender y cuánto
+tardan sus primeras peticiones (GET / con index.html, POST / con template.html,
+el inliner y result.html) frente a las de un worker ya caliente.
+
+Se mide al arrancar gunicorn y al reponer el worker tras matarlo (kill -9),
+que es lo que pasa en producción con max_requests, timeouts o un OOM, en:
+
+- dev: TEMPLATE_MODE=development, sin preload (el comportamiento anterior).
+- prod-sin-cache: TEMPLATE_MODE=production sin preload y sin bytecode guardado.
+- prod-cache: igual, con el bytecode ya en TEMPLATE_CACHE_DIR.
+- prod-preload: TEMPLATE_MODE=production con preload_app (por defecto).
+
+Uso: python benchmarks/bench_cold_start.py [repeticiones]
+"""
+import http.client
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+SCENARIOS = [
+    ('dev', {'TEMPLATE_MODE': 'development', 'PRELOAD_APP': '0'}, False),
+    ('prod-sin-cache', {'TEMPLATE_MODE': 'production', 'PRELOAD_APP': '0'}, False),
+    ('prod-cache', {'TEMPLATE_MODE': 'production', 'PRELOAD_APP': '0'}, True),
+    ('prod-preload', {'TEMPLATE_MODE': 'production', 'PRELOAD_APP': '1'}, False),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def call(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+    start = time.perf_counter()
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return response.status, elapsed
+
+
+def wait_ready(port, since, timeout=60):
+    """Segundos desde `since` hasta que el worker responde (a una ruta sin plantillas)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            call(port, 'GET', '/__ping')
+            return time.perf_counter() - since
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError('gunicorn did not start')
+
+
+def newsletter_form(n):
+    return urlencode({
+        'title': 'Newsletter {}'.format(n), 'intro_title': 'Hola', 'intro_p1': 'Texto ' * 50,
+        'bg_type': 'color', 'bg_color': '#ffffff', 'section1_title': 'Sección', 'section1_p': 'Texto ' * 30,
+    })
+
+
+def first_requests(port, counter):
+    """Latencia (ms) del primer GET / y del primer POST / de un worker recién arrancado."""
+    status, get_s = call(port, 'GET', '/')
+    assert status == 200, status
+    counter[0] += 1
+    status, post_s = call(port, 'POST', '/', newsletter_form(counter[0]))
+    assert status == 200, status
+    return 1000 * get_s, 1000 * post_s
+
+
+def warm_requests(port, counter, rounds=10):
+    gets, posts = [], []
+    for _ in range(rounds):
+        gets.append(1000 * call(port, 'GET', '/')[1])
+        counter[0] += 1
+        posts.append(1000 * call(port, 'POST', '/', newsletter_form(counter[0]))[1])
+    return statistics.median(gets), statistics.median(posts)
+
+
+def worker_pid(master_pid):
+    with open('/proc/{0}/task/{0}/children'.format(master_pid)) as f:
+        children = f.read().split()
+    return int(children[0]) if children else None
+
+
+def run_scenario(env, port, counter):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT_DIR, 'gunicorn.conf.py'),
+         '--workers', '1', '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'critical', 'app:app'],
+        env=env, cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+    try:
+        boot = wait_ready(port, start)
+        boot_get, boot_post = first_requests(port, counter)
+        warm_get, warm_post = warm_requests(port, counter)
+
+        old_pid = worker_pid(process.pid)
+        killed = time.perf_counter()
+        os.kill(old_pid, signal.SIGKILL)
+        while worker_pid(process.pid) in (None, old_pid):
+            time.sleep(0.001)
+        respawn = wait_ready(port, killed)
+        respawn_get, respawn_post = first_requests(port, counter)
+        return {
+            'boot_s': boot, 'boot_get': boot_get, 'boot_post': boot_post,
+            'respawn_ms': 1000 * respawn, 'respawn_get': respawn_get, 'respawn_post': respawn_post,
+            'warm_get': warm_get, 'warm_post': warm_post,
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    temp_dir = tempfile.mkdtemp()
+    counter = [0]
+    print('{:<15} {:>8} {:>9} {:>10} {:>10} {:>9} {:>10} {:>10} {:>9}'.format(
+        'escenario', 'boot s', 'GET1 ms', 'POST1 ms', 'respawn', 'GET1 ms', 'POST1 ms', 'warm GET', 'warm POST'))
+    try:
+        for name, overrides, keep_cache in SCENARIOS:
+            cache_dir = os.path.join(temp_dir, 'jinja-' + name)
+            env = dict(os.environ, SESSION_SQLITE_PATH=os.path.join(temp_dir, 'sessions.sqlite3'),
+                       UPLOAD_JOB_DB=os.path.join(temp_dir, 'jobs.sqlite3'),
+                       TEMPLATE_CACHE_DIR=cache_dir, **overrides)
+            results = []
+            for _ in range(repeats):
+                if keep_cache:
+                    # Bytecode guardado por un arranque anterior
+                    subprocess.run([sys.executable, '-c', 'import app'], env=dict(env, PRELOAD_APP='0'),
+                                   cwd=ROOT_DIR, stdout=subprocess.DEVNULL, check=True)
+                else:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                results.append(run_scenario(env, free_port(), counter))
+            median = {key: statistics.median(r[key] for r in results) for key in results[0]}
+            print('{:<15} {boot_s:>8.2f} {boot_get:>9.1f} {boot_post:>10.1f} {respawn_ms:>8.0f}ms '
+                  '{respawn_get:>9.1f} {respawn_post:>10.1f} {warm_get:>10.1f} {warm_post:>9.1f}'.format(name, **median))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Peticiones simultáneas que atiende UN worker de gunicorn en cada WORKER_MODE
+(sync, gthread, gevent) con las rutas que esperan a Google: cada llamada al
+servidor falso tarda `latencia` segundos.
+
+Uso: python benchmarks/bench_concurrency.py [peticiones] [latencia] [modo ...]
+     (en modo sync cada petición espera a las anteriores: mejor con pocas, p. ej. 20)
+"""
+import http.client
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_google import FOLDER_MIME, FakeGoogleServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+BOUNDARY = 'benchboundary'
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'\0' * (64 * 1024)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def image_body(folder_id):
+    return ('--{b}\r\nContent-Disposition: form-data; name="folderId"\r\n\r\n{f}\r\n'
+            '--{b}\r\nContent-Disposition: form-data; name="file"; filename="foto.png"\r\n'
+            'Content-Type: image/png\r\n\r\n').format(b=BOUNDARY, f=folder_id).encode('ascii') + IMAGE + \
+        '\r\n--{b}--\r\n'.format(b=BOUNDARY).encode('ascii')
+
+
+def start_gunicorn(mode, port, env):
+    env = dict(env, WORKER_MODE=mode)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT_DIR, 'gunicorn.conf.py'),
+         '--workers', '1', '--bind', '127.0.0.1:{}'.format(port), '--chdir', BENCH_DIR,
+         '--log-level', 'warning', 'gunicorn_app:app'],
+        env=env, cwd=ROOT_DIR)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def call(port, method, path, cookie, body=None, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    headers = dict(headers or {}, Cookie=cookie)
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def run_load(port, cookies, method, path, body=None, headers=None):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(cookies)) as pool:
+        statuses = list(pool.map(lambda cookie: call(port, method, path, cookie, body, headers), cookies))
+    elapsed = time.perf_counter() - start
+    return sum(1 for status in statuses if status == 200), elapsed
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    modes = sys.argv[3:] or ['gthread'] + (['gevent'] if importlib.util.find_spec('gevent') else [])
+
+    fake = FakeGoogleServer(latency=latency, store_media=False).start()
+    folder = fake.state.add_file('Newsletter', FOLDER_MIME)
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ,
+               FAKE_GOOGLE_URL=fake.base_url,
+               SERVICE_POOL_SIZE=str(4 * requests),
+               SESSION_SQLITE_PATH=os.path.join(workdir, 'sessions.sqlite3'),
+               PYTHONPATH=os.pathsep.join([ROOT_DIR, BENCH_DIR]))
+    os.environ['SESSION_SQLITE_PATH'] = env['SESSION_SQLITE_PATH']
+    from harness import FAKE_CREDENTIALS, session_cookie
+    # Un usuario distinto por petición, como en producción
+    cookies = [session_cookie(dict(FAKE_CREDENTIALS, token='fake-token-{}'.format(i))) for i in range(requests)]
+
+    upload_headers = {'Content-Type': 'multipart/form-data; boundary={}'.format(BOUNDARY)}
+    loads = [
+        ('/upload_image', 'POST', '/upload_image', image_body(folder['id']), upload_headers),
+        ('/list_drive_folders', 'GET', '/list_drive_folders?force=1', None, None),
+    ]
+    print('{} peticiones simultáneas (una por usuario), {:.0f} ms por llamada a Google, 1 worker'.format(requests, 1000 * latency))
+    print('{:>8} {:>20} {:>6} {:>10} {:>10} {:>12}'.format('modo', 'ruta', 'ok', 'seg', 'req/s', 'en vuelo'))
+    for mode in modes:
+        port = free_port()
+        process = start_gunicorn(mode, port, env)
+        try:
+            for name, method, path, body, headers in loads:
+                # Primera ronda sin medir: construye el servicio de cada usuario en el pool
+                run_load(port, cookies, method, path, body, headers)
+                fake.state.max_in_flight = 0
+                ok, elapsed = run_load(port, cookies, method, path, body, headers)
+                # Llamadas a Google que el worker llegó a tener en curso a la vez
+                in_flight = fake.state.max_in_flight
+                print('{:>8} {:>20} {:>6} {:>10.2f} {:>10.1f} {:>12}'.format(
+                    mode, name, ok, elapsed, ok / elapsed, in_flight))
+        finally:
+            process.terminate()
+            process.wait()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Campañas recurrentes contra el servidor falso de Drive: cada semana se suben
+el mismo logo y los mismos banners más algunas fotos nuevas por /upload_image.
+Compara bytes enviados a Drive, llamadas a la API y tiempo con y sin la
+deduplicación por hash de contenido.
+
+Uso: python benchmarks/bench_dedup.py [semanas] [latencia]
+"""
+import os
+import sys
+import time
+
+from harness import AppServer, point_app_at, session_cookie
+from fake_google import FOLDER_MIME, FakeGoogleServer
+from bench_upload_memory import upload
+
+import app as app_module
+
+RECURRING = [('logo.png', 300 * 1024), ('banner_1.jpg', 900 * 1024), ('banner_2.jpg', 900 * 1024),
+             ('pie.png', 200 * 1024)]
+NEW_PER_WEEK = [('foto_{}_{}.jpg', 1500 * 1024), ('foto_{}_{}.jpg', 1500 * 1024)]
+
+
+def main():
+    weeks = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    recurring = [(name, os.urandom(size)) for name, size in RECURRING]
+    # Sin Pillow que decodifique bytes aleatorios: se mide solo la deduplicación
+    app_module.image_pipeline.enabled = False
+
+    print('{:>6} {:>8} {:>14} {:>8} {:>8} {:>8} {:>8}'.format(
+        'dedup', 'semanas', 'bytes a Drive', 'subidas', 'permisos', 'listados', 'seg'))
+    fake = FakeGoogleServer(latency=latency, store_media=False).start()
+    point_app_at(fake)
+    server = AppServer().start()
+    cookie = session_cookie()
+    for dedup in (False, True):
+        app_module.IMAGE_DEDUP = dedup
+        folder_id = fake.state.add_file('Newsletter_Imagenes_{}'.format(dedup), FOLDER_MIME)['id']
+        bytes_before = fake.state.bytes_received
+        requests_before = dict(fake.state.requests)
+        start = time.perf_counter()
+        for week in range(weeks):
+            images = recurring + [(name.format(week, i), os.urandom(size))
+                                  for i, (name, size) in enumerate(NEW_PER_WEEK)]
+            for name, data in images:
+                upload(server.address, '/upload_image', len(data), name, 'image/jpeg', cookie,
+                       data=data, fields={'folderId': folder_id})
+        elapsed = time.perf_counter() - start
+        requests = {name: count - requests_before.get(name, 0) for name, count in fake.state.requests.items()}
+        print('{:>6} {:>8} {:>14} {:>8} {:>8} {:>8} {:>8.2f}'.format(
+            'sí' if dedup else 'no', weeks, fake.state.bytes_received - bytes_before, requests.get('files.create', 0),
+            requests.get('permissions.create', 0), requests.get('files.list', 0), elapsed))
+    print(app_module.image_index.stats())
+    server.stop()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
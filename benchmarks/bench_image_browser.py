@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Tiempo hasta ver la primera pantalla de /manage_images/<carpeta> con 1.000
+imágenes en el servidor falso de Google: la página y las imágenes de las
+primeras tarjetas, pedidas como un navegador (6 conexiones a la vez).
+
+- antes: la página listaba solo la primera página de files.list (100
+  imágenes, sin pageToken) y el navegador descargaba todas a tamaño completo
+  de lh3.googleusercontent.com (sin loading="lazy").
+- miniaturas, caché vacía: primera página (IMAGE_PAGE_SIZE) y miniaturas de la
+  primera pantalla a través de /thumbnail, que las descarga de Drive.
+- miniaturas, caché en disco: otro navegador; las miniaturas salen de disco.
+- miniaturas, revalidación: el navegador ya las tiene y pregunta con
+  If-None-Match (304, sin ir a disco ni a Drive). Con Cache-Control immutable
+  normalmente ni siquiera pregunta.
+
+En local el ancho de banda no cuenta: la columna "ms a N Mbit/s" suma el
+tiempo de descargar los bytes de la primera pantalla con esa conexión.
+Al final, lo que tarda recorrer la carpeta entera con /folder_images.
+
+Uso: python benchmarks/bench_image_browser.py [imágenes] [KB por imagen] [latencia] [Mbit/s]
+"""
+import glob
+import http.client
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+os.environ.setdefault('THUMBNAIL_CACHE_DIR', tempfile.mkdtemp(prefix='bench_thumbnails_'))
+
+from harness import FAKE_CREDENTIALS, AppServer, get_json, point_app_at, session_cookie
+from fake_google import FOLDER_MIME, FakeGoogleServer
+
+import app as app_module
+
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+# Tarjetas visibles sin desplazarse (4 filas de 6 en la rejilla de 1200 px)
+FIRST_SCREEN = 24
+BROWSER_CONNECTIONS = 6
+_IMG_SRC = re.compile(r'<img src="([^"]+)"')
+
+
+def fetch(address, path, headers=None):
+    """(estado, bytes del cuerpo) de un GET."""
+    connection = http.client.HTTPConnection(*address, timeout=120)
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, body
+
+
+def main():
+    num_images = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    image_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    mbps = float(sys.argv[4]) if len(sys.argv) > 4 else 50
+    fake = FakeGoogleServer(latency=latency).start()
+    point_app_at(fake)
+    server = AppServer().start()
+    cookie = session_cookie()
+    folder_id = fake.state.add_file('Campaña', FOLDER_MIME)['id']
+    image = os.urandom(image_kb * 1024)
+    for i in range(num_images):
+        fake.state.add_file('imagen_{:04d}.jpg'.format(i), 'image/jpeg', parents=[folder_id], data=image)
+    fake_address = urlparse(fake.base_url).netloc.split(':')
+    fake_address = (fake_address[0], int(fake_address[1]))
+
+    def full_image(src):
+        # Lo que hacía el navegador: la imagen original de lh3.googleusercontent.com
+        return fetch(fake_address, urlparse(src).path)[1]
+
+    def thumbnail(src, headers=None):
+        status, body = fetch(server.address, src, dict(headers or {}, Cookie=cookie))
+        assert status in (200, 304), (status, body[:200])
+        return body
+
+    def revalidate(src):
+        version, size = re.search(r'[?&]s=(\d+)&v=([0-9a-f]+)', src).group(2, 1)
+        return thumbnail(src, {'If-None-Match': '"{}-{}"'.format(version, size)})
+
+    print('{} imágenes de {} KB, latencia de Google {:.0f} ms'.format(num_images, image_kb, 1000 * latency))
+    print('{:<32} {:>8} {:>15} {:>9} {:>9} {:>11}'.format(
+        'primera pantalla', 'ms', 'ms a {:g} Mbit/s'.format(mbps), 'KB', 'tarjetas', 'peticiones'))
+
+    def report(name, measure):
+        requests_before = fake.state.requests.get('http_requests', 0)
+        elapsed, first_screen_bytes, size, cards = measure()
+        print('{:<32} {:>8.1f} {:>15.1f} {:>9.0f} {:>9} {:>11}'.format(
+            name, elapsed, elapsed + first_screen_bytes * 8 / (mbps * 1000.0), size / 1024.0, cards,
+            fake.state.requests.get('http_requests', 0) - requests_before))
+
+    # Antes: files.list sin paginar (100 por página en Drive) y todas las imágenes a tamaño completo
+    def before():
+        service = app_module.build_service('drive', 'v3', FAKE_CREDENTIALS)
+        start = time.perf_counter()
+        files = service.files().list(
+            q="'{}' in parents and mimeType contains 'image/' and trashed=false".format(folder_id),
+            spaces='drive', fields='files(id, name)').execute().get('files', [])
+        page = app_module.app.jinja_env.get_template('manage_images.html').render(
+            images=[{'id': f['id'], 'name': f['name'], 'thumbnail': 'https://lh3.googleusercontent.com/d/' + f['id'],
+                     'url': 'https://lh3.googleusercontent.com/d/' + f['id']} for f in files],
+            url_for=lambda *args, **kwargs: '/', folder_id=folder_id, next_page_token=None)
+        with ThreadPoolExecutor(max_workers=BROWSER_CONNECTIONS) as browser:
+            futures = [browser.submit(full_image, 'https://lh3.googleusercontent.com/d/' + f['id']) for f in files]
+            first_screen_bytes = len(page.encode('utf-8')) + sum(len(f.result()) for f in futures[:FIRST_SCREEN])
+            elapsed = time.perf_counter() - start
+            size = first_screen_bytes + sum(len(future.result()) for future in futures[FIRST_SCREEN:])
+        return 1000 * elapsed, first_screen_bytes, size, len(files)
+
+    def thumbnails(fetch_image):
+        def measure():
+            start = time.perf_counter()
+            status, page = fetch(server.address, '/manage_images/' + folder_id, {'Cookie': cookie})
+            assert status == 200, status
+            sources = [src.replace('&amp;', '&') for src in _IMG_SRC.findall(page.decode('utf-8'))]
+            # loading="lazy": solo se piden las de la primera pantalla
+            with ThreadPoolExecutor(max_workers=BROWSER_CONNECTIONS) as browser:
+                size = sum(len(body) for body in browser.map(fetch_image, sources[:FIRST_SCREEN]))
+            return 1000 * (time.perf_counter() - start), len(page) + size, len(page) + size, len(sources)
+        return measure
+
+    for path in glob.glob(os.path.join(app_module.thumbnail_cache.directory, '*.thumbnail')):
+        os.remove(path)
+    report('antes: original, sin paginar', before)
+    report('miniaturas, caché vacía', thumbnails(thumbnail))
+    report('miniaturas, caché en disco', thumbnails(thumbnail))
+    report('miniaturas, revalidación (304)', thumbnails(revalidate))
+
+    # La carpeta completa, página a página como al desplazarse
+    requests_before = fake.state.requests.get('http_requests', 0)
+    start = time.perf_counter()
+    status, page = fetch(server.address, '/manage_images/' + folder_id, {'Cookie': cookie})
+    token = re.search(r'data-next-page-token="([^"]*)"', page.decode('utf-8')).group(1)
+    listed = len(_IMG_SRC.findall(page.decode('utf-8')))
+    pages = 1
+    while token:
+        status, payload = get_json(server.address, '/folder_images/{}?page_token={}'.format(folder_id, token), cookie)
+        assert status == 200, payload
+        listed += len(payload['images'])
+        token = payload['next_page_token']
+        pages += 1
+    print('carpeta completa: {} imágenes en {} páginas, {:.1f} ms, {} peticiones a Google'.format(
+        listed, pages, 1000 * (time.perf_counter() - start), fake.state.requests.get('http_requests', 0) - requests_before))
+    assert listed == num_images, listed
+    print(app_module.thumbnail_cache.stats())
+    server.stop()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
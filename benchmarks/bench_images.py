@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Bytes ahorrados y tiempo de codificación del pipeline de imágenes con fotos
+sintéticas tipo cámara (JPEG de alta calidad con EXIF) y un PNG con
+transparencia, y bytes que llegan a Drive por /upload_image con y sin él.
+
+Uso: python benchmarks/bench_images.py [ancho máximo]
+"""
+import io
+import sys
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from harness import AppServer, point_app_at, session_cookie
+from fake_google import FakeGoogleServer
+from bench_upload_memory import upload
+
+import app as app_module
+from werkzeug.datastructures import FileStorage
+
+
+def camera_photo(width, height, seed):
+    """Degradado con ruido suavizado: se comprime como una foto real, no como ruido puro."""
+    noise = Image.effect_noise((width // 8, height // 8), 60 + seed).resize((width, height), Image.BICUBIC)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5)))
+    draw = ImageDraw.Draw(image)
+    for i in range(40):
+        x, y = (i * 97 * (seed + 1)) % width, (i * 53 * (seed + 2)) % height
+        draw.ellipse((x, y, x + width // 10, y + width // 10), fill=(i * 6 % 255, 120, 200 - i * 4))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    exif = Image.Exif()
+    exif[0x0112] = 1  # Orientation
+    exif[0x010F] = 'Camera'  # Make
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=95, exif=exif)
+    return out.getvalue()
+
+
+def logo_png(width, height):
+    image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.rounded_rectangle((10, 10, width - 10, height - 10), radius=40, fill=(20, 80, 160, 255))
+    draw.text((width // 3, height // 2), 'CITED', fill=(255, 255, 255, 255))
+    out = io.BytesIO()
+    image.save(out, 'PNG')
+    return out.getvalue()
+
+
+def main():
+    max_width = int(sys.argv[1]) if len(sys.argv) > 1 else 1080
+    samples = [
+        ('foto 4000x3000.jpg', camera_photo(4000, 3000, 1), 'image/jpeg'),
+        ('foto 3024x4032.jpg', camera_photo(3024, 4032, 2), 'image/jpeg'),
+        ('foto 1600x1200.jpg', camera_photo(1600, 1200, 3), 'image/jpeg'),
+        ('logo 1200x400.png', logo_png(1200, 400), 'image/png'),
+    ]
+    pipeline = app_module.image_pipeline
+    # El primer uso arranca los procesos del pool: una ronda sin medir
+    for name, data, mimetype in samples:
+        pipeline.optimize(FileStorage(io.BytesIO(data), name, content_type=mimetype), max_width)
+
+    print('{:>20} {:>12} {:>12} {:>8} {:>10} {:>8}'.format('imagen', 'original', 'optimizada', 'ahorro', 'ms', 'formato'))
+    for name, data, mimetype in samples:
+        _, report = pipeline.optimize(FileStorage(io.BytesIO(data), name, content_type=mimetype), max_width)
+        print('{:>20} {:>12} {:>12} {:>7.0%} {:>10.1f} {:>8}'.format(
+            name, report['originalBytes'], report['optimizedBytes'],
+            report['savedBytes'] / float(report['originalBytes']), report['encodeMs'], report.get('format', '-')))
+
+    fake = FakeGoogleServer(store_media=False).start()
+    point_app_at(fake)
+    server = AppServer().start()
+    cookie = session_cookie()
+    for enabled in (False, True):
+        pipeline.enabled = enabled
+        before = fake.state.bytes_received
+        for name, data, mimetype in samples[:3]:
+            upload(server.address, '/upload_image', len(data), name, mimetype, cookie, data=data)
+        print('/upload_image {} pipeline: {:>10} bytes enviados a Drive'.format(
+            'con' if enabled else 'sin', fake.state.bytes_received - before))
+    server.stop()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark del inlining de CSS: Pynliner frente a la hoja precompilada.
+
+Uso: python benchmarks/bench_inline.py [segundos_por_caso]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template
+from pynliner import Pynliner
+
+from app import app
+from inliner import inline_styles
+
+
+def build_context(num_sections):
+    return {
+        'title': 'Newsletter CITED Cantabria',
+        'header_logo_link': 'https://educantabria.es/web/cited',
+        'header_logo_src': 'https://lh3.googleusercontent.com/d/logo',
+        'hero_link': 'https://educantabria.es/web/cited',
+        'hero_src': 'https://lh3.googleusercontent.com/d/hero',
+        'hero_alt': 'Innovación y Formación CITED',
+        'intro_title': 'Descubre el CITED',
+        'intro_p1': 'El <strong>CITED</strong> es tu punto de referencia &amp; más.',
+        'intro_p2': 'Explora nuestras nuevas líneas de formación.',
+        'video_title': 'Conoce el CITED en 1 Minuto',
+        'video_p': 'Descubre nuestras instalaciones.',
+        'video_link': 'https://www.youtube.com/watch?v=abc',
+        'video_thumbnail_src': 'https://lh3.googleusercontent.com/d/thumb',
+        'video_thumbnail_alt': 'Ver video',
+        'footer_web_link': 'https://educantabria.es/web/cited',
+        'footer_text_main': '<strong>CITED</strong><br>Gobierno de Cantabria',
+        'footer_web_text': 'educantabria.es/web/cited',
+        'footer_legal_text': 'Has recibido este correo como miembro de la comunidad educativa.',
+        'bg_type': 'solid',
+        'bg_color': '#f2f2f2',
+        'title_color': '#333333',
+        'text_color': '#555555',
+        'button_color': '#005a9e',
+        'font_family': 'Arial, sans-serif',
+        'title_font_size': '24px',
+        'sections': [{
+            'id': str(i),
+            'img_src': 'https://lh3.googleusercontent.com/d/img{}'.format(i),
+            'img_alt': 'Imagen {}'.format(i),
+            'title': 'Sección {}'.format(i),
+            'p': 'Texto de la sección {} con <strong>negrita</strong> &amp; entidades.'.format(i),
+            'button_link': 'https://educantabria.es/{}'.format(i),
+            'button_text': 'Más información',
+        } for i in range(1, num_sections + 1)],
+    }
+
+
+def render(num_sections):
+    with app.test_request_context():
+        return render_template('template.html', **build_context(num_sections))
+
+
+def measure(func, html, seconds):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        func(html)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return runs / elapsed
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    print('{:>9} {:>14} {:>14} {:>8}'.format('secciones', 'pynliner r/s', 'compilado r/s', 'mejora'))
+    for num_sections in (1, 10, 100):
+        html = render(num_sections)
+        expected = Pynliner().from_string(html).run()
+        if inline_styles(html) != expected:
+            sys.exit('La salida compilada difiere de Pynliner con {} secciones'.format(num_sections))
+        baseline = measure(lambda h: Pynliner().from_string(h).run(), html, seconds)
+        compiled = measure(inline_styles, html, seconds)
+        print('{:>9} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(num_sections, baseline, compiled, compiled / baseline))
+
+
+if __name__ == '__main__':
+    main()
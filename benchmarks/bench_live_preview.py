@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Vista previa en vivo frente al POST / completo mientras se escribe en una
+sección de una newsletter de N secciones: cada pulsación envía el formulario
+entero, como haría el editor.
+
+Comprueba además que el HTML de /live_preview es idéntico al de
+render_newsletter_uncached() para el mismo contexto.
+
+Uso: python benchmarks/bench_live_preview.py [secciones] [pulsaciones]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import g
+
+from bench_inline import build_context
+
+import app as app_module
+
+
+def form_fields(context):
+    fields = {key: value for key, value in context.items() if key != 'sections' and value is not None}
+    for section in context['sections']:
+        for name, value in section.items():
+            if name != 'id':
+                fields['section{}_{}'.format(section['id'], name)] = value
+    return fields
+
+
+VIEW_MS = []
+
+
+@app_module.app.before_request
+def start_timer():
+    g.bench_start = time.perf_counter()
+
+
+@app_module.app.after_request
+def record_view(response):
+    VIEW_MS.append(1000 * (time.perf_counter() - g.bench_start))
+    return response
+
+
+def typing(client, path, context, keystrokes, section):
+    """
+    Latencias (ms) de `keystrokes` envíos escribiendo letra a letra en el texto
+    de `section`: en la aplicación (de before_request a after_request) y en
+    total con el cliente de pruebas de Flask.
+    """
+    text = context['sections'][section]['p']
+    totals = []
+    del VIEW_MS[:]
+    for i in range(keystrokes):
+        context['sections'][section]['p'] = text + ' escribiendo'[:i % 12 + 1] + str(i)
+        fields = form_fields(context)
+        start = time.perf_counter()
+        response = client.post(path, data=fields)
+        totals.append(1000 * (time.perf_counter() - start))
+        assert response.status_code == 200, response.status_code
+    return list(VIEW_MS), totals, response
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def main():
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    keystrokes = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    client = app_module.app.test_client()
+    context = build_context(sections)
+
+    # Primera vista previa: se inlinean todos los fragmentos
+    client.post('/live_preview', data=form_fields(context))
+
+    print('{:<18} {:>22} {:>22}'.format('{} secciones'.format(sections), 'en la app ms (p50/p95)',
+                                        'total ms (p50/p95)'))
+    for name, path in (('POST / completo', '/'), ('/live_preview', '/live_preview')):
+        view, totals, response = typing(client, path, context, keystrokes, sections // 2)
+        print('{:<18} {:>14.2f} / {:>5.2f} {:>14.2f} / {:>5.2f}'.format(name, *(summary(view) + summary(totals))))
+
+    payload = response.get_json()
+    with app_module.app.test_request_context():
+        expected = app_module.render_newsletter_uncached(app_module.context_from_form(
+            app_module.app.test_request_context(method='POST', data=form_fields(context)).request.form))
+    if payload['html'] != expected:
+        sys.exit('La vista previa difiere de render_newsletter_uncached()')
+    print('HTML idéntico al de render_newsletter_uncached(); fragmentos inlineados en la última: {}'.format(
+        payload['fragments_inlined']))
+    print(app_module.live_preview.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga de extremo a extremo: app.py en un worker de gunicorn contra el
+servidor falso de Google (fake_google.py), con clientes simultáneos en cada ruta:
+
+    /                            POST del formulario (render, inlineado y minificado)
+    /upload_image                subida de una imagen distinta en cada petición
+    /upload_video                aceptación de la subida (202); se espera a los trabajos
+    /list_drive_folders          listado de carpetas (índice de cambios de Drive)
+    /list_images_in_folder/<id>  carpeta con --images imágenes, --page-size por página
+    /save_template               plantilla nueva en cada petición (consulta y subida)
+    /load_template/<id>          plantillas ya guardadas en Drive
+
+Cada cliente es un usuario distinto (sus credenciales y su sesión) y hace sus
+peticiones una tras otra; antes de medir, cada uno hace una petición de
+calentamiento (servicios del pool, índices de Drive). Por ruta se mide:
+
+- throughput (respuestas correctas por segundo) y latencia p50/p99;
+- RSS máximo del worker durante la ruta (se reinicia VmHWM con clear_refs; si
+  no se puede, se muestrea VmRSS);
+- peticiones que llegaron al servidor falso de Google.
+
+El resultado se escribe en JSON (--output, por defecto a la salida estándar;
+la tabla va a stderr) para compararlo entre commits con --compare:
+
+    python benchmarks/bench_load.py --output antes.json
+    git checkout otra-rama
+    python benchmarks/bench_load.py --output despues.json --compare antes.json
+
+Por defecto sin límite de peticiones por usuario (API_RATE_PER_USER=0) para
+medir la aplicación y no el limitador; --errors inyecta errores 503 en las
+llamadas a Google de cada ruta para medir los reintentos.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+# Directorios de trabajo propios, compartidos con gunicorn: las cookies de sesión se crean
+# aquí (harness importa app.py) en el mismo almacén que leerá el worker
+WORKDIR = tempfile.mkdtemp(prefix='bench_load_')
+for _key, _name in [('SESSION_SQLITE_PATH', 'sessions.sqlite3'), ('SAVED_TEMPLATE_CACHE_DIR', 'saved_templates'),
+                    ('THUMBNAIL_CACHE_DIR', 'thumbnails'), ('TEMPLATE_CACHE_DIR', 'jinja'),
+                    ('UPLOAD_JOB_DB', 'jobs.sqlite3'), ('UPLOAD_JOB_DIR', 'upload_jobs')]:
+    os.environ.setdefault(_key, os.path.join(WORKDIR, _name))
+
+from fake_google import FOLDER_MIME, FakeGoogleServer
+from bench_concurrency import BENCH_DIR, ROOT_DIR, free_port, start_gunicorn
+from bench_upload_memory import BOUNDARY, multipart_body
+from bench_template_save import form_data
+from harness import FAKE_CREDENTIALS, session_cookie
+
+import app as app_module
+from template_snapshot import dumps_template
+
+ROUTES = ['/', '/upload_image', '/upload_video', '/list_drive_folders', '/list_images_in_folder/<id>',
+          '/save_template', '/load_template/<id>']
+
+# Llamadas a Google de cada ruta en las que --errors inyecta fallos
+GOOGLE_CALLS = {
+    '/upload_image': ('POST', r'^/upload/drive/v3/files'),
+    '/upload_video': ('PUT', r'^/upload/session/'),
+    '/list_drive_folders': ('GET', r'^/drive/v3/(files|changes)'),
+    '/list_images_in_folder/<id>': ('GET', r'^/drive/v3/(files|changes)'),
+    '/save_template': ('POST', r'^/upload/drive/v3/files'),
+    '/load_template/<id>': ('GET', r'^/drive/v3/files/'),
+}
+
+
+def percentile(values, fraction):
+    """Percentil por rango más cercano de una lista ordenada."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+def worker_pid(master_pid, timeout=30):
+    """PID del único worker de gunicorn (hijo del maestro)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with open('/proc/{0}/task/{0}/children'.format(master_pid)) as f:
+                children = f.read().split()
+        except OSError:
+            children = []
+        if children:
+            return int(children[0])
+        time.sleep(0.05)
+    raise RuntimeError('gunicorn worker did not start')
+
+
+class PeakRss(object):
+    """RSS máximo de un proceso entre start() y stop(), en bytes."""
+
+    def __init__(self, pid, interval=0.005):
+        self.pid = pid
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._hwm_reset = False
+        self.peak = 0
+
+    def _status(self, field):
+        with open('/proc/{}/status'.format(self.pid)) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            try:
+                self.peak = max(self.peak, self._status('VmRSS'))
+            except OSError:
+                return
+            self._stop.wait(self.interval)
+
+    def start(self):
+        # Escribir 5 en clear_refs reinicia VmHWM (Linux >= 4.0)
+        try:
+            with open('/proc/{}/clear_refs'.format(self.pid), 'w') as f:
+                f.write('5')
+            self._hwm_reset = True
+        except OSError:
+            self._hwm_reset = False
+        self.peak = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if self._hwm_reset:
+            try:
+                self.peak = max(self.peak, self._status('VmHWM'))
+            except OSError:
+                pass
+        return self.peak
+
+
+def request(port, method, path, cookie, body=None, headers=None):
+    """(estado, cuerpo, segundos) de una petición en una conexión nueva, como un navegador."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    start = time.perf_counter()
+    connection.request(method, path, body=body, headers=dict(headers or {}, Cookie=cookie))
+    response = connection.getresponse()
+    payload = response.read()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return response.status, payload, elapsed
+
+
+def newsletter_form(i, sections):
+    fields = {
+        'title': 'Newsletter de carga #{}'.format(i), 'header_logo_link': 'https://example.com',
+        'header_logo_src': 'https://lh3.googleusercontent.com/d/logo', 'hero_link': 'https://example.com',
+        'hero_src': 'https://lh3.googleusercontent.com/d/hero', 'hero_alt': 'Portada',
+        'intro_title': 'Novedades {}'.format(i), 'intro_p1': 'Texto de introducción {} &amp; más.'.format(i),
+        'intro_p2': 'Segundo párrafo.', 'video_title': 'Vídeo', 'video_p': 'Descripción del vídeo.',
+        'video_link': 'https://www.youtube.com/watch?v=abc',
+        'video_thumbnail_src': 'https://lh3.googleusercontent.com/d/thumb', 'video_thumbnail_alt': 'Ver vídeo',
+        'footer_web_link': 'https://example.com', 'footer_text_main': '<strong>CITED</strong>',
+        'footer_web_text': 'example.com', 'footer_legal_text': 'Aviso legal.', 'bg_type': 'solid',
+        'bg_color': '#f2f2f2', 'title_color': '#333333', 'text_color': '#555555', 'button_color': '#005a9e',
+        'font_family': 'Arial, sans-serif', 'title_font_size': '24px',
+    }
+    for n in range(1, sections + 1):
+        fields.update({
+            'section{}_img_src'.format(n): 'https://lh3.googleusercontent.com/d/img{}'.format(n),
+            'section{}_img_alt'.format(n): 'Imagen {}'.format(n),
+            'section{}_title'.format(n): 'Sección {} de la newsletter {}'.format(n, i),
+            'section{}_p'.format(n): 'Texto de la sección {} con <strong>negrita</strong>. '.format(n) * 4,
+            'section{}_button_link'.format(n): 'https://example.com/{}'.format(n),
+            'section{}_button_text'.format(n): 'Más información',
+        })
+    return urlencode(fields).encode('utf-8')
+
+
+def png_image(kb):
+    """PNG válido de unos `kb` KB (ruido, casi incompresible) para que pase por la optimización con Pillow."""
+    from PIL import Image
+    side = max(8, int((kb * 1024 / 3.0) ** 0.5))
+    output = io.BytesIO()
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(output, format='PNG')
+    return output.getvalue()
+
+
+def upload(field_data, filename, mimetype, fields=None):
+    body, length = multipart_body(len(field_data), filename, mimetype, data=field_data, fields=fields)
+    return b''.join(body), {'Content-Type': 'multipart/form-data; boundary={}'.format(BOUNDARY),
+                            'Content-Length': str(length)}
+
+
+def route_requests(args, fake, seeds):
+    """Para cada ruta, función índice -> (método, ruta, cuerpo, cabeceras)."""
+    image = png_image(args.image_kb)
+    video = os.urandom(args.video_kb * 1024)
+    form_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    json_headers = {'Content-Type': 'application/json'}
+
+    def upload_image(i):
+        # Contenido distinto en cada petición (bytes tras el final del PNG): ninguna se resuelve como duplicada
+        body, headers = upload(image + str(i).encode('ascii'), 'foto_{}.png'.format(i), 'image/png',
+                               {'folderId': seeds['image_folder']})
+        return 'POST', '/upload_image', body, headers
+
+    def upload_video(i):
+        body, headers = upload(video, 'video_{}.mp4'.format(i), 'video/mp4')
+        return 'POST', '/upload_video', body, headers
+
+    return {
+        '/': lambda i: ('POST', '/', newsletter_form(i, args.sections), form_headers),
+        '/upload_image': upload_image,
+        '/upload_video': upload_video,
+        '/list_drive_folders': lambda i: ('GET', '/list_drive_folders', None, None),
+        '/list_images_in_folder/<id>': lambda i: (
+            'GET', '/list_images_in_folder/{}'.format(seeds['image_folder']), None, None),
+        '/save_template': lambda i: ('POST', '/save_template', json.dumps(
+            {'filename': 'plantilla_de_carga_{}'.format(i)}).encode('utf-8'), json_headers),
+        '/load_template/<id>': lambda i: (
+            'GET', '/load_template/{}'.format(seeds['templates'][i % len(seeds['templates'])]), None, None),
+    }
+
+
+def run_route(port, cookies, build, first, count):
+    """Latencias y estados de `count` peticiones repartidas entre los clientes (cada uno en serie)."""
+    results = []
+    lock = threading.Lock()
+
+    def client(n):
+        for i in range(first + n, first + count, len(cookies)):
+            method, path, body, headers = build(i)
+            status, payload, elapsed = request(port, method, path, cookies[n], body, headers)
+            with lock:
+                results.append((status, elapsed, payload, cookies[n]))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(cookies)) as pool:
+        list(pool.map(client, range(len(cookies))))
+    return results, time.perf_counter() - start
+
+
+def wait_jobs(port, results, timeout=600):
+    """Espera a los trabajos de /upload_video (cada uno con la sesión que lo creó); devuelve cuántos acabaron bien."""
+    done = 0
+    deadline = time.time() + timeout
+    for status, _, payload, cookie in results:
+        if status != 202:
+            continue
+        status_url = json.loads(payload)['statusUrl']
+        while time.time() < deadline:
+            _, body, _ = request(port, 'GET', status_url, cookie)
+            job = json.loads(body)
+            if job.get('status') in ('done', 'error'):
+                done += job['status'] == 'done'
+                break
+            time.sleep(0.05)
+    return done
+
+
+def summarize(results, elapsed, ok_statuses):
+    latencies = sorted(1000 * latency for _, latency, _, _ in results)
+    ok = sum(1 for status, _, _, _ in results if status in ok_statuses)
+    return {
+        'requests': len(results),
+        'ok': ok,
+        'errors': len(results) - ok,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(ok / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 2),
+            'p99': round(percentile(latencies, 0.99), 2),
+            'mean': round(sum(latencies) / len(latencies), 2),
+            'max': round(latencies[-1], 2),
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(report, previous=None):
+    out = sys.stderr
+    out.write('{:<30} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8}\n'.format(
+        'ruta', 'ok', 'error', 'req/s', 'p50 ms', 'p99 ms', 'RSS MB', 'Google'))
+    for name, route in report['routes'].items():
+        out.write('{:<30} {:>6} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>8}\n'.format(
+            name, route['ok'], route['errors'], route['throughput_rps'], route['latency_ms']['p50'],
+            route['latency_ms']['p99'], route['peak_rss_bytes'] / 1048576.0, route['google_requests']))
+        before = (previous or {}).get('routes', {}).get(name)
+        if before:
+            def change(new, old):
+                return '{:+.0f}%'.format(100.0 * (new - old) / old) if old else 'n/a'
+            out.write('{:<30} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9}\n'.format(
+                '  vs {}'.format(previous.get('commit') or 'anterior'), '', '',
+                change(route['throughput_rps'], before['throughput_rps']),
+                change(route['latency_ms']['p50'], before['latency_ms']['p50']),
+                change(route['latency_ms']['p99'], before['latency_ms']['p99']),
+                change(route['peak_rss_bytes'], before['peak_rss_bytes'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de app.py contra el servidor falso de Google.')
+    parser.add_argument('--clients', type=int, default=16, help='clientes (usuarios) simultáneos')
+    parser.add_argument('--requests', type=int, default=160, help='peticiones medidas por ruta')
+    parser.add_argument('--latency', type=float, default=0.02, help='segundos por llamada a Google')
+    parser.add_argument('--errors', type=int, default=0, help='errores 503 inyectados por ruta en sus llamadas a Google')
+    parser.add_argument('--retry-after', type=float, default=0, help='Retry-After de los errores inyectados')
+    parser.add_argument('--page-size', type=int, default=100, help='tamaño máximo de página del servidor falso')
+    parser.add_argument('--images', type=int, default=500, help='imágenes en la carpeta listada')
+    parser.add_argument('--folders', type=int, default=200, help='carpetas en Drive')
+    parser.add_argument('--sections', type=int, default=8, help='secciones de la newsletter de /')
+    parser.add_argument('--image-kb', type=int, default=64)
+    parser.add_argument('--video-kb', type=int, default=1024)
+    parser.add_argument('--mode', default='gthread', help='WORKER_MODE de gunicorn')
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=ROUTES)
+    parser.add_argument('--output', default='-', help='fichero JSON del resultado (- para la salida estándar)')
+    parser.add_argument('--compare', help='JSON de una ejecución anterior con el que comparar')
+    args = parser.parse_args()
+
+    fake = FakeGoogleServer(latency=args.latency, page_size=args.page_size, store_media=False).start()
+    for i in range(args.folders):
+        fake.state.add_file('Carpeta {}'.format(i), FOLDER_MIME)
+    image_folder = fake.state.add_file('Imágenes de campaña', FOLDER_MIME)['id']
+    for i in range(args.images):
+        fake.state.add_file('imagen_{:05d}.jpg'.format(i), 'image/jpeg', parents=[image_folder])
+
+    env = dict(os.environ,
+               FAKE_GOOGLE_URL=fake.base_url,
+               SERVICE_POOL_SIZE=str(4 * args.clients),
+               PYTHONPATH=os.pathsep.join([ROOT_DIR, BENCH_DIR]))
+    env.setdefault('API_RATE_PER_USER', '0')
+
+    templates_folder = fake.state.add_file(app_module.TEMPLATES_FOLDER_NAME, FOLDER_MIME)['id']
+    payload = dumps_template(form_data(8), app_module.TEMPLATE_GZIP_THRESHOLD)[0]
+    fake.state.store_media = True
+    seeds = {
+        'image_folder': image_folder,
+        'templates': [fake.state.add_file('plantilla_{}.json'.format(i), 'application/json',
+                                          parents=[templates_folder], data=payload)['id']
+                      for i in range(args.clients)],
+    }
+    fake.state.store_media = False
+    cookies = [session_cookie(dict(FAKE_CREDENTIALS, token='fake-token-{}'.format(n)), form_data=form_data(8, n))
+               for n in range(args.clients)]
+    builders = route_requests(args, fake, seeds)
+    ok_statuses = {'/upload_video': (202,), '/load_template/<id>': (302,)}
+
+    port = free_port()
+    process = start_gunicorn(args.mode, port, env)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'routes': {},
+    }
+    try:
+        pid = worker_pid(process.pid)
+        for name in args.routes:
+            # Calentamiento: una petición por cliente, sin medir
+            run_route(port, cookies, builders[name], 0, len(cookies))
+            if args.errors and name in GOOGLE_CALLS:
+                method, pattern = GOOGLE_CALLS[name]
+                fake.state.inject_errors(method, pattern, status=503, times=args.errors,
+                                         retry_after=args.retry_after)
+            google_before = fake.state.requests.get('http_requests', 0)
+            rss = PeakRss(pid).start()
+            results, elapsed = run_route(port, cookies, builders[name], len(cookies), args.requests)
+            route = summarize(results, elapsed, ok_statuses.get(name, (200,)))
+            if name == '/upload_video':
+                start = time.perf_counter()
+                route['jobs_done'] = wait_jobs(port, results)
+                route['jobs_seconds'] = round(elapsed + time.perf_counter() - start, 3)
+            route['peak_rss_bytes'] = rss.stop()
+            route['google_requests'] = fake.state.requests.get('http_requests', 0) - google_before
+            report['routes'][name] = route
+    finally:
+        process.terminate()
+        process.wait()
+        fake.stop()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if previous.get('config') != report['config']:
+            sys.stderr.write('Aviso: {} se ejecutó con otra configuración\n'.format(args.compare))
+    print_table(report, previous)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    failed = [name for name, route in report['routes'].items() if route['errors']]
+    if failed:
+        sys.stderr.write('Rutas con errores: {}\n'.format(', '.join(failed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Coste de las métricas de /metrics: cada escenario se ejecuta en un proceso
+nuevo con METRICS=1 y con METRICS=0 (la aplicación lee la variable al importarse).
+
+- GET / (index.html) y POST / (newsletter nueva cada vez, sin caché).
+- /upload_image contra el servidor falso de Google: execute() de files.create
+  con la subida resumable y permissions.create.
+
+Al final se muestran las líneas de /metrics de esas llamadas.
+
+Uso: python benchmarks/bench_metrics.py [peticiones]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RUN = '''
+import json, os, statistics, sys, time
+from harness import AppServer, point_app_at, session_cookie
+from fake_google import FOLDER_MIME, FakeGoogleServer
+from bench_upload_memory import upload
+import app as app_module
+
+requests = int(sys.argv[1])
+app_module.image_pipeline.enabled = False
+app_module.IMAGE_DEDUP = False
+client = app_module.app.test_client()
+
+def timed(call):
+    samples = []
+    for i in range(requests):
+        start = time.perf_counter()
+        call(i)
+        samples.append(1e6 * (time.perf_counter() - start))
+    return statistics.median(samples)
+
+result = {}
+client.get('/')
+result['GET /'] = timed(lambda i: client.get('/'))
+result['POST /'] = timed(lambda i: client.post('/', data={'title': 'Newsletter %d' % i, 'intro_p1': 'Texto ' * 50}))
+
+fake = FakeGoogleServer(latency=0, store_media=False).start()
+point_app_at(fake)
+server = AppServer().start()
+cookie = session_cookie()
+folder_id = fake.state.add_file('Imagenes', FOLDER_MIME)['id']
+data = os.urandom(256 * 1024)
+result['/upload_image'] = timed(lambda i: upload(server.address, '/upload_image', len(data), 'foto.jpg',
+                                                 'image/jpeg', cookie, data=data, fields={'folderId': folder_id}))
+if app_module.metrics:
+    result['metrics'] = client.get('/metrics', headers={'Authorization': 'Bearer bench'}).get_data(as_text=True)
+server.stop()
+fake.stop()
+print(json.dumps(result))
+'''
+
+
+def run(enabled, requests):
+    env = dict(os.environ, METRICS='1' if enabled else '0', TEMPLATE_MODE='production', STATS_TOKEN='bench')
+    output = subprocess.run([sys.executable, '-c', RUN, str(requests)], cwd=BENCH_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def microbenchmark():
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+    from metrics import Metrics
+    metrics = Metrics()
+    calls = 200000
+    start = time.perf_counter()
+    for i in range(calls):
+        metrics.observe('http_request_duration_seconds', 0.012, route='/', method='GET', status=200)
+    observe_ns = 1e9 * (time.perf_counter() - start) / calls
+    start = time.perf_counter()
+    for i in range(calls):
+        metrics.inc('google_api_upload_bytes_total', 1024, api='drive', method='files.create')
+    inc_ns = 1e9 * (time.perf_counter() - start) / calls
+    print('observe(): {:.0f} ns por llamada, inc(): {:.0f} ns por llamada'.format(observe_ns, inc_ns))
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    microbenchmark()
+    runs = {enabled: [run(enabled, requests) for _ in range(3)] for enabled in (False, True)}
+    print('{:<16} {:>12} {:>12} {:>10}'.format('mediana (µs)', 'METRICS=0', 'METRICS=1', 'diferencia'))
+    for name in ('GET /', 'POST /', '/upload_image'):
+        off = statistics.median(r[name] for r in runs[False])
+        on = statistics.median(r[name] for r in runs[True])
+        print('{:<16} {:>12.0f} {:>12.0f} {:>+9.1f}%'.format(name, off, on, 100.0 * (on - off) / off))
+    print()
+    for line in runs[True][-1]['metrics'].splitlines():
+        if line.startswith(('google_api', 'newsletter_render_duration_seconds_sum',
+                            'newsletter_render_duration_seconds_count')) and '_bucket' not in line:
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
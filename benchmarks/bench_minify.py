@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Minificado del HTML ya inlineado (html_minify.py): bytes antes y después,
+tiempo del minificado y margen frente al límite de recorte de Gmail, para
+newsletterCited.html y para template.html con distinto número de secciones.
+
+Comprueba además, con cssutils y BeautifulSoup (independientes del
+minificador), que cada elemento conserva los mismos atributos, los mismos
+estilos efectivos y el mismo texto visible, y que los casos de REGRESSIONS
+conservan tal cual el fragmento que el minificador no debe tocar.
+
+Uso: python benchmarks/bench_minify.py [repeticiones]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cssutils
+from bs4 import BeautifulSoup
+
+from bench_inline import render
+from html_minify import GMAIL_CLIP_BYTES, minify_html
+from inliner import inline_styles
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+cssutils.log.setLevel('FATAL')
+
+
+# (documento, fragmento que debe seguir en el resultado)
+REGRESSIONS = [
+    # Texto que parece un atributo
+    ('<p>Use style="x: y" here</p>', 'style="x: y"'),
+    ('<p title=\'a style="x: y"\'>texto</p>', 'style="x: y"'),
+    # Un valor inicial en línea pisa la regla @media: quitarlo la deja ganar
+    ('<style>@media (max-width:600px){.a{float:left}}</style>'
+     '<div class="a" style="float: none; color: red">texto</div>', 'float:none'),
+    # Alternativa para los clientes que no entienden el degradado
+    ('<td style="background: #ffffff; background: linear-gradient(#fff, #eee)">texto</td>', 'background:#fff;'),
+]
+
+BLOCK_NAMES = ('html', 'head', 'body', 'table', 'tr', 'td', 'th', 'div', 'p', 'h1', 'h2', 'h3', 'ul', 'ol', 'li')
+
+
+def normalized_value(name, value):
+    """Valor CSS comparable: colores como RGBA, ceros sin unidad y márgenes con sus cuatro lados."""
+    items = []
+    for item in cssutils.css.PropertyValue(value):
+        if item.type == 'COLOR_VALUE':
+            items.append((item.red, item.green, item.blue, item.alpha))
+        elif item.type in ('NUMBER', 'DIMENSION') and item.value == 0:
+            items.append('0')
+        else:
+            items.append(item.cssText.lower())
+    if name in ('margin', 'padding') and 1 <= len(items) <= 4:
+        top, right, bottom, left = {1: items * 4, 2: items * 2, 3: items + items[1:2], 4: items}[len(items)]
+        items = [top, right, bottom, left]
+    return tuple(items)
+
+
+def effective_styles(html):
+    """
+    Por elemento: etiqueta, atributos, estilos efectivos y, en los bloques sin
+    otros bloques dentro, el texto visible (con los espacios que se ven).
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    elements = []
+    for element in soup.find_all(True):
+        attributes = {name: value for name, value in element.attrs.items() if name != 'style'}
+        declaration = cssutils.parseStyle(element.get('style', ''))
+        style = {}
+        for name in set(prop.name for prop in declaration.getProperties(all=True)):
+            style[name] = (normalized_value(name, declaration.getPropertyValue(name)),
+                           declaration.getPropertyPriority(name))
+        text = None
+        if element.name in BLOCK_NAMES and not element.find(BLOCK_NAMES):
+            text = ' '.join(element.get_text().split())
+        elements.append((element.name, sorted(attributes.items(), key=str), sorted(style.items()), text))
+    return elements
+
+
+def size(html):
+    return len(html.encode('utf-8'))
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with open(os.path.join(ROOT_DIR, 'newsletterCited.html'), encoding='utf-8') as f:
+        cases = [('newsletterCited.html', f.read())]
+    cases += [('template.html, {} secc.'.format(n), render(n)) for n in (1, 30, 100, 200)]
+
+    print('{:<26} {:>10} {:>10} {:>7} {:>9} {:>14}'.format(
+        'documento', 'inlineado', 'minificado', 'ahorro', 'ms', 'límite Gmail'))
+    failures = []
+    for name, source in cases:
+        inlined = inline_styles(source)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            minified = minify_html(inlined)
+            times.append(1000 * (time.perf_counter() - start))
+        before, after = size(inlined), size(minified)
+        print('{:<26} {:>10} {:>10} {:>6.1f}% {:>9.2f} {:>14}'.format(
+            name, before, after, 100.0 * (before - after) / before, statistics.median(times),
+            'supera' if after > GMAIL_CLIP_BYTES else '{:.0f}% usado'.format(100.0 * after / GMAIL_CLIP_BYTES)))
+        if effective_styles(inlined) != effective_styles(minified):
+            failures.append(name)
+    for source, fragment in REGRESSIONS:
+        minified = minify_html(source)
+        if fragment not in minified or effective_styles(source) != effective_styles(minified):
+            failures.append('{!r} -> {!r}'.format(source, minified))
+    if failures:
+        sys.exit('Estilos o texto distintos tras minificar: {}'.format(', '.join(failures)))
+    print('Mismos estilos efectivos y texto visible en todos los documentos.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Coste de obtener el servicio de Drive: build() en cada petición frente al pool,
+y latencia de /list_drive_folders en frío y en caliente contra el servidor falso.
+
+Uso: python benchmarks/bench_service_pool.py [repeticiones]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault('STATS_TOKEN', 'bench')
+
+from harness import FAKE_CREDENTIALS, point_app_at, session_cookie
+from fake_google import FOLDER_MIME, FakeGoogleServer
+
+import app as app_module
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return 1000.0 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    fake = FakeGoogleServer().start()
+    for i in range(20):
+        fake.state.add_file('Carpeta {}'.format(i), FOLDER_MIME)
+    point_app_at(fake)
+
+    build_ms = timed(lambda: app_module.build_service('drive', 'v3', FAKE_CREDENTIALS), repeat)
+    pool = app_module.service_pool
+    pool.release(pool.get('drive', 'v3', FAKE_CREDENTIALS))
+    pool_ms = timed(lambda: pool.release(pool.get('drive', 'v3', FAKE_CREDENTIALS)), repeat)
+    print('build() por petición: {:8.3f} ms'.format(build_ms))
+    print('pool en caliente:     {:8.3f} ms'.format(pool_ms))
+
+    client = app_module.app.test_client()
+    client.set_cookie(*session_cookie().split('=', 1))
+    app_module.service_pool.discard(FAKE_CREDENTIALS)
+    cold_ms = timed(lambda: client.get('/list_drive_folders'), 1)
+    warm_ms = timed(lambda: client.get('/list_drive_folders'), repeat)
+    print('/list_drive_folders en frío:     {:8.3f} ms'.format(cold_ms))
+    print('/list_drive_folders en caliente: {:8.3f} ms'.format(warm_ms))
+    print(client.get('/service_pool_stats', headers={'Authorization': 'Bearer ' + app_module.STATS_TOKEN}).get_json())
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tamaño de la cookie de sesión y coste de abrir la sesión en cada petición:
+sesión firmada de Flask frente a las sesiones en servidor (SQLite y ficheros).
+
+Uso: python benchmarks/bench_session.py [secciones] [repeticiones]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from bench_inline import build_context
+from harness import FAKE_CREDENTIALS
+
+from flask import request
+from flask.sessions import SecureCookieSessionInterface
+
+import app as app_module
+from session_store import FileSessionStore, ServerSideSessionInterface, SQLiteSessionStore
+
+
+def measure(interface, data, repeat):
+    app = app_module.app
+    with app.test_request_context():
+        session = interface.open_session(app, request)
+        session.update(data)
+        response = app.response_class()
+        interface.save_session(app, session, response)
+    cookie = response.headers['Set-Cookie'].split(';', 1)[0]
+    header = 'Cookie: {}'.format(cookie)
+
+    with app.test_request_context(headers={'Cookie': cookie}):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            session = interface.open_session(app, request)
+        elapsed = time.perf_counter() - start
+        assert session['form_data'] == data['form_data']
+    return len(header), 1000.0 * elapsed / repeat
+
+
+def main():
+    num_sections = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    data = {'credentials': FAKE_CREDENTIALS, 'form_data': build_context(num_sections)}
+    workdir = tempfile.mkdtemp()
+    try:
+        interfaces = [
+            ('cookie firmada', SecureCookieSessionInterface()),
+            ('sqlite', ServerSideSessionInterface(SQLiteSessionStore(os.path.join(workdir, 'sessions.sqlite3')))),
+            ('ficheros', ServerSideSessionInterface(FileSessionStore(os.path.join(workdir, 'sessions')))),
+        ]
+        print('{} secciones'.format(num_sections))
+        print('{:>16} {:>14} {:>16}'.format('backend', 'cabecera (B)', 'apertura (ms)'))
+        for name, interface in interfaces:
+            header_size, open_ms = measure(interface, data, repeat)
+            print('{:>16} {:>14} {:>16.4f}'.format(name, header_size, open_ms))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Tiempo de arranque de app.py (lo que tarda en importarlo cada worker de
+gunicorn sin preload_app) medido con `python -X importtime`, y primer GET /
+con el cliente de pruebas de Flask.
+
+Cada medida se hace en un proceso nuevo. Con --rev se mide también el árbol de
+esa revisión de git (extraído con `git archive`) para comparar antes y después.
+
+Uso: python benchmarks/bench_startup.py [repeticiones] [--rev REVISIÓN]
+"""
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# Módulos pesados cuyo coste (acumulado, en el punto en que se importan) se desglosa
+HEAVY_MODULES = ['flask', 'google.oauth2.credentials', 'google_auth_oauthlib.flow', 'googleapiclient.discovery',
+                 'googleapiclient.http', 'httplib2', 'inliner', 'PIL.Image']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+first_get = time.perf_counter()
+print(json.dumps({
+    'import_ms': 1000 * (imported - start),
+    'first_get_ms': 1000 * (first_get - imported),
+    'modules': len(sys.modules),
+    'loaded': [name for name in %r if name in sys.modules],
+}))
+''' % (HEAVY_MODULES,)
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def probe(tree, env):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=tree, env=env,
+                            capture_output=True, text=True, check=True)
+    measures = json.loads(result.stdout.strip().splitlines()[-1])
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and match.group(4) in HEAVY_MODULES:
+            cumulative[match.group(4)] = int(match.group(2)) / 1000.0
+    measures['cumulative'] = cumulative
+    return measures
+
+
+def measure(name, tree, repeats, temp_dir):
+    env = dict(os.environ, SESSION_SQLITE_PATH=os.path.join(temp_dir, 'sessions.sqlite3'),
+               UPLOAD_JOB_DB=os.path.join(temp_dir, 'jobs.sqlite3'),
+               TEMPLATE_CACHE_DIR=os.path.join(temp_dir, 'jinja-' + name))
+    probe(tree, env)  # bytecode de Python y de Jinja ya guardados, como en un dyno que rearranca
+    runs = [probe(tree, env) for _ in range(repeats)]
+    print('\n{}: import app {:.0f} ms, primer GET / {:.1f} ms, {} módulos'.format(
+        name, statistics.median(r['import_ms'] for r in runs), statistics.median(r['first_get_ms'] for r in runs),
+        runs[0]['modules']))
+    for module in HEAVY_MODULES:
+        times = [r['cumulative'].get(module) for r in runs]
+        if None in times:
+            print('  {:<28} {}'.format(module, 'sin importar' if module not in runs[0]['loaded'] else 'ya importado'))
+        else:
+            print('  {:<28} {:>7.1f} ms'.format(module, statistics.median(times)))
+
+
+def main():
+    args = sys.argv[1:]
+    rev = None
+    if '--rev' in args:
+        rev = args[args.index('--rev') + 1]
+        del args[args.index('--rev'):args.index('--rev') + 2]
+    repeats = int(args[0]) if args else 5
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        if rev:
+            tree = os.path.join(temp_dir, 'rev')
+            os.makedirs(tree)
+            archive = subprocess.run(['git', 'archive', rev], cwd=ROOT_DIR, capture_output=True, check=True)
+            subprocess.run(['tar', '-x', '-C', tree], input=archive.stdout, check=True)
+            measure(rev, tree, repeats, temp_dir)
+        measure('árbol actual', ROOT_DIR, repeats, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Apertura de plantillas guardadas (/load_template) contra el servidor falso de
+Google, con la caché local de template_cache.py: peticiones a Google y tiempo
+por apertura.
+
+- sin caché: la entrada se borra antes de cada apertura (lo que hacía antes
+  load_template(): siempre get_media).
+- dentro del TTL: sin ninguna petición.
+- TTL vencido, sin cambios: solo files.get con md5Checksum.
+- cambiada en Drive: files.get y la descarga.
+- tras /list_templates: el listado revalida las entradas y precarga en segundo
+  plano las más recientes; después se abren esas plantillas.
+
+Uso: python benchmarks/bench_template_load.py [aperturas] [latencia]
+"""
+import http.client
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('SAVED_TEMPLATE_CACHE_DIR', tempfile.mkdtemp(prefix='bench_saved_templates_'))
+
+from harness import FAKE_CREDENTIALS, AppServer, get_json, point_app_at, session_cookie
+from fake_google import FOLDER_MIME, FakeGoogleServer
+from bench_template_save import form_data
+
+import app as app_module
+from template_snapshot import dumps_template
+
+cache = app_module.saved_template_cache
+
+
+def load(address, cookie, template_id):
+    connection = http.client.HTTPConnection(*address, timeout=120)
+    connection.request('GET', '/load_template/' + template_id, headers={'Cookie': cookie})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    assert response.status == 302, response.status
+
+
+def wait_prefetch(timeout=60):
+    deadline = time.time() + timeout
+    while cache.stats()['prefetching'] and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def main():
+    opens = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    fake = FakeGoogleServer(latency=latency).start()
+    point_app_at(fake)
+    server = AppServer().start()
+    cookie = session_cookie()
+    account = app_module.credentials_identity(FAKE_CREDENTIALS)
+    folder_id = fake.state.add_file(app_module.TEMPLATES_FOLDER_NAME, FOLDER_MIME)['id']
+    payload = dumps_template(form_data(300), app_module.TEMPLATE_GZIP_THRESHOLD)[0]
+    template_id = fake.state.add_file('grande.json', 'application/json', parents=[folder_id], data=payload)['id']
+    default_ttl = cache.ttl
+
+    def change_in_drive(i):
+        with fake.state.lock:
+            fake.state._set_content(fake.state.files[template_id],
+                                    dumps_template(form_data(300, i + 1), app_module.TEMPLATE_GZIP_THRESHOLD)[0])
+
+    scenarios = [
+        ('sin caché', default_ttl, lambda i: cache.invalidate(account, template_id)),
+        ('dentro del TTL', default_ttl, None),
+        ('TTL vencido, sin cambios', 0, None),
+        ('cambiada en Drive', 0, change_in_drive),
+    ]
+    print('{:<28} {:>10} {:>10} {:>9}'.format('apertura', 'peticiones', 'get_media', 'ms'))
+    load(server.address, cookie, template_id)
+    for name, ttl, before_each in scenarios:
+        cache.ttl = ttl
+        requests_before = fake.state.requests.get('http_requests', 0)
+        media_before = fake.state.requests.get('files.get_media', 0)
+        elapsed = 0.0
+        for i in range(opens):
+            if before_each:
+                before_each(i)
+            start = time.perf_counter()
+            load(server.address, cookie, template_id)
+            elapsed += time.perf_counter() - start
+        print('{:<28} {:>10.1f} {:>10.1f} {:>9.1f}'.format(
+            name, (fake.state.requests.get('http_requests', 0) - requests_before) / float(opens),
+            (fake.state.requests.get('files.get_media', 0) - media_before) / float(opens), 1000 * elapsed / opens))
+    cache.ttl = default_ttl
+
+    # Varias plantillas sin abrir nunca: el listado precarga las más recientes
+    recent = []
+    for i in range(10):
+        file = fake.state.add_file('plantilla_{}.json'.format(i), 'application/json', parents=[folder_id],
+                                   data=dumps_template(form_data(8, i))[0],
+                                   modifiedTime='2026-01-{:02d}T10:00:00.000Z'.format(i + 1))
+        recent.insert(0, file['id'])
+    get_json(server.address, '/list_templates', cookie)
+    wait_prefetch()
+    requests_before = fake.state.requests.get('http_requests', 0)
+    start = time.perf_counter()
+    for file_id in recent[:cache.prefetch_limit]:
+        load(server.address, cookie, file_id)
+    elapsed = time.perf_counter() - start
+    print('{:<28} {:>10.1f} {:>10} {:>9.1f}'.format(
+        'precargadas tras el listado', (fake.state.requests.get('http_requests', 0) - requests_before)
+        / float(cache.prefetch_limit), '', 1000 * elapsed / cache.prefetch_limit))
+    print(cache.stats())
+    server.stop()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Guardado de plantillas en Drive contra el servidor falso de Google: peticiones,
+bytes enviados y tiempo por guardado.
+
+- antes: lo que hacía save_template() (JSON con indent=4 en un fichero
+  temporal y files().update resumable) reproducido con el mismo servicio.
+- /save_template con cambios: JSON compacto (gzip si es grande), comprobación
+  de md5Checksum y subida simple desde memoria.
+- /save_template sin cambios (autoguardado): solo la consulta de md5Checksum.
+
+Uso: python benchmarks/bench_template_save.py [guardados] [latencia]
+"""
+import http.client
+import json
+import os
+import sys
+import tempfile
+import time
+
+from harness import FAKE_CREDENTIALS, AppServer, point_app_at, session_cookie
+from fake_google import FOLDER_MIME, FakeGoogleServer
+
+import app as app_module
+from template_snapshot import loads_template
+
+SIZES = [('normal (8 secciones)', 8), ('grande (300 secciones)', 300)]
+
+
+def form_data(sections, version=0):
+    data = {key: 'Texto de {} v{}'.format(key, version) for key in (
+        'title', 'header_logo_link', 'header_logo_src', 'hero_link', 'hero_src', 'hero_alt', 'intro_title',
+        'intro_p1', 'intro_p2', 'video_title', 'video_p', 'video_link', 'footer_text_main', 'footer_legal_text')}
+    data['sections'] = [{
+        'id': str(i), 'title': 'Sección {}'.format(i), 'text': 'Contenido de la sección {} '.format(i) * 12,
+        'image_src': 'https://drive.google.com/uc?id=imagen{}'.format(i), 'link': 'https://example.com/{}'.format(i),
+    } for i in range(1, sections + 1)]
+    return data
+
+
+def save(address, cookie, file_id):
+    connection = http.client.HTTPConnection(*address, timeout=120)
+    connection.request('POST', '/save_template', body=json.dumps({'filename': 'autosave', 'file_id': file_id}),
+                       headers={'Content-Type': 'application/json', 'Cookie': cookie})
+    response = connection.getresponse()
+    payload = json.loads(response.read())
+    connection.close()
+    assert response.status == 200, payload
+    return payload
+
+
+def old_save(drive_service, data, file_id):
+    """save_template() anterior: indent=4, fichero temporal y subida resumable."""
+    from googleapiclient.http import MediaFileUpload
+    with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.json', encoding='utf-8') as temp_file:
+        temp_file.write(json.dumps(data, indent=4))
+        temp_file_path = temp_file.name
+    media = MediaFileUpload(temp_file_path, mimetype='application/json', resumable=True)
+    drive_service.files().update(fileId=file_id, media_body=media).execute()
+    os.remove(temp_file_path)
+
+
+def measure(fake, call, saves):
+    requests_before = fake.state.requests.get('http_requests', 0)
+    bytes_before = fake.state.bytes_received
+    start = time.perf_counter()
+    for i in range(saves):
+        call(i)
+    elapsed = time.perf_counter() - start
+    return ((fake.state.requests.get('http_requests', 0) - requests_before) / float(saves),
+            (fake.state.bytes_received - bytes_before) / float(saves), 1000 * elapsed / saves)
+
+
+def main():
+    saves = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    fake = FakeGoogleServer(latency=latency).start()
+    point_app_at(fake)
+    server = AppServer().start()
+    folder_id = fake.state.add_file(app_module.TEMPLATES_FOLDER_NAME, FOLDER_MIME)['id']
+    drive_service = app_module.service_pool.get('drive', 'v3', FAKE_CREDENTIALS)
+
+    print('{:<24} {:<28} {:>10} {:>12} {:>9}'.format('plantilla', 'guardado', 'peticiones', 'bytes', 'ms'))
+    for name, sections in SIZES:
+        file_id = fake.state.add_file('autosave.json', 'application/json', parents=[folder_id])['id']
+        rows = [
+            ('antes (indent=4, resumable)',
+             lambda i: old_save(drive_service, form_data(sections, i), file_id)),
+        ]
+        versions = iter(range(1000, 1000 + saves))
+        cookies = {}
+
+        def changed(i):
+            cookie = session_cookie(form_data=form_data(sections, next(versions)))
+            cookies['last'] = cookie
+            result = save(server.address, cookie, file_id)
+            assert not result.get('unchanged'), result
+
+        def unchanged(i):
+            result = save(server.address, cookies['last'], file_id)
+            assert result.get('unchanged'), result
+
+        rows += [('ahora, con cambios', changed), ('ahora, sin cambios', unchanged)]
+        for label, call in rows:
+            requests, sent, ms = measure(fake, call, saves)
+            print('{:<24} {:<28} {:>10.1f} {:>12.0f} {:>9.1f}'.format(name, label, requests, sent, ms))
+        stored = fake.state.files[file_id]
+        print('{:<24} {:<28} {:>10} {:>12} {:>9}'.format('', 'tamaño en Drive', '', stored['size'], ''))
+        # Lo guardado (comprimido o no) se vuelve a cargar igual con /load_template
+        assert loads_template(stored['data']) == form_data(sections, 1000 + saves - 1)
+        connection = http.client.HTTPConnection(*server.address, timeout=120)
+        connection.request('GET', '/load_template/' + file_id, headers={'Cookie': cookies['last']})
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        assert response.status == 302, response.status
+
+    app_module.service_pool.release(drive_service)
+    server.stop()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Subidas de vídeo en segundo plano contra el servidor falso de YouTube: cuánto
+tarda en responder /upload_video frente a la subida completa, y reanudación
+tras errores 503 inyectados en los trozos (sin volver a enviar lo ya recibido).
+
+Uso: python benchmarks/bench_upload_jobs.py [MB] [latencia]
+"""
+import http.client
+import json
+import sys
+import time
+
+from harness import AppServer, point_app_at, session_cookie, wait_for_job
+from fake_google import FakeGoogleServer
+from bench_upload_memory import BOUNDARY, multipart_body
+
+import app as app_module
+
+
+def submit(address, size, cookie):
+    body, length = multipart_body(size, 'video.mp4', 'video/mp4')
+    connection = http.client.HTTPConnection(*address, timeout=600)
+    connection.request('POST', '/upload_video', body=body, headers={
+        'Content-Type': 'multipart/form-data; boundary={}'.format(BOUNDARY),
+        'Content-Length': str(length),
+        'Cookie': cookie,
+    })
+    response = connection.getresponse()
+    payload = json.loads(response.read())
+    connection.close()
+    return response.status, payload
+
+
+def run(address, size, cookie, label):
+    start = time.perf_counter()
+    status, payload = submit(address, size, cookie)
+    accepted = time.perf_counter() - start
+    job = wait_for_job(address, payload['statusUrl'], cookie)
+    total = time.perf_counter() - start
+    print('{:<28} respuesta {} en {:6.3f} s, trabajo {} en {:6.2f} s, reintentos {}'.format(
+        label, status, accepted, job['status'], total, job['attempts']))
+    return job
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 16 * 1024 * 1024
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    fake = FakeGoogleServer(latency=latency, store_media=False).start()
+    point_app_at(fake)
+    app_module.video_upload_queue.chunk_size = 1024 * 1024
+    server = AppServer().start()
+    cookie = session_cookie()
+
+    run(server.address, size, cookie, 'sin errores')
+    clean_bytes = fake.state.bytes_received
+    fake.state.inject_errors('PUT', r'^/upload/session/', status=503, times=2)
+    job = run(server.address, size, cookie, 'con 2 errores 503')
+    resent = fake.state.bytes_received - 2 * clean_bytes
+    print('bytes reenviados tras los errores: {} ({} trozos de {} KB)'.format(
+        resent, resent // app_module.video_upload_queue.chunk_size, app_module.video_upload_queue.chunk_size // 1024))
+    assert job['status'] == 'done' and job['url']
+    server.stop()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
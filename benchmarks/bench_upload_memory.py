@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Memoria máxima de Python (tracemalloc) durante /upload_image y /upload_video
+contra el servidor falso de Drive/YouTube, para distintos tamaños de fichero.
+El vídeo se sube en segundo plano: se mide hasta que termina su trabajo.
+
+Uso: python benchmarks/bench_upload_memory.py [MB ...]
+"""
+import http.client
+import json
+import sys
+import time
+import tracemalloc
+
+from harness import AppServer, point_app_at, session_cookie, wait_for_job
+from fake_google import FakeGoogleServer
+
+import app as app_module
+
+BLOCK = b'\0' * (256 * 1024)
+BOUNDARY = 'benchboundary'
+
+
+def multipart_body(size, filename, mimetype, data=None, fields=None):
+    head = ''.join('--{b}\r\nContent-Disposition: form-data; name="{n}"\r\n\r\n{v}\r\n'.format(
+        b=BOUNDARY, n=name, v=value) for name, value in (fields or {}).items()).encode('utf-8')
+    head += ('--{b}\r\nContent-Disposition: form-data; name="file"; filename="{f}"\r\n'
+            'Content-Type: {m}\r\n\r\n').format(b=BOUNDARY, f=filename, m=mimetype).encode('ascii')
+    tail = '\r\n--{b}--\r\n'.format(b=BOUNDARY).encode('ascii')
+
+    def chunks():
+        yield head
+        if data is not None:
+            yield data
+        else:
+            remaining = size
+            while remaining > 0:
+                block = BLOCK[:min(remaining, len(BLOCK))]
+                remaining -= len(block)
+                yield block
+        yield tail
+
+    return chunks(), len(head) + size + len(tail)
+
+
+def upload(address, path, size, filename, mimetype, cookie, data=None, fields=None):
+    body, length = multipart_body(size, filename, mimetype, data, fields)
+    connection = http.client.HTTPConnection(*address, timeout=600)
+    connection.request('POST', path, body=body, headers={
+        'Content-Type': 'multipart/form-data; boundary={}'.format(BOUNDARY),
+        'Content-Length': str(length),
+        'Cookie': cookie,
+    })
+    response = connection.getresponse()
+    payload = json.loads(response.read())
+    connection.close()
+    if response.status not in (200, 202):
+        raise RuntimeError('{} -> {} {}'.format(path, response.status, payload))
+    if 'statusUrl' in payload:
+        payload = wait_for_job(address, payload['statusUrl'], cookie)
+        if payload.get('status') != 'done':
+            raise RuntimeError('{} -> {}'.format(path, payload))
+    return payload
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [16, 64, 256]
+    fake = FakeGoogleServer(store_media=False).start()
+    point_app_at(fake)
+    # Se mide la subida en streaming, no la optimización de imágenes
+    app_module.image_pipeline.enabled = False
+    server = AppServer().start()
+    cookie = session_cookie()
+    print('{:>8} {:>16} {:>12} {:>10}'.format('MB', 'ruta', 'pico MB', 'seg'))
+    for size_mb in sizes:
+        for path, filename, mimetype in (('/upload_image', 'foto.jpg', 'image/jpeg'),
+                                         ('/upload_video', 'video.mp4', 'video/mp4')):
+            tracemalloc.start()
+            start = time.perf_counter()
+            upload(server.address, path, size_mb * 1024 * 1024, filename, mimetype, cookie)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('{:>8} {:>16} {:>12.1f} {:>10.2f}'.format(size_mb, path, peak / 1024.0 / 1024.0, elapsed))
+    server.stop()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    main()
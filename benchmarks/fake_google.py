@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor local que imita las partes de Drive v3 y YouTube Data v3 que usa app.py.
+
+Solo implementa lo necesario para los benchmarks: listados con `q` sencillos y
+paginación, creación de carpetas y ficheros (simple, multipart y resumable),
+permisos, descarga con alt=media, borrado, la API de cambios, peticiones batch,
+subida resumable de vídeos y las imágenes de lh3.googleusercontent.com (a
+tamaño completo y las miniaturas de `thumbnailLink`). `FakeGoogleState.inject_errors()` hace fallar
+las siguientes peticiones a una ruta para probar reintentos, y `user_quota`
+limita las peticiones por usuario como la cuota de Drive (429).
+Los clientes se redirigen a él con `FakeGoogleServer.http()`, que reescribe los
+hosts de googleapis.com (incluidas las URLs de subida y de batch) y
+lh3.googleusercontent.com:
+
+    server = FakeGoogleServer().start()
+    build('drive', 'v3', http=AuthorizedHttp(credentials, http=server.http()))
+"""
+import hashlib
+import http.client
+import itertools
+import json
+import re
+import threading
+import time
+from collections import deque
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+_VALUE = r"'((?:[^'\\]|\\.)*)'"
+_QUERY_CLAUSES = [
+    (re.compile(r"^mimeType\s*=\s*" + _VALUE + "$"), lambda f, v: f['mimeType'] == v),
+    (re.compile(r"^mimeType contains " + _VALUE + "$"), lambda f, v: v in f['mimeType']),
+    (re.compile(r"^name\s*=\s*" + _VALUE + "$"), lambda f, v: f['name'] == v),
+    (re.compile(r"^" + _VALUE + " in parents$"), lambda f, v: v in f.get('parents', [])),
+    (re.compile(r"^trashed\s*=\s*(true|false)$"), lambda f, v: f.get('trashed', False) == (v == 'true')),
+]
+
+
+def matches_query(file, query):
+    if not query:
+        return True
+    for clause in query.split(' and '):
+        clause = clause.strip()
+        for pattern, check in _QUERY_CLAUSES:
+            match = pattern.match(clause)
+            if match:
+                value = re.sub(r'\\(.)', r'\1', match.group(1))
+                if not check(file, value):
+                    return False
+                break
+        else:
+            raise ValueError('Cláusula no soportada: {}'.format(clause))
+    return True
+
+
+class FakeGoogleState(object):
+    """Estado compartido del servidor: ficheros, permisos y contadores."""
+
+    def __init__(self, page_size=100, store_media=True, user_quota=None):
+        self.page_size = page_size
+        self.user_quota = user_quota  # (peticiones, segundos) por token de acceso, o None
+        self._quota_windows = {}
+        self.store_media = store_media
+        self.files = {}
+        self.permissions = {}
+        self.uploads = {}
+        self.requests = {}
+        self.bytes_received = 0
+        self.changes = []  # IDs de fichero modificados, en orden; el token es la posición
+        self.faults = []  # [método, patrón de ruta, estado HTTP, veces restantes, Retry-After]
+        self.in_flight = 0
+        self.max_in_flight = 0  # máximo de peticiones atendidas a la vez
+        self._ids = itertools.count(1)
+        self.lock = threading.RLock()
+
+    def new_id(self, prefix='file'):
+        return '{}{}'.format(prefix, next(self._ids))
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def inject_errors(self, method, path_pattern, status=503, times=1, retry_after=None):
+        """
+        Las próximas `times` peticiones `method` a rutas que casen con `path_pattern`
+        fallan con `status` (y la cabecera Retry-After si se indica).
+        """
+        with self.lock:
+            self.faults.append([method, re.compile(path_pattern), status, times, retry_after])
+
+    def over_quota(self, user):
+        """True si `user` ya hizo sus peticiones permitidas en la ventana de la cuota."""
+        if not self.user_quota:
+            return False
+        limit, seconds = self.user_quota
+        now = time.monotonic()
+        with self.lock:
+            window = self._quota_windows.setdefault(user, deque())
+            while window and window[0] <= now - seconds:
+                window.popleft()
+            if len(window) >= limit:
+                self.count('rate_limited')
+                return True
+            window.append(now)
+            return False
+
+    def take_fault(self, method, path):
+        with self.lock:
+            for fault in self.faults:
+                if fault[0] == method and fault[3] > 0 and fault[1].search(path):
+                    fault[3] -= 1
+                    self.count('faults')
+                    return fault[2], fault[4]
+        return None
+
+    def add_file(self, name, mime_type, parents=None, data=b'', **extra):
+        file_id = self.new_id()
+        self.files[file_id] = dict(extra, id=file_id, name=name, mimeType=mime_type, parents=parents or [], trashed=False)
+        self._set_content(self.files[file_id], data)
+        return self.files[file_id]
+
+    def record_change(self, file_id):
+        with self.lock:
+            self.changes.append(file_id)
+
+    def _set_content(self, file, data, size=None):
+        self.record_change(file['id'])
+        file['size'] = str(len(data) if size is None else size)
+        file['md5Checksum'] = hashlib.md5(data).hexdigest()
+        file['version'] = str(int(file.get('version', '0')) + 1)
+        file['data'] = data if self.store_media else b''
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Sin esto las conexiones keep-alive sufren el retardo de ACK de ~40 ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, reason, message, headers=None):
+        self._send_json(status, {'error': {'code': status, 'message': message,
+                                           'errors': [{'reason': reason, 'message': message}]}}, headers)
+
+    def _read_body(self, keep=True):
+        length = int(self.headers.get('Content-Length') or 0)
+        chunks = []
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if keep:
+                chunks.append(chunk)
+        with self.state.lock:
+            self.state.bytes_received += length
+        return b''.join(chunks), length
+
+    def _public_file(self, file, fields=None):
+        public = {key: value for key, value in file.items() if key != 'data'}
+        if file['mimeType'].startswith('image/'):
+            public['thumbnailLink'] = 'https://lh3.googleusercontent.com/drive-storage/{}=s220'.format(file['id'])
+        return public
+
+    # Peticiones internas del batch: no vuelven a pagar la latencia simulada
+    INTERNAL_HEADER = 'X-Fake-Batch-Part'
+
+    def _route(self, method):
+        self.state.count('http_requests')
+        with self.state.lock:
+            self.state.in_flight += 1
+            self.state.max_in_flight = max(self.state.max_in_flight, self.state.in_flight)
+        try:
+            self._dispatch(method)
+        finally:
+            with self.state.lock:
+                self.state.in_flight -= 1
+
+    def _dispatch(self, method):
+        if self.server.latency and not self.headers.get(self.INTERNAL_HEADER):
+            time.sleep(self.server.latency)
+        parsed = urlparse(self.path)
+        self.query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        path = parsed.path
+        if not self.headers.get(self.INTERNAL_HEADER) and self.state.over_quota(self.headers.get('Authorization')):
+            self._read_body(keep=False)
+            return self._send_error(429, 'userRateLimitExceeded', 'Cuota por usuario superada')
+        fault = self.state.take_fault(method, path)
+        if fault is not None:
+            status, retry_after = fault
+            self._read_body(keep=False)
+            reason = 'rateLimitExceeded' if status in (403, 429) else 'backendError'
+            return self._send_error(status, reason, 'Error inyectado en {} {}'.format(method, path),
+                                    headers={'Retry-After': str(retry_after)} if retry_after is not None else None)
+        for pattern, handler_method, handler in self.server.routes:
+            if handler_method != method:
+                continue
+            match = pattern.match(path)
+            if match:
+                return handler(self, *match.groups())
+        self._send_error(404, 'notFound', 'Ruta no encontrada: {} {}'.format(method, path))
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+    def do_PATCH(self):
+        self._route('PATCH')
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+    # --- Drive v3 ---
+
+    def files_list(self):
+        self.state.count('files.list')
+        try:
+            # Copia bajo el lock: con clientes simultáneos se crean ficheros mientras se lista
+            with self.state.lock:
+                files = list(self.state.files.values())
+            matching = [f for f in files if matches_query(f, self.query.get('q'))]
+        except ValueError as e:
+            return self._send_error(400, 'invalidQuery', str(e))
+        if self.query.get('orderBy') == 'name':
+            matching.sort(key=lambda f: f['name'])
+        page_size = int(self.query.get('pageSize') or self.state.page_size)
+        start = int(self.query.get('pageToken') or 0)
+        page = matching[start:start + page_size]
+        payload = {'files': [self._public_file(f) for f in page]}
+        if start + page_size < len(matching):
+            payload['nextPageToken'] = str(start + page_size)
+        self._send_json(200, payload)
+
+    def _missing_parent(self, metadata):
+        for parent in metadata.get('parents') or []:
+            if parent not in self.state.files:
+                self._send_error(404, 'notFound', 'File not found: {}.'.format(parent))
+                return True
+        return False
+
+    def files_create(self):
+        self.state.count('files.create')
+        body, _ = self._read_body()
+        metadata = json.loads(body or b'{}')
+        if self._missing_parent(metadata):
+            return
+        with self.state.lock:
+            file = self.state.add_file(metadata.get('name'), metadata.get('mimeType', 'application/octet-stream'),
+                                       metadata.get('parents'), appProperties=metadata.get('appProperties', {}))
+        self._send_json(200, self._public_file(file))
+
+    def files_get(self, file_id):
+        file = self.state.files.get(file_id)
+        if file is None or file.get('trashed'):
+            return self._send_error(404, 'notFound', 'File not found: {}.'.format(file_id))
+        if self.query.get('alt') == 'media':
+            self.state.count('files.get_media')
+            self.send_response(200)
+            self.send_header('Content-Type', file['mimeType'])
+            self.send_header('Content-Length', str(len(file['data'])))
+            self.end_headers()
+            self.wfile.write(file['data'])
+            return
+        self.state.count('files.get')
+        self._send_json(200, self._public_file(file))
+
+    def files_update(self, file_id):
+        self.state.count('files.update')
+        body, _ = self._read_body()
+        metadata = json.loads(body or b'{}')
+        with self.state.lock:
+            file = self.state.files.get(file_id)
+            if file is None or file.get('trashed'):
+                return self._send_error(404, 'notFound', 'File not found: {}.'.format(file_id))
+            # Como en Drive, appProperties se combina con las que ya tiene el fichero
+            app_properties = dict(file.get('appProperties') or {}, **metadata.pop('appProperties', {}))
+            file.update({key: value for key, value in metadata.items() if key != 'id'}, appProperties=app_properties)
+            self.state.record_change(file_id)
+        self._send_json(200, self._public_file(file))
+
+    def files_delete(self, file_id):
+        self.state.count('files.delete')
+        with self.state.lock:
+            file = self.state.files.pop(file_id, None)
+        if file is None:
+            return self._send_error(404, 'notFound', 'File not found: {}.'.format(file_id))
+        self.state.record_change(file_id)
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # --- lh3.googleusercontent.com ---
+
+    def _send_image(self, file, data):
+        self.send_response(200)
+        self.send_header('Content-Type', file['mimeType'])
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def full_image(self, file_id):
+        self.state.count('full_images')
+        file = self.state.files.get(file_id)
+        if file is None:
+            return self._send_error(404, 'notFound', 'File not found: {}.'.format(file_id))
+        self._send_image(file, file['data'])
+
+    def thumbnail(self, file_id, size):
+        self.state.count('thumbnails')
+        file = self.state.files.get(file_id)
+        if file is None or not self.headers.get('Authorization'):
+            return self._send_error(404, 'notFound', 'File not found: {}.'.format(file_id))
+        # Como un JPEG de size x size píxeles a ~1 bit por píxel, nunca mayor que el original
+        self._send_image(file, file['data'][:int(size) * int(size) // 8])
+
+    def changes_start_token(self):
+        self.state.count('changes.getStartPageToken')
+        self._send_json(200, {'startPageToken': str(len(self.state.changes))})
+
+    def changes_list(self):
+        self.state.count('changes.list')
+        start = int(self.query.get('pageToken') or 0)
+        page_size = int(self.query.get('pageSize') or self.state.page_size)
+        end = min(start + page_size, len(self.state.changes))
+        changes = []
+        for file_id in self.state.changes[start:end]:
+            file = self.state.files.get(file_id)
+            if file is None:
+                changes.append({'fileId': file_id, 'removed': True})
+            else:
+                changes.append({'fileId': file_id, 'removed': False, 'file': self._public_file(file)})
+        payload = {'changes': changes}
+        if end < len(self.state.changes):
+            payload['nextPageToken'] = str(end)
+        else:
+            payload['newStartPageToken'] = str(end)
+        self._send_json(200, payload)
+
+    def permissions_create(self, file_id):
+        self.state.count('permissions.create')
+        body, _ = self._read_body()
+        if file_id not in self.state.files:
+            return self._send_error(404, 'notFound', 'File not found: {}.'.format(file_id))
+        permission = dict(json.loads(body or b'{}'), id=self.state.new_id('perm'))
+        with self.state.lock:
+            self.state.permissions.setdefault(file_id, []).append(permission)
+        self._send_json(200, permission)
+
+    # --- Batch (multipart/mixed con peticiones HTTP embebidas) ---
+
+    def batch(self):
+        self.state.count('batch')
+        body, _ = self._read_body()
+        message = BytesParser().parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode('ascii') + b'\r\n\r\n' + body)
+        boundary = 'batch_' + self.state.new_id('response')
+        out = []
+        connection = http.client.HTTPConnection(*self.server.server_address[:2])
+        for part in message.get_payload():
+            raw = part.get_payload(decode=True) or part.get_payload().encode('utf-8')
+            head, _, sub_body = raw.replace(b'\r\n', b'\n').partition(b'\n\n')
+            lines = head.decode('utf-8').split('\n')
+            method, path, _ = lines[0].split(' ', 2)
+            headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            headers[self.INTERNAL_HEADER] = '1'
+            headers['Content-Length'] = str(len(sub_body))
+            connection.request(method, path, body=sub_body, headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+            out.append('--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n'
+                       'HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n'.format(
+                           boundary, part['Content-ID'][1:-1], response.status, response.reason).encode('utf-8')
+                       + content + b'\r\n')
+        connection.close()
+        payload = b''.join(out) + '--{}--\r\n'.format(boundary).encode('ascii')
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/mixed; boundary={}'.format(boundary))
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # --- Subidas (Drive y YouTube) ---
+
+    def upload_start(self, service, file_id=None):
+        upload_type = self.query.get('uploadType')
+        if upload_type == 'resumable':
+            body, _ = self._read_body()
+            session_id = self.state.new_id('upload')
+            self.state.uploads[session_id] = {
+                'service': service,
+                'file_id': file_id,
+                'metadata': json.loads(body or b'{}'),
+                'mimeType': self.headers.get('X-Upload-Content-Type', 'application/octet-stream'),
+                'received': 0,
+                'data': [],
+                'hash': hashlib.md5(),
+            }
+            location = 'http://{}:{}/upload/session/{}'.format(self.server.server_address[0],
+                                                                 self.server.server_address[1], session_id)
+            self._send_json(200, {}, headers={'Location': location})
+        elif upload_type == 'multipart':
+            body, _ = self._read_body()
+            message = BytesParser().parsebytes(
+                b'Content-Type: ' + self.headers['Content-Type'].encode('ascii') + b'\r\n\r\n' + body)
+            parts = message.get_payload()
+            metadata = json.loads(parts[0].get_payload(decode=True) or b'{}')
+            data = parts[1].get_payload(decode=True)
+            self._finish_upload(service, file_id, metadata, parts[1].get_content_type(), data, len(data))
+        else:
+            data, size = self._read_body(keep=self.state.store_media)
+            self._finish_upload(service, file_id, {}, self.headers.get('Content-Type'), data, size)
+
+    def upload_chunk(self, session_id):
+        upload = self.state.uploads.get(session_id)
+        if upload is None:
+            return self._send_error(404, 'notFound', 'Upload session not found.')
+        data, size = self._read_body(keep=self.state.store_media)
+        upload['received'] += size
+        upload['hash'].update(data)
+        if self.state.store_media:
+            upload['data'].append(data)
+        content_range = self.headers.get('Content-Range', '')
+        total = content_range.rsplit('/', 1)[-1] if '/' in content_range else '*'
+        if total != '*' and upload['received'] < int(total):
+            self.send_response(308)
+            if upload['received']:
+                self.send_header('Range', 'bytes=0-{}'.format(upload['received'] - 1))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        del self.state.uploads[session_id]
+        self._finish_upload(upload['service'], upload['file_id'], upload['metadata'], upload['mimeType'],
+                            b''.join(upload['data']), upload['received'])
+
+    def _finish_upload(self, service, file_id, metadata, mime_type, data, size):
+        if service == 'youtube':
+            self.state.count('videos.insert')
+            video_id = self.state.new_id('video')
+            return self._send_json(200, {'id': video_id, 'snippet': metadata.get('snippet', {})})
+        if self._missing_parent(metadata):
+            return
+        with self.state.lock:
+            if file_id is None:
+                self.state.count('files.create')
+                file = self.state.add_file(metadata.get('name'), mime_type or 'application/octet-stream',
+                                           metadata.get('parents'), appProperties=metadata.get('appProperties', {}))
+            else:
+                self.state.count('files.update')
+                file = self.state.files.get(file_id)
+                if file is None:
+                    return self._send_error(404, 'notFound', 'File not found: {}.'.format(file_id))
+                file.update({key: value for key, value in metadata.items() if key != 'id'})
+            self.state._set_content(file, data, size)
+        self._send_json(200, self._public_file(file))
+
+
+_ROUTES = [
+    (r'^/drive/v3/files$', 'GET', _Handler.files_list),
+    (r'^/drive/v3/files$', 'POST', _Handler.files_create),
+    (r'^/drive/v3/files/([^/]+)$', 'GET', _Handler.files_get),
+    (r'^/drive/v3/files/([^/]+)$', 'PATCH', _Handler.files_update),
+    (r'^/drive/v3/files/([^/]+)$', 'DELETE', _Handler.files_delete),
+    (r'^/drive/v3/files/([^/]+)/permissions$', 'POST', _Handler.permissions_create),
+    (r'^/drive/v3/changes/startPageToken$', 'GET', _Handler.changes_start_token),
+    (r'^/drive/v3/changes$', 'GET', _Handler.changes_list),
+    (r'^/upload/drive/v3/files$', 'POST', lambda h: h.upload_start('drive')),
+    (r'^/upload/drive/v3/files/([^/]+)$', 'PATCH', lambda h, file_id: h.upload_start('drive', file_id)),
+    (r'^/upload/youtube/v3/videos$', 'POST', lambda h: h.upload_start('youtube')),
+    (r'^/upload/session/([^/]+)$', 'PUT', _Handler.upload_chunk),
+    (r'^/batch/drive/v3$', 'POST', _Handler.batch),
+    (r'^/d/([^/]+)$', 'GET', _Handler.full_image),
+    (r'^/drive-storage/([^/=]+)=s(\d+)$', 'GET', _Handler.thumbnail),
+]
+
+
+class LocalHttp(httplib2.Http):
+    """httplib2.Http que sustituye los hosts de las APIs de Google por `base_url`."""
+
+    GOOGLE_HOSTS = ('https://www.googleapis.com', 'https://youtube.googleapis.com', 'https://lh3.googleusercontent.com')
+
+    def __init__(self, base_url, **kwargs):
+        super(LocalHttp, self).__init__(**kwargs)
+        self.base_url = base_url
+        # Igual que googleapiclient.http.build_http: 308 es "Resume Incomplete"
+        self.redirect_codes = self.redirect_codes - {308}
+
+    def request(self, uri, *args, **kwargs):
+        for host in self.GOOGLE_HOSTS:
+            if uri.startswith(host):
+                uri = self.base_url + uri[len(host):]
+                break
+        return super(LocalHttp, self).request(uri, *args, **kwargs)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Cientos de conexiones simultáneas en las pruebas de carga
+    request_queue_size = 1024
+
+
+class FakeGoogleServer(object):
+    """Servidor HTTP en un hilo con el estado de Drive/YouTube en memoria."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, page_size=100, store_media=True, user_quota=None):
+        self.state = FakeGoogleState(page_size=page_size, store_media=store_media, user_quota=user_quota)
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.state = self.state
+        self.httpd.latency = latency
+        self.httpd.routes = [(re.compile(pattern), method, handler) for pattern, method, handler in _ROUTES]
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(*self.httpd.server_address)
+
+    def http(self, **kwargs):
+        """Transporte httplib2 que envía a este servidor las peticiones a Google."""
+        return LocalHttp(self.base_url, **kwargs)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
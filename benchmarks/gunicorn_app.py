@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+app.py para arrancarlo con gunicorn contra un servidor falso de Google ya en
+marcha (FAKE_GOOGLE_URL), p. ej. desde bench_concurrency.py.
+"""
+import os
+
+from harness import point_app_at
+from fake_google import LocalHttp
+
+import app as app_module
+
+
+class _RemoteFakeGoogle(object):
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def http(self, **kwargs):
+        return LocalHttp(self.base_url, **kwargs)
+
+
+point_app_at(_RemoteFakeGoogle(os.environ['FAKE_GOOGLE_URL']))
+app = app_module.app
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Utilidades comunes de los benchmarks: arranca app.py en un servidor local
+apuntando al FakeGoogleServer y prepara una sesión autenticada.
+"""
+import functools
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import googleapiclient.discovery
+from google_auth_httplib2 import AuthorizedHttp
+from flask import request
+from werkzeug.serving import make_server
+
+import app as app_module
+
+FAKE_CREDENTIALS = {
+    'token': 'fake-token',
+    'refresh_token': None,
+    'token_uri': 'https://oauth2.googleapis.com/token',
+    'client_id': 'fake-client',
+    'client_secret': 'fake-secret',
+    'scopes': ['https://www.googleapis.com/auth/drive.file'],
+}
+
+
+def point_app_at(fake_server):
+    """Hace que app.py construya sus servicios contra el servidor falso."""
+    original_build = googleapiclient.discovery.build
+
+    def fake_build(service_name, version, credentials=None, **kwargs):
+        kwargs['http'] = AuthorizedHttp(credentials, http=fake_server.http())
+        return original_build(service_name, version, **kwargs)
+
+    # app.build_service() importa build de googleapiclient.discovery al llamarla
+    googleapiclient.discovery.build = functools.wraps(original_build)(fake_build)
+    return original_build
+
+
+def session_cookie(credentials=None, **extra):
+    """Cookie de sesión (nombre=valor) con las credenciales indicadas, sea cual sea el backend."""
+    app = app_module.app
+    with app.test_request_context():
+        session = app.session_interface.open_session(app, request)
+        session.update(extra, credentials=credentials or FAKE_CREDENTIALS)
+        response = app.response_class()
+        app.session_interface.save_session(app, session, response)
+    return response.headers['Set-Cookie'].split(';', 1)[0]
+
+
+class AppServer(object):
+    """app.py servido por werkzeug en un hilo (peticiones HTTP reales)."""
+
+    def __init__(self, host='127.0.0.1', port=0, threaded=True):
+        self.httpd = make_server(host, port, app_module.app, threaded=threaded)
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def get_json(address, path, cookie):
+    connection = http.client.HTTPConnection(*address, timeout=60)
+    connection.request('GET', path, headers={'Cookie': cookie})
+    response = connection.getresponse()
+    payload = json.loads(response.read())
+    connection.close()
+    return response.status, payload
+
+
+def wait_for_job(address, status_url, cookie, timeout=600):
+    """Consulta /jobs/<id> hasta que el trabajo termina y devuelve su estado final."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, payload = get_json(address, status_url, cookie)
+        if status != 200 or payload.get('status') in ('done', 'error'):
+            return payload
+        time.sleep(0.05)
+    raise RuntimeError('Job {} did not finish'.format(status_url))
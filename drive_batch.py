@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Ejecución de muchas operaciones de Drive con peticiones batch.
+
+Cada petición batch agrupa hasta 100 operaciones en un único viaje de ida y
+vuelta; los fallos se reportan por operación sin interrumpir el resto.
+"""
+import time
+
+DRIVE_BATCH_LIMIT = 100
+
+
+def execute_in_batches(drive_service, requests, batch_size=DRIVE_BATCH_LIMIT, metrics=None):
+    """
+    Ejecuta `requests`, una lista de (request_id, HttpRequest), en peticiones
+    batch de `batch_size` operaciones.
+
+    Devuelve un dict request_id -> (respuesta, excepción); si falla una
+    petición batch completa, todas sus operaciones reciben esa excepción.
+    Con `metrics` se mide cada petición batch y se cuentan sus operaciones.
+    """
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    for offset in range(0, len(requests), batch_size):
+        chunk = requests[offset:offset + batch_size]
+        batch = drive_service.new_batch_http_request(callback=callback)
+        for request_id, http_request in chunk:
+            batch.add(http_request, request_id=request_id)
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            batch.execute()
+        except Exception as e:
+            print("Error in Drive batch request: {}".format(e))
+            outcome = 'error'
+            for request_id, _ in chunk:
+                results.setdefault(request_id, (None, e))
+        if metrics is not None:
+            metrics.record_api_call('drive.batch', time.perf_counter() - start, outcome)
+            for _, http_request in chunk:
+                api, _, method = (http_request.methodId or 'unknown.unknown').partition('.')
+                metrics.inc('google_api_batched_operations_total', api=api, method=method)
+    return results
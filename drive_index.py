@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Índice local de carpetas e imágenes de Drive mantenido con la API de cambios.
+
+La primera vez se lista todo (carpetas, o las imágenes de una carpeta) y se
+guarda el `startPageToken` de `changes()`. En las siguientes consultas solo se
+piden los cambios desde ese token y se aplican al índice, en lugar de volver a
+paginar todas las carpetas e imágenes de la cuenta.
+"""
+import threading
+from collections import OrderedDict
+
+from googleapiclient.errors import HttpError
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+CHANGE_FIELDS = 'nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, trashed))'
+
+
+def is_image(file):
+    return (file.get('mimeType') or '').startswith('image/')
+
+
+class DriveIndex(object):
+    """Carpetas e imágenes (por carpeta) de una cuenta."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.page_token = None
+        self.folders = None  # id -> nombre, None hasta el primer listado
+        self.folder_images = {}  # id de carpeta -> {id de imagen: nombre}
+
+    def reset(self):
+        self.page_token = None
+        self.folders = None
+        self.folder_images = {}
+
+    def apply_change(self, change):
+        file_id = change.get('fileId')
+        file = change.get('file') or {}
+        if change.get('removed') or file.get('trashed'):
+            if self.folders is not None:
+                self.folders.pop(file_id, None)
+            self.folder_images.pop(file_id, None)
+            for images in self.folder_images.values():
+                images.pop(file_id, None)
+            return
+        if file.get('mimeType') == FOLDER_MIME_TYPE:
+            if self.folders is not None:
+                self.folders[file_id] = file.get('name')
+        elif is_image(file):
+            parents = file.get('parents') or []
+            for folder_id, images in self.folder_images.items():
+                if folder_id in parents:
+                    images[file_id] = file.get('name')
+                else:
+                    images.pop(file_id, None)
+
+
+class DriveIndexStore(object):
+    """Índices por cuenta (LRU) y métricas de páginas pedidas a Drive frente a servidas del índice."""
+
+    def __init__(self, max_accounts=64, page_size=1000):
+        self.max_accounts = max_accounts
+        self.page_size = page_size
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self.list_pages_fetched = 0
+        self.change_pages_fetched = 0
+        self.listings_from_index = 0
+        self.full_listings = 0
+
+    def _index(self, account):
+        with self._lock:
+            index = self._indexes.get(account)
+            if index is None:
+                index = self._indexes[account] = DriveIndex()
+                while len(self._indexes) > self.max_accounts:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(account)
+            return index
+
+    def _list_all(self, drive_service, query):
+        files = []
+        page_token = None
+        while True:
+            response = drive_service.files().list(
+                q=query,
+                spaces='drive',
+                fields='nextPageToken, files(id, name)',
+                pageSize=self.page_size,
+                pageToken=page_token
+            ).execute()
+            with self._lock:
+                self.list_pages_fetched += 1
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken', None)
+            if page_token is None:
+                return files
+
+    def _sync(self, drive_service, index):
+        """Aplica al índice los cambios desde el último token."""
+        if index.page_token is None:
+            response = drive_service.changes().getStartPageToken().execute()
+            index.page_token = response.get('startPageToken')
+            return
+        page_token = index.page_token
+        while page_token is not None:
+            try:
+                response = drive_service.changes().list(
+                    pageToken=page_token,
+                    spaces='drive',
+                    fields=CHANGE_FIELDS,
+                    pageSize=self.page_size
+                ).execute()
+            except HttpError as e:
+                # Solo con el token caducado o no válido (410, o 404 en changes.list) se
+                # reconstruye el índice desde cero; cualquier otro error (503, 429 tras
+                # agotar los reintentos...) deja el índice como está y se propaga
+                if e.resp.status not in (404, 410):
+                    raise
+                print("Drive changes page token is no longer valid, rebuilding index: {}".format(e))
+                index.reset()
+                self._sync(drive_service, index)
+                return
+            with self._lock:
+                self.change_pages_fetched += 1
+            for change in response.get('changes', []):
+                index.apply_change(change)
+            if 'newStartPageToken' in response:
+                index.page_token = response['newStartPageToken']
+            page_token = response.get('nextPageToken')
+
+    def folders(self, drive_service, account, force=False):
+        """Lista de {'id', 'name'} de todas las carpetas de la cuenta."""
+        index = self._index(account)
+        with index.lock:
+            if force:
+                index.reset()
+            # El token se obtiene antes del listado para no perder cambios intermedios
+            self._sync(drive_service, index)
+            if index.folders is None:
+                files = self._list_all(drive_service, "mimeType='{}' and trashed=false".format(FOLDER_MIME_TYPE))
+                index.folders = {file.get('id'): file.get('name') for file in files}
+                with self._lock:
+                    self.full_listings += 1
+            else:
+                with self._lock:
+                    self.listings_from_index += 1
+            return [{'id': folder_id, 'name': name} for folder_id, name in index.folders.items()]
+
+    def images(self, drive_service, account, folder_id, force=False):
+        """Lista de {'id', 'name'} de las imágenes de una carpeta."""
+        index = self._index(account)
+        with index.lock:
+            if force:
+                index.folder_images.pop(folder_id, None)
+            self._sync(drive_service, index)
+            images = index.folder_images.get(folder_id)
+            if images is None:
+                files = self._list_all(
+                    drive_service,
+                    "'{}' in parents and mimeType contains 'image/' and trashed=false".format(folder_id))
+                images = index.folder_images[folder_id] = {file.get('id'): file.get('name') for file in files}
+                with self._lock:
+                    self.full_listings += 1
+            else:
+                with self._lock:
+                    self.listings_from_index += 1
+            return [{'id': image_id, 'name': name} for image_id, name in images.items()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'accounts': len(self._indexes),
+                'full_listings': self.full_listings,
+                'listings_from_index': self.listings_from_index,
+                'list_pages_fetched': self.list_pages_fetched,
+                'change_pages_fetched': self.change_pages_fetched,
+            }
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de IDs de carpetas de Drive por cuenta y nombre.
+
+save_template(), list_templates() y get_or_create_folder() resuelven siempre la
+misma carpeta por nombre; con esta caché solo se consulta Drive la primera vez
+(o cuando caduca la entrada o Drive responde notFound).
+
+Al crear una carpeta se evita duplicarla: dentro del proceso con un lock por
+(cuenta, nombre) y entre workers de gunicorn volviendo a listar tras crearla y
+quedándose con la más antigua, eliminando la creada de más.
+"""
+import threading
+import time
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+def escape_query_value(value):
+    """Escapa un valor para usarlo entre comillas simples en una consulta `q` de Drive."""
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+class FolderCache(object):
+    """Nombre de carpeta -> ID, por cuenta, con TTL."""
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._folders = {}
+        self._lock = threading.Lock()
+        self._create_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, account, folder_name):
+        key = (account, folder_name)
+        with self._lock:
+            entry = self._folders.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def set(self, account, folder_name, folder_id):
+        with self._lock:
+            self._folders[(account, folder_name)] = (time.time() + self.ttl, folder_id)
+
+    def invalidate(self, account, folder_name=None, folder_id=None):
+        """Olvida una carpeta por nombre o por ID (p. ej. tras un notFound de Drive)."""
+        with self._lock:
+            for key, entry in list(self._folders.items()):
+                if key[0] != account:
+                    continue
+                if (folder_name is not None and key[1] == folder_name) or \
+                        (folder_id is not None and entry[1] == folder_id):
+                    del self._folders[key]
+
+    def _create_lock(self, account, folder_name):
+        with self._lock:
+            return self._create_locks.setdefault((account, folder_name), threading.Lock())
+
+    def resolve(self, drive_service, account, folder_name, create=True):
+        """
+        Devuelve el ID de la carpeta `folder_name` de la cuenta. Si no existe la
+        crea (o devuelve None si `create` es False).
+        """
+        folder_id = self.get(account, folder_name)
+        if folder_id:
+            return folder_id
+
+        with self._create_lock(account, folder_name):
+            # Otro hilo puede haberla resuelto mientras esperábamos
+            folder_id = self.get(account, folder_name)
+            if folder_id:
+                return folder_id
+
+            folders = self._find(drive_service, folder_name)
+            if not folders and create:
+                file_metadata = {'name': folder_name, 'mimeType': FOLDER_MIME_TYPE}
+                created = drive_service.files().create(body=file_metadata, fields='id').execute()
+                # Otro worker puede haber creado la misma carpeta a la vez: nos
+                # quedamos con la más antigua y borramos la nuestra si sobra.
+                folders = self._find(drive_service, folder_name) or [created]
+                if folders[0].get('id') != created.get('id'):
+                    drive_service.files().delete(fileId=created.get('id')).execute()
+            if not folders:
+                return None
+
+            folder_id = folders[0].get('id')
+            self.set(account, folder_name, folder_id)
+            return folder_id
+
+    def _find(self, drive_service, folder_name):
+        query = "mimeType='{}' and name='{}' and trashed=false".format(
+            FOLDER_MIME_TYPE, escape_query_value(folder_name))
+        response = drive_service.files().list(
+            q=query, spaces='drive', fields='files(id)', orderBy='createdTime').execute()
+        return response.get('files', [])
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._folders), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Configuración de gunicorn.
+
+Las rutas que hablan con Drive y YouTube pasan casi todo el tiempo esperando a
+la red, así que cada worker atiende muchas peticiones a la vez (WORKER_MODE):
+
+- gthread (por defecto): IO_THREADS hilos por worker.
+- gevent: un bucle de eventos por worker con hasta IO_CONNECTIONS peticiones
+  (requiere `pip install gevent`; si no está instalado se usa gthread).
+- sync: una petición por worker, como antes.
+
+Los ficheros subidos pasan a disco a partir de UPLOAD_SPOOL_MAX_MEMORY y los
+servicios de Google se prestan por petición desde el pool, así que cada subida
+en curso ocupa poca memoria.
+"""
+import importlib.util
+import os
+
+WORKER_MODE = os.environ.get('WORKER_MODE', 'gthread')
+
+if WORKER_MODE == 'gevent' and importlib.util.find_spec('gevent') is None:
+    print("gevent is not installed, falling back to gthread workers")
+    WORKER_MODE = 'gthread'
+
+if WORKER_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('IO_CONNECTIONS', 1000))
+elif WORKER_MODE == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('IO_THREADS', 256))
+else:
+    worker_class = 'sync'
+
+# Las subidas de vídeo largas no deben matar al worker en modo sync
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600 if worker_class == 'sync' else 30))
+
+# La aplicación (con las plantillas ya compiladas) se carga una vez en el proceso
+# maestro y los workers nacen con ella por fork (PRELOAD_APP=0 lo desactiva)
+preload_app = os.environ.get('PRELOAD_APP', '1') != '0'
+
+
+# Las librerías de Google y el inliner se importan en su primer uso. WARM_UP=1 (por
+# defecto) las carga antes: con preload_app en el maestro antes del fork, así cada
+# worker nace con ellas; sin preload, en un hilo en segundo plano mientras el
+# worker ya atiende peticiones.
+WARM_UP = os.environ.get('WARM_UP', '1') != '0'
+
+
+def when_ready(server):
+    if WARM_UP and preload_app:
+        from app import warm_up
+        warm_up()
+
+
+def post_worker_init(worker):
+    import threading
+    from app import video_upload_queue, warm_up
+
+    # Ya en el worker: retomar las subidas que dejó a medias un proceso anterior
+    video_upload_queue.maintenance(force=True)
+    if WARM_UP and not preload_app:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
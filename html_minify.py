@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Reducción del HTML de la newsletter después del inlineado de estilos.
+
+Tras Pynliner cada <p>, <h2> y <td> lleva su atributo style completo, a menudo
+con propiedades repetidas (las de la hoja delante de las del elemento), y el
+HTML conserva la indentación y los comentarios de template.html. Gmail recorta
+los mensajes de más de ~102 KB, así que aquí se quita lo que no cambia cómo se
+ve el correo:
+
+- comentarios HTML (salvo los condicionales de Outlook, `<!--[if mso]>`);
+- en el atributo style de cada etiqueta (no en el texto), las declaraciones
+  que pisa otra de la misma propiedad, salvo que la que gana lleve una
+  función o un prefijo de navegador (`background: #fff; background:
+  linear-gradient(...)`: la primera es la alternativa de los clientes que no
+  entienden la segunda); el resto se escribe sin espacios sobrantes y con los
+  valores en su forma corta (colores #rrggbb, longitudes cero, márgenes
+  repetidos);
+- en los bloques <style> (Pynliner solo deja las reglas @media, que no se
+  pueden inlinear), los comentarios, los espacios y las reglas cuyos
+  selectores no pueden coincidir con ningún elemento del documento;
+- el espacio entre etiquetas de bloque y las secuencias de espacios del texto,
+  salvo que haya <pre>, <textarea>, <script> o white-space: pre.
+
+Los atributos style se repiten mucho, así que su versión reducida se guarda en
+una caché.
+"""
+import functools
+import re
+from html import escape, unescape
+
+# Límite a partir del cual Gmail muestra "[Mensaje recortado]"
+GMAIL_CLIP_BYTES = 102 * 1024
+
+# Etiquetas entre las que el espacio no se ve en ningún cliente de correo
+BLOCK_TAGS = frozenset([
+    'html', 'head', 'body', 'meta', 'title', 'style', 'link', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'td',
+    'th', 'div', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'center', 'br', 'hr', 'form',
+])
+
+_COMMENT = re.compile(r'<!--(?!\[if)(?!<!)[\s\S]*?-->')
+_CSS_COMMENT = re.compile(r'/\*[\s\S]*?\*/')
+# Etiqueta de apertura completa, con los valores entre comillas enteros (pueden llevar '>')
+_START_TAG = re.compile(
+    r'''(<[a-zA-Z][^\s/>]*)((?:\s+[^\s"'>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?)*)(\s*/?>)''')
+_ATTRIBUTE = re.compile(r'''(\s+)([^\s"'>/=]+)(?:(\s*=\s*)(?:(["'])(.*?)\4|[^\s"'=<>`]+))?''', re.S)
+_STYLE_BLOCK = re.compile(r'(<style\b[^>]*>)(.*?)(</style>)', re.S | re.I)
+_BLOCK_NAMES = '|'.join(sorted(BLOCK_TAGS))
+# Sin re.I, que impide a re buscar primero el literal: BeautifulSoup (el inliner) escribe las
+# etiquetas y atributos en minúsculas. Se busca en el texto invertido para que la expresión empiece por un literal ('< >' es '> <'
+# al revés) y la etiqueta de la izquierda quede detrás: mucho más rápido que probar cada '<'
+_SPACE_AFTER_BLOCK_REVERSED = re.compile(
+    r'< >(?=(?:[^<>]*\s)?(?:{})/?<)'.format('|'.join(name[::-1] for name in sorted(BLOCK_TAGS))))
+_SPACE_BEFORE_BLOCK = re.compile(r'> (?=</?(?:{})\b|<!)'.format(_BLOCK_NAMES))
+# Dos búsquedas con un literal al principio: mucho más rápidas que una alternativa
+_PREFORMATTED_TAG = re.compile(r'<(?:pre|textarea|script)\b')
+_WHITE_SPACE_PRE = re.compile(r'white-space\s*:\s*pre')
+_SPACES = re.compile(r'[ \t\r\n]+')
+_IMPORTANT = re.compile(r'\s*!\s*important\s*$', re.I)
+_SELECTOR_SKIP = re.compile(r'\[[^\]]*\]|::?[a-zA-Z-]+(?:\([^)]*\))?')
+_SELECTOR_TOKEN = re.compile(r'([.#]?)(-?[_a-zA-Z][\w-]*)')
+# Sin exigir el espacio delante (p. ej. también data-id=): sobran tokens, nunca faltan
+_CLASS_ATTR = re.compile(r'class="([^"]*)"|class=\'([^\']*)\'')
+_ID_ATTR = re.compile(r'id="([^"]*)"|id=\'([^\']*)\'')
+_TAG = re.compile(r'<([a-z][a-z0-9]*)')
+_LONG_HEX = re.compile(r'#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3\b')
+_ZERO_LENGTH = re.compile(r'(?<![\w.#-])0(?:px|em|rem|pt)\b')
+_COMMA = re.compile(r'\s*,\s*')
+BOX_PROPERTIES = frozenset(['margin', 'padding'])
+# Caracteres que str.split() toma por espacio además de ' ', \t, \r y \n (entre ellos &nbsp;)
+_OTHER_WHITESPACE = ''.join(char for char in map(chr, range(0x3001)) if char.isspace() and char not in ' \t\r\n')
+
+
+def _split_top_level(text, separator):
+    """Divide por `separator` fuera de comillas y paréntesis (p. ej. url(data:...;base64,...))."""
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _compact_value(name, value):
+    """Mismo valor en menos bytes: #333333 -> #333, 0px -> 0, `a, b` -> `a,b`, `0 1px 0 1px` -> `0 1px`."""
+    if '"' in value or "'" in value or 'url(' in value.lower():
+        return value
+    value = _COMMA.sub(',', _ZERO_LENGTH.sub('0', _LONG_HEX.sub(r'#\1\2\3', value)))
+    if name in BOX_PROPERTIES:
+        sides = value.split(' ')
+        if len(sides) == 4 and sides[3] == sides[1]:
+            sides.pop()
+        if len(sides) == 3 and sides[2] == sides[0]:
+            sides.pop()
+        if len(sides) == 2 and sides[1] == sides[0]:
+            sides.pop()
+        value = ' '.join(sides)
+    return value
+
+
+@functools.lru_cache(maxsize=8192)
+def compact_declarations(text):
+    """
+    Declaraciones CSS (`a: 1; b: 2 !important`) sin las que no tienen efecto.
+    De cada propiedad queda la que gana en la cascada (la última, o la última
+    !important si hay alguna), en su posición; si su valor lleva una función
+    o un prefijo de navegador se conservan también las anteriores, que son la
+    alternativa de los clientes que no lo entienden.
+    """
+    declarations = []
+    for part in _split_top_level(text, ';'):
+        name, colon, value = part.partition(':')
+        name = name.strip().lower()
+        if not colon or not name:
+            continue
+        important = bool(_IMPORTANT.search(value))
+        value = _SPACES.sub(' ', _IMPORTANT.sub('', value)).strip()
+        if value:
+            declarations.append((name, value, important))
+
+    winners = {}
+    for i, (name, _, important) in enumerate(declarations):
+        current = winners.get(name)
+        if current is None or important or not declarations[current][2]:
+            winners[name] = i
+    fallbacks = set(name for name, i in winners.items() if _needs_fallback(declarations[i][1]))
+    return ';'.join(
+        '{}:{}{}'.format(name, _compact_value(name, value), '!important' if important else '')
+        for i, (name, value, important) in enumerate(declarations)
+        if winners[name] == i or name in fallbacks)
+
+
+def _needs_fallback(value):
+    # linear-gradient(...), calc(...), -webkit-box...: no todos los clientes de correo los entienden
+    return '(' in value or (value[:1] == '-' and value[1:2].isalpha())
+
+
+def _document_tokens(html):
+    """Clases, IDs y etiquetas que aparecen en el documento."""
+    classes = set()
+    for double, single in set(_CLASS_ATTR.findall(html)):
+        classes.update((double or single).split())
+    ids = set((double or single).strip() for double, single in _ID_ATTR.findall(html))
+    return classes, ids, set(_TAG.findall(html))
+
+
+def _selector_may_match(selector, tokens):
+    """
+    False solo si es seguro que el selector no coincide con nada: le falta al
+    documento alguna de sus clases, IDs o etiquetas. Los atributos y las
+    pseudoclases no se comprueban.
+    """
+    classes, ids, tags = tokens
+    for prefix, name in _SELECTOR_TOKEN.findall(_SELECTOR_SKIP.sub(' ', selector)):
+        if prefix == '.' and name not in classes:
+            return False
+        if prefix == '#' and name not in ids:
+            return False
+        if not prefix and name.lower() not in tags:
+            return False
+    return True
+
+
+def _rules(css):
+    """
+    (cabecera, cuerpo) de cada regla o bloque de primer nivel, con el texto
+    final sin llaves (p. ej. un @import) como cabecera sin cuerpo; None si las
+    llaves no cuadran.
+    """
+    rules = []
+    position = 0
+    while True:
+        start = css.find('{', position)
+        if start == -1:
+            if css[position:].strip():
+                rules.append((css[position:].strip(), None))
+            return rules
+        depth = 1
+        end = start + 1
+        while depth and end < len(css):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+            end += 1
+        if depth:
+            return None
+        rules.append((css[position:start].strip(), css[start + 1:end - 1]))
+        position = end
+
+
+def compact_css(css, tokens):
+    """Hoja de estilos sin comentarios, sin espacios sobrantes y sin reglas que no pueden aplicarse."""
+    rules = _rules(_CSS_COMMENT.sub('', css))
+    if rules is None:
+        return css
+    output = []
+    for header, body in rules:
+        # Lo que precede a la cabecera terminado en ';' son sentencias como @import o @charset
+        statements = _split_top_level(header, ';')
+        header = statements.pop().strip() if body is not None else ''
+        output.extend(_SPACES.sub(' ', statement).strip() + ';' for statement in statements if statement.strip())
+        if body is None:
+            continue
+        if header.lower().startswith('@media'):
+            inner = compact_css(body, tokens)
+            if inner:
+                output.append('{}{{{}}}'.format(_SPACES.sub(' ', header), inner))
+        elif header.startswith('@'):
+            # @font-face, @keyframes...: se dejan como están
+            output.append('{}{{{}}}'.format(_SPACES.sub(' ', header), body.strip()))
+        else:
+            selectors = [_SPACES.sub(' ', selector).strip() for selector in _split_top_level(header, ',')]
+            selectors = [selector for selector in selectors if _selector_may_match(selector, tokens)]
+            declarations = compact_declarations(body)
+            if selectors and declarations:
+                output.append('{}{{{}}}'.format(','.join(selectors), declarations))
+    return ''.join(output)
+
+
+@functools.lru_cache(maxsize=8192)
+def _compact_style_attribute_value(value, quote):
+    # Las entidades (&quot; en font-family) llevan ';': se separa con el valor ya decodificado
+    declarations = compact_declarations(unescape(value))
+    if not declarations:
+        return ''
+    return 'style={0}{1}{0}'.format(
+        quote, escape(declarations, quote=False).replace(quote, '&quot;' if quote == '"' else '&#x27;'))
+
+
+def _compact_style_attribute(match):
+    if match.group(2).lower() != 'style' or not match.group(4):
+        return match.group(0)  # otro atributo, o style sin comillas: se deja igual
+    return match.group(1) + _compact_style_attribute_value(match.group(5), match.group(4))
+
+
+def _compact_start_tag(match):
+    attributes = match.group(2)
+    if 'style' not in attributes.lower():
+        return match.group(0)
+    # Solo los atributos de la etiqueta: un style="..." en el texto o dentro de otro atributo no se toca
+    return match.group(1) + _ATTRIBUTE.sub(_compact_style_attribute, attributes) + match.group(3)
+
+
+def _collapse_spaces(html):
+    # Sin expresiones regulares: mucho más rápido en documentos grandes. Solo espacio ASCII: los
+    # &nbsp; (U+00A0) y el resto de espacios Unicode se conservan
+    if not any(char in html for char in _OTHER_WHITESPACE):
+        return ' '.join(html.split())
+    html = html.replace('\r', ' ').replace('\n', ' ').replace('\t', ' ')
+    while '  ' in html:
+        html = html.replace('  ', ' ')
+    return html
+
+
+def minify_html(html):
+    """HTML de la newsletter reducido (ver la descripción del módulo)."""
+    html = _COMMENT.sub('', html)
+
+    tokens = []
+
+    def compact_style_block(match):
+        if not tokens:
+            tokens.append(_document_tokens(html))
+        css = compact_css(match.group(2), tokens[0])
+        return match.group(1) + css + match.group(3) if css else ''
+
+    html = _STYLE_BLOCK.sub(compact_style_block, html)
+    html = _START_TAG.sub(_compact_start_tag, html)
+    if not _PREFORMATTED_TAG.search(html) and not _WHITE_SPACE_PRE.search(html):
+        # Todo espacio queda en uno solo, que sobra entre etiquetas si alguna de las dos es de bloque
+        html = _collapse_spaces(html)
+        html = _SPACE_AFTER_BLOCK_REVERSED.sub('<>', html[::-1])[::-1]
+        html = _SPACE_BEFORE_BLOCK.sub('>', html)
+    return html.strip()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Índice de imágenes ya subidas por hash de contenido, para no subir dos veces
+el mismo fichero (el logo de la cabecera, los banners de cada semana...).
+
+Cada imagen guarda su hash SHA-256 en `appProperties.contentHash` una vez se
+ha hecho pública (una imagen privada no puede reutilizarse). La primera consulta a una carpeta lista los hashes de sus ficheros y los guarda
+en memoria (con TTL); las siguientes subidas a esa carpeta se comprueban
+localmente y, si el contenido ya existe, se devuelve el fichero existente sin
+subir nada ni crear otro permiso.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+HASH_PROPERTY = 'contentHash'
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def content_hash(stream, variant=''):
+    """
+    SHA-256 del contenido de `stream` (leído por bloques) y de `variant`, que
+    distingue el mismo original procesado de forma distinta (p. ej. otro ancho).
+    """
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    stream.seek(0)
+    digest.update(b'\0' + variant.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ContentHashIndex(object):
+    """Hash -> ID de fichero por (cuenta, carpeta), LRU de carpetas con TTL."""
+
+    def __init__(self, ttl=600, max_folders=256, page_size=1000):
+        self.ttl = ttl
+        self.max_folders = max_folders
+        self.page_size = page_size
+        self._folders = OrderedDict()  # (cuenta, carpeta) -> (caduca, {hash: id})
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.folder_loads = 0
+        self.bytes_saved = 0
+
+    def _load(self, drive_service, folder_id):
+        hashes = {}
+        page_token = None
+        while True:
+            response = drive_service.files().list(
+                q="'{}' in parents and trashed=false".format(folder_id),
+                spaces='drive',
+                fields='nextPageToken, files(id, appProperties)',
+                pageSize=self.page_size,
+                pageToken=page_token
+            ).execute()
+            for file in response.get('files', []):
+                file_hash = (file.get('appProperties') or {}).get(HASH_PROPERTY)
+                if file_hash:
+                    hashes[file_hash] = file.get('id')
+            page_token = response.get('nextPageToken', None)
+            if page_token is None:
+                return hashes
+
+    def _hashes(self, drive_service, account, folder_id):
+        key = (account, folder_id)
+        with self._lock:
+            entry = self._folders.get(key)
+            if entry and entry[0] > time.time():
+                self._folders.move_to_end(key)
+                return entry[1]
+        hashes = self._load(drive_service, folder_id)
+        with self._lock:
+            self.folder_loads += 1
+            self._folders[key] = (time.time() + self.ttl, hashes)
+            self._folders.move_to_end(key)
+            while len(self._folders) > self.max_folders:
+                self._folders.popitem(last=False)
+        return hashes
+
+    def lookup(self, drive_service, account, folder_id, file_hash, size=0):
+        """ID del fichero de la carpeta con ese hash, o None."""
+        file_id = self._hashes(drive_service, account, folder_id).get(file_hash)
+        with self._lock:
+            if file_id:
+                self.hits += 1
+                self.bytes_saved += size
+            else:
+                self.misses += 1
+        return file_id
+
+    def add(self, account, folder_id, file_hash, file_id):
+        with self._lock:
+            entry = self._folders.get((account, folder_id))
+            if entry:
+                entry[1][file_hash] = file_id
+
+    def forget(self, account, file_id):
+        """Quita un fichero borrado de todas las carpetas de la cuenta."""
+        with self._lock:
+            for (entry_account, _), (_, hashes) in self._folders.items():
+                if entry_account != account:
+                    continue
+                for file_hash in [h for h, i in hashes.items() if i == file_id]:
+                    del hashes[file_hash]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'folders': len(self._folders),
+                'hits': self.hits,
+                'misses': self.misses,
+                'folder_loads': self.folder_loads,
+                'bytes_saved': self.bytes_saved,
+            }
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Optimización de imágenes antes de subirlas a Drive.
+
+Las fotos de cámara (varios MB, 4000 px) acababan tal cual en `hero_src` y en
+las secciones, que en templates/template.html se muestran a 540 px como mucho
+(600 px el contenedor). Aquí se corrige la orientación EXIF, se reducen al
+ancho pedido (por defecto 1080 px, el doble de 540 para pantallas retina), se
+eliminan los metadatos y se vuelven a codificar en el formato más pequeño de
+los permitidos. Si el resultado no es más pequeño se sube el original.
+
+La codificación se hace en un pool de procesos para no ocupar el GIL del
+worker web. Pillow es opcional: sin él las imágenes se suben sin cambios.
+"""
+import importlib.util
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from werkzeug.datastructures import FileStorage
+
+# Pillow solo se importa en los procesos del pool
+HAS_PILLOW = importlib.util.find_spec('PIL') is not None
+
+# Anchos de templates/template.html (540 imágenes, 600 contenedor) y sus 2x
+ALLOWED_WIDTHS = (540, 600, 1080, 1200)
+DEFAULT_WIDTH = 1080
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+def _encode(image, image_format):
+    out = io.BytesIO()
+    if image_format == 'JPEG':
+        image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        image.save(out, 'WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        image.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+def optimize_bytes(data, max_width, formats):
+    """
+    Se ejecuta en el pool de procesos. Devuelve (datos, formato, ancho) de la
+    versión más pequeña, o (None, None, None) si no compensa tocar la imagen.
+    """
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(data))
+    if getattr(image, 'is_animated', False):
+        return None, None, None
+    if image.format == 'JPEG':
+        # Decodifica el JPEG ya reducido (1/2, 1/4, 1/8) si sigue siendo >= max_width
+        image.draft('RGB', (max_width, max_width))
+    image = ImageOps.exif_transpose(image)
+    if image.width > max_width:
+        height = max(1, round(image.height * max_width / float(image.width)))
+        image = image.resize((max_width, height), Image.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    # JPEG no admite transparencia
+    candidates = [image_format for image_format in formats if not (has_alpha and image_format == 'JPEG')]
+    best = None
+    for image_format in candidates or ['PNG']:
+        encoded = _encode(image, image_format)
+        if best is None or len(encoded) < len(best[0]):
+            best = (encoded, image_format)
+    if len(best[0]) >= len(data):
+        return None, None, None
+    return best[0], best[1], image.width
+
+
+class ImagePipeline(object):
+    """Optimiza los ficheros subidos en un pool de procesos y acumula métricas."""
+
+    def __init__(self, workers=2, formats=('JPEG', 'PNG'), enabled=True, max_bytes=40 * 1024 * 1024):
+        self.workers = workers
+        self.formats = tuple(formats)
+        self.max_bytes = max_bytes  # los ficheros más grandes se suben sin leerlos a memoria
+        self.enabled = enabled and HAS_PILLOW
+        self._executor = None
+        self._lock = threading.Lock()
+        self.images = 0
+        self.optimized = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_seconds = 0.0
+
+    def _pool(self):
+        # Se crea en el primer uso, ya dentro del worker de gunicorn
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context('spawn'))
+            return self._executor
+
+    def variant(self, max_width):
+        """Identifica el procesado que recibirá una imagen (para el hash de deduplicación)."""
+        if not self.enabled:
+            return ''
+        return 'w{}'.format(max_width if max_width in ALLOWED_WIDTHS else DEFAULT_WIDTH)
+
+    def optimize(self, file, max_width=DEFAULT_WIDTH):
+        """
+        Devuelve (FileStorage, informe). Si la imagen no se puede o no compensa
+        optimizarla, devuelve el mismo `file`.
+        """
+        if not self.enabled or not (file.mimetype or '').startswith('image/'):
+            return file, None
+        if max_width not in ALLOWED_WIDTHS:
+            max_width = DEFAULT_WIDTH
+        file.stream.seek(0, os.SEEK_END)
+        if file.stream.tell() > self.max_bytes:
+            file.stream.seek(0)
+            return file, None
+
+        file.stream.seek(0)
+        data = file.stream.read()
+        start = time.perf_counter()
+        try:
+            optimized, image_format, width = self._pool().submit(
+                optimize_bytes, data, max_width, self.formats).result()
+        except Exception as e:
+            print("Error optimizing image {}: {}".format(file.filename, e))
+            optimized = None
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.images += 1
+            self.bytes_in += len(data)
+            self.encode_seconds += elapsed
+            self.bytes_out += len(optimized) if optimized else len(data)
+            if optimized:
+                self.optimized += 1
+
+        report = {
+            'originalBytes': len(data),
+            'optimizedBytes': len(optimized) if optimized else len(data),
+            'savedBytes': len(data) - len(optimized) if optimized else 0,
+            'encodeMs': round(1000 * elapsed, 1),
+        }
+        if not optimized:
+            file.stream.seek(0)
+            return file, report
+
+        report.update(format=image_format, width=width)
+        filename = os.path.splitext(file.filename or 'imagen')[0] + EXTENSIONS[image_format]
+        optimized_file = FileStorage(stream=io.BytesIO(optimized), filename=filename,
+                                     content_type='image/{}'.format(image_format.lower()))
+        return optimized_file, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'images': self.images,
+                'optimized': self.optimized,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'bytes_saved': self.bytes_in - self.bytes_out,
+                'avg_encode_ms': 1000.0 * self.encode_seconds / self.images if self.images else 0.0,
+            }
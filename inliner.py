@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Inliner de CSS con la hoja de estilos precompilada.
+
+Pynliner vuelve a parsear con cssutils el bloque <style> de template.html en
+cada petición y resuelve la especificidad elemento a elemento. Como ese bloque
+es estático, aquí se compila una sola vez por versión de la plantilla (hash del
+contenido del <style>) y se reutiliza. La salida es idéntica byte a byte a la de
+`Pynliner().from_string(html).run()`.
+"""
+import hashlib
+import os
+import re
+import threading
+
+import cssutils
+from bs4 import BeautifulSoup
+from pynliner import Pynliner
+from pynliner.soupselect import select
+
+_compiled_lock = threading.Lock()
+_compiled_stylesheets = {}
+_template_versions = {}
+
+
+class CompiledStylesheet(object):
+    """Reglas de estilo ya parseadas de una hoja CSS."""
+
+    def __init__(self, style_string):
+        cssparser = cssutils.CSSParser()
+        stylesheet = cssparser.parseString(style_string)
+        # (selector, especificidad, índice de la regla) en el orden de la hoja
+        self.selectors = []
+        # Propiedades (nombre, valor) de cada regla de estilo
+        self.rule_props = []
+        for rule in stylesheet.cssRules.rulesOfType(cssutils.css.CSSRule.STYLE_RULE):
+            rule_index = len(self.rule_props)
+            self.rule_props.append([(prop.name, prop.value) for prop in rule.style.getProperties()])
+            for selector in rule.selectorList:
+                self.selectors.append((selector.selectorText, selector.specificity, rule_index))
+        media_rules = list(stylesheet.cssRules.rulesOfType(cssutils.css.CSSRule.MEDIA_RULE))
+        # Bloque <style> con las reglas @media que Pynliner reinserta en el <body>
+        self.media_markup = None
+        if media_rules:
+            self.media_markup = "<style>" + "\n".join(re.sub(r'\s+', ' ', x.cssText) for x in media_rules) + "</style>"
+        # cssText ya serializado por combinación de reglas aplicadas
+        self._declarations = {}
+        self._declarations_lock = threading.Lock()
+
+    def declaration_text(self, rule_indexes):
+        """Devuelve el atributo style resultante de aplicar las reglas en orden."""
+        key = tuple(rule_indexes)
+        text = self._declarations.get(key)
+        if text is None:
+            declaration = cssutils.css.CSSStyleDeclaration()
+            for rule_index in key:
+                for name, value in self.rule_props[rule_index]:
+                    declaration.removeProperty(name)
+                    declaration.setProperty(name, value)
+            text = declaration.cssText.replace('\n', ' ')
+            with self._declarations_lock:
+                self._declarations[key] = text
+        return text
+
+
+def get_compiled_stylesheet(style_string):
+    """Compila (o recupera de la caché) la hoja de estilos para `style_string`."""
+    key = hashlib.sha1(style_string.encode('utf-8')).hexdigest()
+    compiled = _compiled_stylesheets.get(key)
+    if compiled is None:
+        compiled = CompiledStylesheet(style_string)
+        with _compiled_lock:
+            compiled = _compiled_stylesheets.setdefault(key, compiled)
+    return compiled
+
+
+def template_version(path):
+    """
+    Identificador de la versión de un fichero de plantilla.
+    Se recalcula el hash del contenido solo cuando cambia su mtime.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _template_versions.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        version = hashlib.sha1(f.read()).hexdigest()
+    _template_versions[path] = (mtime, version)
+    return version
+
+
+class CompiledPynliner(Pynliner):
+    """
+    Pynliner que obtiene la hoja de estilos de la caché de compilación y
+    aplica las reglas con una única resolución de especificidad por elemento.
+    """
+
+    def _get_styles(self):
+        self._get_external_styles()
+        self._get_internal_styles()
+        for style_string in self.extra_style_strings:
+            self.style_string += style_string
+        self.stylesheet = get_compiled_stylesheet(self.style_string)
+
+    def _apply_styles(self):
+        stylesheet = self.stylesheet
+        # Se indexa por id() en lugar de por el Tag: el __hash__ de bs4
+        # serializa el elemento completo en cada consulta.
+        elements = {}
+        matches = {}
+        for selector_text, specificity, rule_index in stylesheet.selectors:
+            for element in select(self.soup, selector_text):
+                element_id = id(element)
+                if element_id not in matches:
+                    elements[element_id] = element
+                    matches[element_id] = []
+                matches[element_id].append((specificity, rule_index))
+
+        for element_id, element_matches in matches.items():
+            element = elements[element_id]
+            element_matches.sort(key=lambda match: match[0])
+            style = stylesheet.declaration_text(match[1] for match in element_matches)
+            if element.has_attr('style'):
+                element['style'] = u'%s; %s' % (style, element['style'])
+            else:
+                element['style'] = style
+
+    def _insert_media_rules(self):
+        if self.stylesheet.media_markup:
+            style = BeautifulSoup(self.stylesheet.media_markup, "html.parser")
+            target = self.soup.body or self.soup
+            target.insert(0, style)
+
+
+class FragmentPynliner(CompiledPynliner):
+    """
+    CompiledPynliner para un trozo del <body> de una página ya inlineada: usa
+    la hoja compilada de esa página y no añade el bloque de reglas @media, que
+    ya está en la página.
+    """
+
+    def __init__(self, stylesheet):
+        super(FragmentPynliner, self).__init__()
+        self.stylesheet = stylesheet
+
+    def _insert_media_rules(self):
+        pass
+
+
+def inline_styles(html):
+    """Equivalente a `Pynliner().from_string(html).run()` con la hoja precompilada."""
+    return CompiledPynliner().from_string(html).run()
+
+
+def inline_document(html):
+    """Como inline_styles(), pero devuelve también la hoja compilada de la página."""
+    inliner = CompiledPynliner().from_string(html)
+    return inliner.run(), inliner.stylesheet
+
+
+def inline_fragment(html, stylesheet):
+    """Inlinea un trozo del <body> con la hoja `stylesheet` de inline_document()."""
+    return FragmentPynliner(stylesheet).from_string(html).run()
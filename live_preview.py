@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Vista previa de la newsletter que solo vuelve a inlinear lo que ha cambiado.
+
+template.html marca con `{% block %}` sus fragmentos: cabecera, imagen
+principal, introducción, cada sección del bucle, vídeo y pie. Para cada vista
+previa se renderiza la plantilla con Jinja (rápido) sustituyendo cada bloque
+por un marcador y guardando aparte el HTML del bloque. Lo caro es el inlineado
+de estilos, y ese se hace por separado:
+
+- el esqueleto (head, <style> y tablas exteriores, con los marcadores), que
+  solo cambia con el título o la tipografía;
+- cada fragmento, con la hoja ya compilada del esqueleto.
+
+Ambos se guardan en LRUs con el hash del HTML de Jinja como clave (los
+fragmentos, junto con la hoja), así que al escribir en una sección de una
+newsletter de 30 solo se inlinea esa sección y el resto se reutiliza. El
+resultado es el mismo que el de
+render_newsletter_uncached() siempre que las reglas de la hoja no dependan de
+elementos fuera del fragmento (en template.html son todas de una sola clase) y
+el HTML de los campos esté bien cerrado.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+MARKER = '<!--live-preview-fragment-->'
+
+
+def _digest(html):
+    return hashlib.sha1(html.encode('utf-8')).digest()
+
+
+class LivePreview(object):
+    """Fragmentos y esqueletos ya inlineados (LRU por número de entradas)."""
+
+    def __init__(self, max_fragments=4096, max_skeletons=64):
+        self.max_fragments = max_fragments
+        self.max_skeletons = max_skeletons
+        self._fragments = OrderedDict()  # (hoja, hash del HTML de Jinja) -> HTML inlineado
+        self._skeletons = OrderedDict()  # hash del esqueleto -> (trozos entre marcadores, hoja compilada)
+        self._lock = threading.Lock()
+        self.previews = 0
+        self.fragments_inlined = 0
+        self.fragments_reused = 0
+        self.skeletons_inlined = 0
+
+    def _split(self, template, context):
+        """Esqueleto con un marcador por bloque y el HTML de cada bloque, en orden."""
+        jinja_context = template.new_context(context)
+        fragments = []
+
+        def slot(render_block):
+            def render(block_context):
+                fragments.append(''.join(render_block(block_context)))
+                yield MARKER
+            return render
+
+        for name, render_block in template.blocks.items():
+            jinja_context.blocks[name] = [slot(render_block)]
+        return ''.join(template.root_render_func(jinja_context)), fragments
+
+    def _cached(self, entries, key):
+        with self._lock:
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+            return value
+
+    def _store(self, entries, key, value, max_entries):
+        with self._lock:
+            entries[key] = value
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def render(self, template, context):
+        """HTML inlineado de la newsletter y cuántos fragmentos hubo que inlinear."""
+        from inliner import inline_document, inline_fragment
+
+        skeleton, fragments = self._split(template, context)
+        key = _digest(skeleton)
+        cached = self._cached(self._skeletons, key)
+        if cached is None:
+            html, stylesheet = inline_document(skeleton)
+            cached = (html.split(MARKER), stylesheet)
+            self._store(self._skeletons, key, cached, self.max_skeletons)
+            with self._lock:
+                self.skeletons_inlined += 1
+        parts, stylesheet = cached
+
+        inlined = 0
+        output = [parts[0]]
+        for fragment, part in zip(fragments, parts[1:]):
+            # La hoja compilada se conserva mientras viva el proceso (ver inliner.py)
+            key = (id(stylesheet), _digest(fragment))
+            html = self._cached(self._fragments, key)
+            if html is None:
+                html = inline_fragment(fragment, stylesheet)
+                self._store(self._fragments, key, html, self.max_fragments)
+                inlined += 1
+            output.append(html)
+            output.append(part)
+        with self._lock:
+            self.previews += 1
+            self.fragments_inlined += inlined
+            self.fragments_reused += len(fragments) - inlined
+        return ''.join(output), inlined
+
+    def stats(self):
+        with self._lock:
+            return {
+                'previews': self.previews,
+                'fragments_inlined': self.fragments_inlined,
+                'fragments_reused': self.fragments_reused,
+                'skeletons_inlined': self.skeletons_inlined,
+                'fragments': len(self._fragments),
+                'skeletons': len(self._skeletons),
+            }
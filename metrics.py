@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas de la aplicación en formato de texto de Prometheus (ruta /metrics).
+
+Se registran:
+- la latencia de cada ruta (histograma por ruta, método y código de estado),
+- cada llamada a la API de Drive/YouTube (execute() y los trozos de las
+  subidas resumables) por método, p. ej. files.list o permissions.create,
+  con su duración, su resultado y los bytes subidos,
+- el tiempo de renderizado y de inlineado de la newsletter,
+- los contadores de las cachés y pools (los mismos que las rutas *_stats).
+
+Las métricas son de cada proceso: con varios workers de gunicorn cada uno
+publica las suyas. Con METRICS=0 no se crea nada de esto y ninguna petición
+ni llamada a Google pasa por aquí. Como las rutas *_stats, /metrics solo
+responde con STATS_TOKEN definido (Prometheus lo envía con `bearer_token`).
+"""
+import bisect
+import threading
+import time
+
+# Los mismos intervalos (segundos) que usan por defecto los clientes de Prometheus
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request_class = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """Contadores e histogramas con etiquetas, protegidos por un único lock."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._descriptions = {}  # nombre -> (tipo, ayuda)
+        self._counters = {}  # (nombre, etiquetas) -> valor
+        self._histograms = {}  # (nombre, etiquetas) -> [cuenta por intervalo..., suma, total]
+        self._collectors = []  # (prefijo, función que devuelve un dict de valores)
+
+    def describe(self, name, kind, help_text):
+        self._descriptions[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 3)
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def add_collector(self, prefix, stats):
+        """Publica los valores numéricos de `stats()` como `<prefijo>_<clave>`."""
+        self._collectors.append((prefix, stats))
+
+    def render(self):
+        """Todas las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def header(name, default_kind):
+            if name in described:
+                return
+            described.add(name)
+            kind, help_text = self._descriptions.get(name, (default_kind, ''))
+            if help_text:
+                lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append('{}{} {}'.format(name, _labels_text(labels), _number(value)))
+        for (name, labels), values in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _labels_text(labels, ('le', _number(bound))), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _labels_text(labels), _number(values[-2])))
+            lines.append('{}_count{} {}'.format(name, _labels_text(labels), values[-1]))
+        for prefix, stats in self._collectors:
+            for key, value in sorted(stats().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = '{}_{}'.format(prefix, key)
+                    header(name, 'untyped')
+                    lines.append('{} {}'.format(name, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+    def instrument_app(self, app):
+        """Mide la latencia de todas las rutas de la aplicación Flask."""
+        from flask import g, request
+
+        self.describe('http_request_duration_seconds', 'histogram', 'Latencia de las rutas de la aplicación.')
+
+        @app.before_request
+        def start_timer():
+            g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            start = g.pop('metrics_start', None)
+            if start is not None:
+                self.observe('http_request_duration_seconds', time.perf_counter() - start,
+                             route=request.url_rule.rule if request.url_rule else 'unmatched',
+                             method=request.method, status=response.status_code)
+            return response
+
+    def request_builder(self):
+        """Clase HttpRequest para build(requestBuilder=...) que mide cada llamada a Google."""
+        global _request_class
+        if _request_class is None:
+            _request_class = _instrumented_request_class()
+        self.describe('google_api_call_duration_seconds', 'histogram',
+                      'Duración de las llamadas a las APIs de Google por método y resultado.')
+        self.describe('google_api_upload_bytes_total', 'counter', 'Bytes subidos a las APIs de Google.')
+        _request_class.metrics = self
+        return _request_class
+
+    def record_api_call(self, method_id, seconds, outcome):
+        api, _, method = (method_id or 'unknown.unknown').partition('.')
+        self.observe('google_api_call_duration_seconds', seconds, api=api, method=method, outcome=outcome)
+
+
+def _outcome(exception):
+    resp = getattr(exception, 'resp', None)
+    return str(resp.status) if resp is not None and getattr(resp, 'status', None) else 'error'
+
+
+def _instrumented_request_class():
+    # googleapiclient.http solo se importa si las métricas están activas
+    from googleapiclient.http import HttpRequest
+
+    class InstrumentedHttpRequest(HttpRequest):
+        metrics = None
+
+        def execute(self, http=None, num_retries=0):
+            # execute() de una subida resumable llama a next_chunk(): se mide solo aquí
+            self._metrics_in_execute = True
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                return super(InstrumentedHttpRequest, self).execute(http=http, num_retries=num_retries)
+            except Exception as e:
+                outcome = _outcome(e)
+                raise
+            finally:
+                self._metrics_in_execute = False
+                self.metrics.record_api_call(self.methodId, time.perf_counter() - start, outcome)
+
+        def next_chunk(self, http=None, num_retries=0):
+            # Al reanudar, next_chunk() pregunta primero a Google cuánto recibió y el
+            # progreso salta hasta ahí: ese trozo no se cuenta para no contar de más
+            sent_before = None if self._in_error_state else self.resumable_progress
+            timed = not getattr(self, '_metrics_in_execute', False)
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                status, body = super(InstrumentedHttpRequest, self).next_chunk(http=http, num_retries=num_retries)
+            except Exception as e:
+                outcome = _outcome(e)
+                raise
+            finally:
+                if timed:
+                    self.metrics.record_api_call(self.methodId, time.perf_counter() - start, outcome)
+            if sent_before is None:
+                return status, body
+            sent = (self.resumable.size() if body is not None else self.resumable_progress) - sent_before
+            if sent > 0:
+                api, _, method = (self.methodId or 'unknown.unknown').partition('.')
+                self.metrics.inc('google_api_upload_bytes_total', sent, api=api, method=method)
+            return status, body
+
+    return InstrumentedHttpRequest
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Directorios y ficheros de datos que solo puede leer el usuario del proceso.
+
+Las sesiones, los trabajos de subida y las cachés en disco guardan por defecto
+sus datos en rutas fijas de /tmp. Otro usuario de la máquina puede crear antes
+ese directorio (y dejar dentro ficheros que la aplicación leería) o leer lo que
+se escribe en él si queda con los permisos del umask: aquí se crean con modo
+0700 (directorios) y 0600 (ficheros), y se rechaza un directorio ajeno.
+"""
+import os
+import stat
+
+
+def private_directory(path):
+    """
+    Crea `path` con modo 0700 si no existe y devuelve la ruta. Si ya existe debe
+    ser un directorio (no un enlace) del usuario del proceso; si otros tenían
+    acceso se le quitan los permisos. Si no, RuntimeError.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise RuntimeError('{} is not a directory owned by the current user'.format(path))
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def private_file(path):
+    """Crea `path` vacío con modo 0600 si no existe (p. ej. antes de que SQLite lo abra) o le deja ese modo."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+    return path
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de newsletters ya renderizadas e inlineadas.
+
+La clave es un hash canónico del `context` que construye index() junto con la
+versión de template.html, así que dos envíos idénticos del formulario devuelven
+el mismo HTML sin volver a renderizar. La caché en memoria es un LRU acotado
+en bytes y con TTL; opcionalmente se apoya en un directorio compartido para que
+todos los workers de gunicorn aprovechen los resultados de los demás.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from private_files import private_directory
+
+
+def context_key(context, template_version):
+    """Hash canónico (independiente del orden de las claves) del contexto."""
+    canonical = json.dumps(context, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    digest = hashlib.sha256()
+    digest.update(template_version.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(canonical.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class DiskBackend(object):
+    """Almacén en disco compartido entre procesos (un fichero por clave)."""
+
+    def __init__(self, directory, ttl, max_bytes, prune_every=50):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.prune_every = prune_every
+        self._writes = 0
+        private_directory(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.html')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return f.read().decode('utf-8')
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        # Escritura atómica: otro worker nunca ve un fichero a medio escribir
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value.encode('utf-8'))
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """Elimina entradas caducadas y las más antiguas si se supera max_bytes."""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.html'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.ttl:
+                    os.remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class RenderCache(object):
+    """LRU en memoria acotado por bytes y TTL, con contadores de uso."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=3600, disk_backend=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_backend = disk_backend
+        self._entries = OrderedDict()  # clave -> (caducidad, tamaño, html)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._remove(key)
+        if self.disk_backend is not None:
+            value = self.disk_backend.get(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, value, now)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value, time.time())
+        if self.disk_backend is not None:
+            self.disk_backend.set(key, value)
+
+    def _store(self, key, value, now):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (now + self.ttl, size, value)
+        self._size += size
+        while self._size > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
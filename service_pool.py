@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de servicios de la API de Google ya construidos.
+
+Construir un servicio con `googleapiclient.discovery.build` (documento de
+descubrimiento, clases de recursos y transporte HTTP autorizado) cuesta decenas
+de milisegundos. El pool guarda los servicios por credenciales y los reutiliza,
+junto con su transporte, en las siguientes peticiones del mismo usuario.
+
+httplib2 no es seguro entre hilos, así que cada servicio se presta a una sola
+petición a la vez: `get()` lo saca del pool y `release()` lo devuelve al
+terminar. Así funciona igual con hilos (gthread) que con greenlets (gevent) y
+solo hay tantas instancias por usuario como peticiones simultáneas suyas.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Campo de las credenciales de la sesión con el ID de la cuenta de Google; no es
+# un argumento de google.oauth2.credentials.Credentials
+ACCOUNT_ID_FIELD = 'account_id'
+
+
+def _identity(credentials_info, fields):
+    digest = hashlib.sha256()
+    for field in fields:
+        digest.update((credentials_info.get(field) or '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def credentials_identity(credentials_info):
+    """Identificador estable de unas credenciales guardadas en la sesión."""
+    return _identity(credentials_info, ('client_id', 'refresh_token', 'token'))
+
+
+def account_identity(credentials_info):
+    """
+    Identificador de la cuenta de Google, el mismo en todas sus sesiones y
+    navegadores: el ID guardado al iniciar sesión (ACCOUNT_ID_FIELD). Las
+    sesiones anteriores no lo tienen: se usa el refresh token, sin el token de
+    acceso, que comparten al menos las sesiones de una misma autorización.
+    """
+    if credentials_info.get(ACCOUNT_ID_FIELD):
+        return _identity(credentials_info, ('client_id', ACCOUNT_ID_FIELD))
+    if credentials_info.get('refresh_token'):
+        return _identity(credentials_info, ('client_id', 'refresh_token'))
+    return credentials_identity(credentials_info)
+
+
+class ServicePool(object):
+    """LRU de servicios libres, indexado por (API, versión, credenciales)."""
+
+    def __init__(self, factory, max_size=128):
+        self.factory = factory
+        self.max_size = max_size
+        self._idle = OrderedDict()  # (API, versión, credenciales) -> [servicios libres]
+        self._idle_count = 0
+        self._leased = {}  # id(servicio) -> (clave, generación de las credenciales)
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+        self.evictions = 0
+        self.build_seconds = 0.0
+        self.hit_seconds = 0.0
+
+    def get(self, service_name, version, credentials_info):
+        """Presta un servicio; hay que devolverlo con release() al terminar."""
+        start = time.perf_counter()
+        key = (service_name, version, credentials_identity(credentials_info))
+        with self._lock:
+            services = self._idle.get(key)
+            if services:
+                service = services.pop()
+                self._idle_count -= 1
+                if not services:
+                    del self._idle[key]
+                self._leased[id(service)] = (key, self._generations.get(key[2], 0))
+                self.hits += 1
+                self.hit_seconds += time.perf_counter() - start
+                return service
+            generation = self._generations.get(key[2], 0)
+
+        service = self.factory(service_name, version, credentials_info)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.builds += 1
+            self.build_seconds += elapsed
+            self._leased[id(service)] = (key, generation)
+        return service
+
+    def release(self, service):
+        """Devuelve al pool un servicio prestado por get()."""
+        with self._lock:
+            entry = self._leased.pop(id(service), None)
+            if entry is None:
+                return
+            key, generation = entry
+            # Credenciales descartadas mientras estaba prestado: no se reutiliza
+            if generation != self._generations.get(key[2], 0):
+                return
+            self._idle.setdefault(key, []).append(service)
+            self._idle.move_to_end(key)
+            self._idle_count += 1
+            while self._idle_count > self.max_size:
+                oldest_key, services = next(iter(self._idle.items()))
+                services.pop(0)
+                if not services:
+                    del self._idle[oldest_key]
+                self._idle_count -= 1
+                self.evictions += 1
+
+    def discard(self, credentials_info):
+        """Elimina todos los servicios de unas credenciales (logout o revocación)."""
+        identity = credentials_identity(credentials_info)
+        with self._lock:
+            self._generations[identity] = self._generations.get(identity, 0) + 1
+            for key in [key for key in self._idle if key[2] == identity]:
+                self._idle_count -= len(self._idle.pop(key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._idle_count,
+                'leased': len(self._leased),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'builds': self.builds,
+                'evictions': self.evictions,
+                'avg_build_ms': 1000.0 * self.build_seconds / self.builds if self.builds else 0.0,
+                'avg_hit_ms': 1000.0 * self.hit_seconds / self.hits if self.hits else 0.0,
+            }
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Sesiones guardadas en el servidor (SQLite o ficheros) con solo un ID en la cookie.
+
+La sesión por defecto de Flask viaja entera en una cookie firmada: con el
+`form_data` de una newsletter grande se envían y verifican varios KB en cada
+petición y se puede superar el límite de 4 KB de los navegadores. Aquí la
+cookie lleva únicamente un ID aleatorio firmado y los datos se guardan
+serializados en JSON compacto (comprimido con zlib si son grandes).
+
+Los datos incluyen las credenciales OAuth (con el refresh token): la base de
+datos y los ficheros se crean con modo 0600 en un directorio 0700 (ver
+private_files.py). Las sesiones son locales a la máquina: en un despliegue con
+varias máquinas o con el disco efímero (Heroku) cada reinicio cierra todas las
+sesiones, por eso la aplicación usa por defecto la cookie firmada de Flask.
+"""
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+
+from private_files import private_directory, private_file
+
+COMPRESS_THRESHOLD = 512
+
+
+def dumps_session(data):
+    payload = TaggedJSONSerializer().dumps(data).encode('utf-8')
+    if len(payload) > COMPRESS_THRESHOLD:
+        return b'z' + zlib.compress(payload)
+    return b'j' + payload
+
+
+def loads_session(blob):
+    blob = bytes(blob)
+    payload = zlib.decompress(blob[1:]) if blob[:1] == b'z' else blob[1:]
+    return TaggedJSONSerializer().loads(payload.decode('utf-8'))
+
+
+class SQLiteSessionStore(object):
+    """Sesiones en una base de datos SQLite compartida por todos los workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        private_directory(os.path.dirname(os.path.abspath(path)))
+        private_file(path)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # Una conexión abierta antes del fork (preload_app) no se comparte con el worker
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def load(self, sid):
+        row = self._connection().execute(
+            'SELECT data FROM sessions WHERE id = ? AND expires > ?', (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid, blob, expires):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)', (sid, blob, expires))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def sweep(self):
+        self._connection().execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),))
+
+
+class FileSessionStore(object):
+    """Un fichero por sesión; la caducidad se guarda en su mtime."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        private_directory(directory)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def load(self, sid):
+        path = self._path(sid)
+        try:
+            if os.path.getmtime(path) <= time.time():
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save(self, sid, blob, expires):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(blob)
+        os.utime(temp_path, (expires, expires))
+        os.replace(temp_path, self._path(sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def sweep(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) <= now:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super(ServerSideSession, self).__init__(initial)
+        self.sid = sid
+        self.new = sid is None
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """SessionInterface de Flask que guarda los datos en `store`."""
+
+    def __init__(self, store, sweep_interval=600):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie or not app.secret_key:
+            return ServerSideSession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode('ascii')
+        except BadSignature:
+            return ServerSideSession()
+        blob = self.store.load(sid)
+        if blob is None:
+            return ServerSideSession()
+        try:
+            return ServerSideSession(loads_session(blob), sid=sid)
+        except (ValueError, TypeError, KeyError, zlib.error):
+            # Datos dañados o de otra versión: sesión nueva
+            return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add('Cookie')
+            return
+
+        if session.modified:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(24)
+            self.store.save(session.sid, dumps_session(dict(session)),
+                            time.time() + app.permanent_session_lifetime.total_seconds())
+            self._maybe_sweep()
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode('ascii'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+            response.vary.add('Cookie')
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            self.store.sweep()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Caché en disco de las plantillas guardadas en Drive (el JSON que descarga
+load_template()).
+
+Cada entrada es el contenido de un fichero para una cuenta, junto con el
+`md5Checksum` y la `version` de Drive con los que se descargó. Al abrir una
+plantilla:
+
+- si la entrada se comprobó hace menos de `ttl` segundos se usa sin más;
+- si no, se piden solo sus metadatos (files.get con fields=md5Checksum,version)
+  y, si no ha cambiado, se sigue usando la copia local;
+- solo si ha cambiado (o no está) se descarga el contenido.
+
+El listado de list_templates() ya trae el `md5Checksum` de cada plantilla, así
+que sirve para revalidar todas las entradas de golpe y para precargar en
+segundo plano las usadas más recientemente que aún no estén en disco.
+save_template() guarda en la caché lo que acaba de subir.
+
+Las entradas se guardan en un directorio compartido por los workers de
+gunicorn (un fichero por cuenta y plantilla, escrito de forma atómica); la
+fecha de modificación del fichero es la de la última comprobación.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from private_files import private_directory
+
+
+class TemplateCache(object):
+    """Contenido de las plantillas por (cuenta, ID de fichero), acotado en bytes."""
+
+    def __init__(self, directory, ttl=60, max_bytes=64 * 1024 * 1024, prefetch=3, prefetch_workers=2,
+                 prune_every=50):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.prefetch_limit = prefetch
+        self.prefetch_workers = prefetch_workers
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._pending = set()  # rutas con una precarga en curso
+        self._executor = None
+        self._executor_pid = None
+        self.fresh_hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.prefetched = 0
+        self.stores = 0
+        private_directory(directory)
+
+    def _path(self, account, file_id):
+        key = hashlib.sha256('{}\0{}'.format(account, file_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.template')
+
+    def _read(self, path):
+        """(metadatos, contenido, segundos desde la última comprobación) o None."""
+        try:
+            with open(path, 'rb') as f:
+                age = time.time() - os.fstat(f.fileno()).st_mtime
+                meta = json.loads(f.readline())
+                return meta, f.read(), age
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data, version=None):
+        # Primera línea: metadatos en JSON; el resto, el contenido tal cual se descargó
+        header = json.dumps({'md5Checksum': hashlib.md5(data).hexdigest(), 'version': version})
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header.encode('utf-8') + b'\n')
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _unchanged(meta, current):
+        if current.get('md5Checksum'):
+            return current['md5Checksum'] == meta.get('md5Checksum')
+        return current.get('version') is not None and current.get('version') == meta.get('version')
+
+    def load(self, drive_service, account, file_id):
+        """Contenido de la plantilla: de disco si sigue igual en Drive, si no descargado."""
+        path = self._path(account, file_id)
+        entry = self._read(path)
+        current = {}
+        if entry is not None:
+            meta, data, age = entry
+            if age < self.ttl:
+                with self._lock:
+                    self.fresh_hits += 1
+                return data
+            current = drive_service.files().get(fileId=file_id, fields='md5Checksum, version').execute()
+            if self._unchanged(meta, current):
+                os.utime(path)
+                with self._lock:
+                    self.revalidated += 1
+                return data
+        data = drive_service.files().get_media(fileId=file_id).execute()
+        with self._lock:
+            self.downloads += 1
+        self._write(path, data, current.get('version'))
+        return data
+
+    def store(self, account, file_id, data):
+        """Guarda lo que se acaba de subir a Drive, que ya es la versión actual."""
+        self._write(self._path(account, file_id), data)
+        with self._lock:
+            self.stores += 1
+
+    def invalidate(self, account, file_id):
+        self._remove(self._path(account, file_id))
+
+    def revalidate_listing(self, account, files):
+        """
+        Revalida las entradas con el md5Checksum de un listado de la carpeta de
+        plantillas y devuelve las plantillas del listado que no están en disco.
+        """
+        missing = []
+        for file in files:
+            path = self._path(account, file['id'])
+            entry = self._read(path)
+            if entry is None:
+                missing.append(file)
+            elif self._unchanged(entry[0], file):
+                os.utime(path)
+            else:
+                self._remove(path)
+                missing.append(file)
+        return missing
+
+    def _pool(self):
+        # Se crea en el primer uso, ya dentro del worker de gunicorn
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix='template-prefetch')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def prefetch(self, account, files, open_service, release_service):
+        """
+        Descarga en segundo plano las `prefetch` plantillas de `files` usadas más
+        recientemente (viewedByMeTime, o modifiedTime). Los hilos no usan el
+        servicio de la petición: cada uno toma el suyo con `open_service()`.
+        """
+        if not self.prefetch_limit:
+            return 0
+        recent = sorted(files, key=lambda f: f.get('viewedByMeTime') or f.get('modifiedTime') or '', reverse=True)
+        submitted = 0
+        for file in recent[:self.prefetch_limit]:
+            path = self._path(account, file['id'])
+            with self._lock:
+                if path in self._pending:
+                    continue
+                self._pending.add(path)
+            self._pool().submit(self._prefetch_one, path, file, open_service, release_service)
+            submitted += 1
+        return submitted
+
+    def _prefetch_one(self, path, file, open_service, release_service):
+        drive_service = None
+        try:
+            drive_service = open_service()
+            data = drive_service.files().get_media(fileId=file['id']).execute()
+            self._write(path, data, file.get('version'))
+            with self._lock:
+                self.prefetched += 1
+        except Exception as e:
+            print("Error prefetching template {}: {}".format(file['id'], e))
+        finally:
+            if drive_service is not None:
+                release_service(drive_service)
+            with self._lock:
+                self._pending.discard(path)
+
+    def prune(self):
+        """Elimina las entradas comprobadas hace más tiempo si se supera max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.template'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'fresh_hits': self.fresh_hits,
+                'revalidated': self.revalidated,
+                'downloads': self.downloads,
+                'prefetched': self.prefetched,
+                'stores': self.stores,
+                'prefetching': len(self._pending),
+            }
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Serialización de las plantillas guardadas en Drive (`session['form_data']`).
+
+Se guardan en JSON compacto con las claves ordenadas, de modo que el mismo
+formulario produce siempre los mismos bytes y su MD5 coincide con el
+`md5Checksum` que Drive calcula del fichero: si coinciden, la plantilla ya
+está guardada y no hace falta subir nada. Las plantillas grandes se guardan
+comprimidas con gzip (sin fecha en la cabecera, para que el MD5 sea estable);
+`loads_template` lee tanto estas como las antiguas con `indent=4`.
+"""
+import gzip
+import hashlib
+import json
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def dumps_template(form_data, gzip_threshold=64 * 1024):
+    """Devuelve (bytes, MD5 en hexadecimal, comprimida)."""
+    payload = json.dumps(form_data, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode('utf-8')
+    compressed = gzip_threshold is not None and len(payload) > gzip_threshold
+    if compressed:
+        payload = gzip.compress(payload, compresslevel=6, mtime=0)
+    return payload, hashlib.md5(payload).hexdigest(), compressed
+
+
+def loads_template(content):
+    if content[:2] == GZIP_MAGIC:
+        content = gzip.decompress(content)
+    return json.loads(content.decode('utf-8'))
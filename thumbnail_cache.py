@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Proxy de miniaturas de Drive con caché en disco.
+
+La página de gestión de imágenes ya no carga cada imagen a tamaño completo
+desde lh3.googleusercontent.com: muestra la miniatura que genera Drive
+(`thumbnailLink`, con el tamaño cambiado a `=s<tamaño>`), servida por la
+aplicación desde este módulo:
+
+- el enlace de cada imagen se recuerda al listar la carpeta (caduca a las
+  pocas horas; si falla o no se conoce se pide de nuevo con files.get);
+- la miniatura se descarga como una petición más del servicio de Drive (con
+  su transporte autorizado, api_executor y las métricas) y se guarda en disco, una entrada por cuenta, imagen, tamaño y
+  `md5Checksum`, así que un cambio en la imagen es otra entrada;
+- al mostrar la primera página de una carpeta se descargan en segundo plano
+  las `prefetch` primeras miniaturas, mientras el navegador recibe el HTML; si
+  pide una que aún se está descargando, espera a esa descarga;
+- las entradas se escriben de forma atómica en un directorio privado (0700,
+  del usuario del proceso) compartido por los workers de gunicorn, y la fecha
+  de modificación del fichero es la del último uso: al superar `max_bytes` se
+  eliminan las menos usadas (LRU).
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+from private_files import private_directory
+
+_SIZE_SUFFIX = re.compile(r'=s\d+$')
+
+
+def _response_and_content(response, content):
+    return response, content
+
+
+class ThumbnailCache(object):
+    """Miniaturas por (cuenta, ID de fichero, tamaño, md5Checksum), acotadas en bytes."""
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_links=20000, prefetch=24, prefetch_workers=6,
+                 prune_every=200):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_links = max_links
+        self.prefetch_limit = prefetch
+        self.prefetch_workers = prefetch_workers
+        self.prune_every = prune_every
+        self._links = OrderedDict()  # (cuenta, ID de fichero) -> thumbnailLink
+        self._pending = {}  # ruta -> Future de la precarga en curso
+        self._executor = None
+        self._executor_pid = None
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.downloads = 0
+        self.prefetched = 0
+        self.link_lookups = 0
+        private_directory(directory)
+
+    def _path(self, account, file_id, size, version):
+        key = hashlib.sha256('{}\0{}\0{}\0{}'.format(account, file_id, size, version or '').encode('utf-8'))
+        return os.path.join(self.directory, key.hexdigest() + '.thumbnail')
+
+    def remember_links(self, account, files):
+        """Guarda el thumbnailLink de los ficheros de un listado."""
+        with self._lock:
+            for file in files:
+                if file.get('thumbnailLink'):
+                    key = (account, file['id'])
+                    self._links[key] = file['thumbnailLink']
+                    self._links.move_to_end(key)
+            while len(self._links) > self.max_links:
+                self._links.popitem(last=False)
+
+    def _link(self, drive_service, account, file_id, refresh=False):
+        if not refresh:
+            with self._lock:
+                link = self._links.get((account, file_id))
+            if link:
+                return link
+        file = drive_service.files().get(fileId=file_id, fields='id, thumbnailLink').execute()
+        with self._lock:
+            self.link_lookups += 1
+        self.remember_links(account, [file])
+        return file.get('thumbnailLink')
+
+    def _download(self, drive_service, account, file_id, size):
+        """(contenido, tipo MIME) de la miniatura, o None si Drive no tiene miniatura."""
+        for refresh in (False, True):
+            link = self._link(drive_service, account, file_id, refresh=refresh)
+            if not link:
+                return None
+            # Una petición del servicio con la URL de la miniatura: lleva el token de la cuenta (y
+            # lo renueva si caduca) y se reintenta y se mide como las demás llamadas a Google
+            request = drive_service.files().get_media(fileId=file_id)
+            request.uri = _SIZE_SUFFIX.sub('', link) + '=s{}'.format(size)
+            request.methodId = 'drive.thumbnails.get'
+            request.postproc = _response_and_content
+            try:
+                response, content = request.execute()
+                return content, response.get('content-type', 'image/jpeg')
+            except HttpError as e:
+                # Un enlace recordado puede haber caducado: se vuelve a pedir una vez
+                if e.resp.status not in (403, 404):
+                    raise
+                status = e.resp.status
+        print("Error downloading thumbnail {}: HTTP {}".format(file_id, status))
+        return None
+
+    def get(self, drive_service, account, file_id, size, version=None):
+        """(contenido, tipo MIME) de la miniatura: de disco si está, si no descargada de Drive."""
+        path = self._path(account, file_id, size, version)
+        with self._lock:
+            pending = self._pending.get(path)
+        if pending is not None:
+            pending.result()  # si la precarga falla, se descarga aquí
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                data = f.read()
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return data, meta['mimeType']
+        except (OSError, ValueError, KeyError):
+            pass
+        thumbnail = self._download(drive_service, account, file_id, size)
+        if thumbnail is None:
+            return None
+        with self._lock:
+            self.downloads += 1
+        self._write(path, *thumbnail)
+        return thumbnail
+
+    def _pool(self):
+        # Se crea en el primer uso, ya dentro del worker de gunicorn
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers,
+                                                thread_name_prefix='thumbnail-prefetch')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def prefetch(self, account, files, size, open_service, release_service):
+        """
+        Descarga en segundo plano las miniaturas de las `prefetch` primeras
+        imágenes de `files` que no estén en disco. Los hilos no usan el servicio
+        de la petición: cada uno toma el suyo con `open_service()`.
+        """
+        submitted = 0
+        for file in files[:self.prefetch_limit]:
+            path = self._path(account, file['id'], size, file.get('md5Checksum'))
+            if os.path.exists(path):
+                continue
+            with self._lock:
+                if path in self._pending:
+                    continue
+                self._pending[path] = self._pool().submit(
+                    self._prefetch_one, path, account, file['id'], size, open_service, release_service)
+            submitted += 1
+        return submitted
+
+    def _prefetch_one(self, path, account, file_id, size, open_service, release_service):
+        drive_service = None
+        try:
+            drive_service = open_service()
+            thumbnail = self._download(drive_service, account, file_id, size)
+            if thumbnail is not None:
+                self._write(path, *thumbnail)
+                with self._lock:
+                    self.prefetched += 1
+        except Exception as e:
+            print("Error prefetching thumbnail {}: {}".format(file_id, e))
+        finally:
+            if drive_service is not None:
+                release_service(drive_service)
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def _write(self, path, data, mime_type):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps({'mimeType': mime_type}).encode('utf-8') + b'\n')
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Elimina las miniaturas usadas hace más tiempo si se supera max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.thumbnail'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'downloads': self.downloads,
+                'prefetched': self.prefetched,
+                'link_lookups': self.link_lookups,
+                'links': len(self._links),
+                'prefetching': len(self._pending),
+            }
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Cola local de subidas en segundo plano (vídeos de YouTube).
+
+upload_video() ya no mantiene abierta la petición HTTP durante toda la subida:
+guarda el fichero en disco, crea un trabajo en SQLite y responde enseguida con
+su ID. Unos pocos hilos por proceso (el máximo de subidas simultáneas) suben
+los ficheros por trozos con next_chunk(), guardando tras cada trozo el progreso
+y la URI de la sesión resumable. Si un trozo falla se reintenta con espera
+exponencial desde lo que Google ya recibió (hasta `max_attempts` fallos
+seguidos), y si el proceso muere otro proceso retoma sus trabajos cuando caduca
+su concesión (lease): pregunta a Google cuántos bytes recibió en esa sesión y
+sigue desde ahí. Cada worker lo comprueba en un hilo cada
+`maintenance_interval` segundos, aunque nadie suba ni consulte nada.
+
+Cada trabajo guarda las credenciales OAuth del usuario hasta que termina; la
+base de datos y los ficheros se crean solo para el usuario del proceso (ver
+private_files.py) y las de los trabajos abandonados se borran cuando caducan
+(`retention` segundos sin progreso).
+"""
+import json
+import os
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+from private_files import private_directory, private_file
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+ACTIVE_STATUSES = ('queued', 'uploading')
+LEASE_SECONDS = 300
+
+
+class JobStore(object):
+    """Estado de los trabajos en una base de datos SQLite compartida por todos los workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        private_directory(os.path.dirname(os.path.abspath(path)))
+        private_file(path)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL, file_path TEXT NOT NULL, '
+            'filename TEXT, mimetype TEXT, total_bytes INTEGER NOT NULL, bytes_sent INTEGER NOT NULL DEFAULT 0, '
+            'credentials TEXT, resumable_uri TEXT, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, '
+            'lease_owner TEXT, lease_until REAL NOT NULL DEFAULT 0, created REAL NOT NULL, updated REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # Una conexión abierta antes del fork (preload_app) no se comparte con el worker
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def create(self, **fields):
+        fields['created'] = fields['updated'] = time.time()
+        self._connection().execute(
+            'INSERT INTO jobs ({}) VALUES ({})'.format(', '.join(fields), ', '.join('?' * len(fields))),
+            tuple(fields.values()))
+
+    def get(self, job_id):
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        self._connection().execute(
+            'UPDATE jobs SET {} WHERE id = ?'.format(', '.join('{} = ?'.format(name) for name in fields)),
+            tuple(fields.values()) + (job_id,))
+
+    def claim(self, job_id, lease_owner):
+        """Toma el trabajo si sigue activo y es nuestro o su concesión ha caducado."""
+        now = time.time()
+        cursor = self._connection().execute(
+            'UPDATE jobs SET lease_owner = ?, lease_until = ? WHERE id = ? AND status IN (?, ?) '
+            'AND (lease_owner = ? OR lease_until < ?)',
+            (lease_owner, now + LEASE_SECONDS, job_id) + ACTIVE_STATUSES + (lease_owner, now))
+        return cursor.rowcount == 1
+
+    def renew(self, lease_owner):
+        """Renueva la concesión de todos los trabajos activos de un proceso."""
+        self._connection().execute(
+            'UPDATE jobs SET lease_until = ? WHERE lease_owner = ? AND status IN (?, ?)',
+            (time.time() + LEASE_SECONDS, lease_owner) + ACTIVE_STATUSES)
+
+    def stale(self):
+        """IDs de los trabajos activos cuya concesión ha caducado (su proceso murió)."""
+        rows = self._connection().execute(
+            'SELECT id FROM jobs WHERE status IN (?, ?) AND lease_until < ?', ACTIVE_STATUSES + (time.time(),))
+        return [row[0] for row in rows]
+
+    def expire(self, before, error):
+        """
+        Da por fallidos los trabajos activos sin progreso desde `before` y borra
+        sus credenciales. Devuelve las rutas de sus ficheros.
+        """
+        connection = self._connection()
+        rows = connection.execute(
+            'SELECT file_path FROM jobs WHERE status IN (?, ?) AND updated < ?', ACTIVE_STATUSES + (before,))
+        paths = [row[0] for row in rows]
+        connection.execute(
+            "UPDATE jobs SET status = 'error', error = ?, credentials = NULL, resumable_uri = NULL, updated = ? "
+            'WHERE status IN (?, ?) AND updated < ?', (error, time.time()) + ACTIVE_STATUSES + (before,))
+        return paths
+
+    def sweep(self, before):
+        self._connection().execute(
+            'DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated < ?', ACTIVE_STATUSES + (before,))
+
+
+class UploadJobQueue(object):
+    """
+    Trabajos de subida ejecutados por `workers` hilos de este proceso.
+
+    `start_request(service, media)` crea la petición de subida (p. ej.
+    videos().insert), `describe_result(response)` y `describe_error(exception)`
+    convierten la respuesta o el error final en lo que verá el cliente.
+    """
+
+    def __init__(self, store, directory, service_pool, api, start_request, describe_result, describe_error,
+                 workers=2, chunk_size=8 * 1024 * 1024, max_attempts=5, retention=24 * 3600,
+                 maintenance_interval=60):
+        self.store = store
+        self.directory = directory
+        self.service_pool = service_pool
+        self.api = api  # (nombre, versión) del servicio de Google
+        self.start_request = start_request
+        self.describe_result = describe_result
+        self.describe_error = describe_error
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.maintenance_interval = maintenance_interval
+        self.workers = workers
+        self._lease_owner = None
+        self._lease_pid = None
+        self._executor = None
+        self._executor_pid = None
+        self._last_maintenance = 0.0
+        self._timer_pid = None
+        self._lock = threading.Lock()
+        private_directory(directory)
+
+    @property
+    def lease_owner(self):
+        """Identificador de este proceso; cada worker tras el fork tiene el suyo."""
+        if self._lease_pid != os.getpid():
+            self._lease_owner = secrets.token_hex(8)
+            self._lease_pid = os.getpid()
+        return self._lease_owner
+
+    def _pool(self):
+        # Se crea en el primer uso, ya dentro del worker de gunicorn
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='upload-job')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, owner, credentials_info, file):
+        """Guarda el fichero del formulario y encola su subida. Devuelve el ID del trabajo."""
+        job_id = secrets.token_urlsafe(12)
+        file_path = os.path.join(self.directory, job_id)
+        file.save(file_path)
+        self.store.create(
+            id=job_id, owner=owner, status='queued', file_path=file_path, filename=file.filename,
+            mimetype=file.mimetype, total_bytes=os.path.getsize(file_path),
+            credentials=json.dumps(credentials_info), lease_owner=self.lease_owner,
+            lease_until=time.time() + LEASE_SECONDS)
+        self._pool().submit(self._run, job_id)
+        self.maintenance()
+        return job_id
+
+    def status(self, job_id, owner):
+        """Estado público de un trabajo, o None si no existe o es de otra cuenta."""
+        job = self.store.get(job_id)
+        if job is None or job['owner'] != owner:
+            return None
+        status = {
+            'id': job['id'],
+            'status': job['status'],
+            'filename': job['filename'],
+            'bytesSent': job['bytes_sent'],
+            'totalBytes': job['total_bytes'],
+            'progress': round(100.0 * job['bytes_sent'] / job['total_bytes'], 1) if job['total_bytes'] else 0.0,
+            'attempts': job['attempts'],
+        }
+        if job['result']:
+            status.update(json.loads(job['result']))
+        if job['error']:
+            status['error'] = job['error']
+        return status
+
+    def maintenance(self, force=False):
+        """Retoma los trabajos de procesos muertos y borra los terminados antiguos."""
+        self._start_timer()
+        now = time.time()
+        if not force and now - self._last_maintenance < LEASE_SECONDS:
+            return
+        self._last_maintenance = now
+        for file_path in self.store.expire(now - self.retention, 'La subida se interrumpió y no se pudo completar.'):
+            _remove(file_path)
+        for job_id in self.store.stale():
+            if self.store.claim(job_id, self.lease_owner):
+                print("Resuming upload job {}".format(job_id))
+                self._pool().submit(self._run, job_id)
+        self.store.sweep(now - self.retention)
+
+    def _start_timer(self):
+        # Un hilo por worker (se comprueba el pid: el del proceso maestro no pasa el fork)
+        with self._lock:
+            if self._timer_pid == os.getpid():
+                return
+            self._timer_pid = os.getpid()
+        threading.Thread(target=self._maintenance_loop, name='upload-job-maintenance', daemon=True).start()
+
+    def _maintenance_loop(self):
+        while True:
+            time.sleep(self.maintenance_interval)
+            try:
+                self.maintenance(force=True)
+            except Exception as e:
+                print("Error in upload job maintenance: {}".format(e))
+
+    def _run(self, job_id):
+        if not self.store.claim(job_id, self.lease_owner):
+            return
+        job = self.store.get(job_id)
+        service = None
+        try:
+            service = self.service_pool.get(self.api[0], self.api[1], json.loads(job['credentials']))
+            response = self._upload(job, service)
+            self._finish(job, result=self.describe_result(response))
+        except Exception as e:
+            print("Error in upload job {}: {}".format(job_id, e))
+            self._finish(job, error=self.describe_error(e))
+        finally:
+            if service is not None:
+                self.service_pool.release(service)
+
+    def _upload(self, job, service):
+        # Importados aquí: solo los necesita el hilo que sube, no el arranque del worker
+        import httplib2
+        from googleapiclient.http import MediaIoBaseUpload
+        with open(job['file_path'], 'rb') as f:
+            media = MediaIoBaseUpload(f, mimetype=job['mimetype'], chunksize=self.chunk_size, resumable=True)
+            request = self.start_request(service, media)
+            response = None
+            if job['resumable_uri']:
+                # Trabajo retomado: se pregunta a Google cuánto recibió antes de seguir
+                response = self._resume(request, job['resumable_uri'], job['total_bytes'])
+            self.store.update(job['id'], status='uploading')
+
+            # Fallos seguidos del trozo actual (se reinicia con cada trozo enviado) y total del trabajo
+            failures = 0
+            attempts = job['attempts']
+            while response is None:
+                try:
+                    progress, response = request.next_chunk()
+                except (HttpError, httplib2.HttpLib2Error, OSError) as e:
+                    expired = isinstance(e, HttpError) and e.resp.status == 404 and request.resumable_uri is not None
+                    if not (expired or self._retryable(e)) or failures >= self.max_attempts:
+                        raise
+                    failures += 1
+                    attempts += 1
+                    print("Upload job {} failed ({}), retry {} of {}".format(job['id'], e, failures, self.max_attempts))
+                    self.store.update(job['id'], attempts=attempts)
+                    time.sleep(min(2 ** failures, 64) * (0.5 + random.random() / 2))
+                    if expired:
+                        # La sesión resumable caducó: se vuelve a empezar desde cero con una petición nueva
+                        request = self.start_request(service, media)
+                        self.store.update(job['id'], bytes_sent=0, resumable_uri=None)
+                    # Si no, next_chunk() pregunta a Google cuánto recibió y sigue desde ahí
+                    continue
+                failures = 0
+                if progress:
+                    self.store.update(job['id'], bytes_sent=progress.resumable_progress,
+                                      resumable_uri=request.resumable_uri)
+                    self.store.renew(self.lease_owner)
+            return response
+
+    def _resume(self, request, resumable_uri, total_bytes):
+        """
+        Continúa en `request` (recién creada) la sesión resumable `resumable_uri`:
+        un PUT vacío con "Content-Range: bytes */total" devuelve cuánto recibió
+        Google (308 y la cabecera Range) o la respuesta final si ya terminó. Si la
+        sesión caducó (404 o 410) la subida empieza de nuevo.
+        """
+        resp, content = request.http.request(resumable_uri, 'PUT', headers={
+            'Content-Range': 'bytes */{}'.format(total_bytes), 'Content-Length': '0'})
+        if resp.status in (200, 201):
+            return request.postproc(resp, content)
+        if resp.status == 308:
+            request.resumable_uri = resp.get('location', resumable_uri)
+            request.resumable_progress = int(resp['range'].split('-')[1]) + 1 if 'range' in resp else 0
+            return None
+        if resp.status in (404, 410):
+            return None
+        raise HttpError(resp, content, uri=resumable_uri)
+
+    def _retryable(self, exception):
+        if not isinstance(exception, HttpError):
+            return True  # Error de red: next_chunk() reanuda la sesión
+        return exception.resp.status in RETRYABLE_STATUSES
+
+    def _finish(self, job, result=None, error=None):
+        fields = {'status': 'error' if error else 'done', 'credentials': None, 'resumable_uri': None}
+        if result is not None:
+            fields['result'] = json.dumps(result)
+            fields['bytes_sent'] = job['total_bytes']
+        if error is not None:
+            fields['error'] = error
+        self.store.update(job['id'], **fields)
+        _remove(job['file_path'])
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass